@@ -7,16 +7,21 @@ import matplotlib.pyplot as plt
 import numpy as np
 logging.disable(logging.DEBUG)
 from typing import Dict
-from utils import tune_libcachesim, write_to_file, miss_ratio_reduction
+from utils import get_engine, get_stored_engine, tune_libcachesim, miss_ratio_reduction, get_libcachesim_cost, libcachesim_params_to_str, plot_mr
 from Simulator import SimulatorCache, SimulatorConfig
 from cache import CacheConfig, Trace
+from WarmStarter import PriorResult, WarmStarter
+from JointTuner import JointTuner
+from ResultStore import ResultStore
 
 class MissRatioInfo:
-    def __init__(self, default_mr: float, default_params: Dict, tuned_mr: float, tuned_params: Dict):
+    def __init__(self, default_mr: float, default_params: Dict, tuned_mr: float, tuned_params: Dict, default_cost: Dict=None, tuned_cost: Dict=None):
         self.default_mr = default_mr
         self.default_params = default_params
         self.tuned_mr = tuned_mr
         self.tuned_params = tuned_params
+        self.default_cost = default_cost # see `Telemetry.make_cost`; `None` if unknown
+        self.tuned_cost = tuned_cost
         assert default_mr >= 0 and default_mr <= 1
         assert tuned_mr >= 0 and tuned_mr <= 1
 
@@ -25,21 +30,26 @@ class MissRatioInfo:
             "default_mr": self.default_mr,
             "tuned_mr": self.tuned_mr,
             "default_params": self.default_params,
-            "tuned_params": self.tuned_params
+            "tuned_params": self.tuned_params,
+            "default_cost": self.default_cost,
+            "tuned_cost": self.tuned_cost
         }
 
 class AnalyzerEntry:
-    def __init__(self, trace_path: str, cache_cap: int, cache_cap_frac: float, algo: str, is_sota: bool, default_mr: float, tuned_mr: float, default_params: dict, tuned_params: dict):
+    def __init__(self, trace_path: str, cache_cap: int, cache_cap_frac: float, algo: str, is_sota: bool, default_mr: float, tuned_mr: float, default_params: dict, tuned_params: dict, default_cost: dict=None, tuned_cost: dict=None, engine: str=None):
         self.trace_path = trace_path
         self.cache_cap = cache_cap
         self.cache_cap_frac = cache_cap_frac
         self.algo = algo
         self.is_sota = is_sota
+        self.engine = engine if engine != None else get_engine(algo, is_sota) # see `utils.get_engine`
         self.miss_ratio_info = MissRatioInfo(
             default_mr=default_mr,
             default_params=default_params,
             tuned_mr=tuned_mr,
-            tuned_params=tuned_params
+            tuned_params=tuned_params,
+            default_cost=default_cost,
+            tuned_cost=tuned_cost
         )
 
     @property
@@ -53,6 +63,18 @@ class AnalyzerEntry:
             self.cache_cap_frac,
             self.algo
         )
+
+    @property
+    def store_columns(self):
+        '''
+        The key columns in `ResultStore`, i.e., the signature and the engine.
+        '''
+        return {
+            "algo": self.algo,
+            "cache_cap_frac": self.cache_cap_frac,
+            "engine": self.engine,
+            "trace": os.path.basename(self.trace_path)
+        }
     
     @classmethod
     def from_dict(cls, trace_analysis_entry_dict):
@@ -65,7 +87,10 @@ class AnalyzerEntry:
             default_mr=trace_analysis_entry_dict["default_mr"],
             tuned_mr=trace_analysis_entry_dict["tuned_mr"],
             default_params=trace_analysis_entry_dict["default_params"],
-            tuned_params=trace_analysis_entry_dict["tuned_params"]
+            tuned_params=trace_analysis_entry_dict["tuned_params"],
+            default_cost=trace_analysis_entry_dict.get("default_cost", None),
+            tuned_cost=trace_analysis_entry_dict.get("tuned_cost", None),
+            engine=get_stored_engine(trace_analysis_entry_dict)
         )
 
     @classmethod
@@ -80,6 +105,7 @@ class AnalyzerEntry:
             "cache_cap_frac": self.cache_cap_frac,
             "algo": self.algo,
             "is_sota": self.is_sota,
+            "engine": self.engine,
         }
         trace_analysis_entry_dict.update(self.miss_ratio_info.to_dict())
         return trace_analysis_entry_dict
@@ -92,9 +118,9 @@ class Analyzer:
     trace_analysis_folder = "/home/v-ruiyingma/llm4sys/cache/trace_analysis"
     miss_ratio_jsonl_path = os.path.join(trace_analysis_folder, "miss_ratio.jsonl")
     def __init__(self):
-        with open(self.miss_ratio_jsonl_path, 'r') as file:
-            file_lines = file.readlines()
-        self.entries = [AnalyzerEntry.from_jsonl(l) for l in file_lines]
+        self.store = ResultStore.default()
+        # the results of the legacy JSONL file are stored once
+        self.store.import_jsonl("miss_ratio", self.miss_ratio_jsonl_path, lambda d: AnalyzerEntry.from_dict(d).store_columns)
 
     def get_trace_ndv(self, trace_path, range_s=None, range_e=None):
         trace = Trace(
@@ -103,18 +129,34 @@ class Analyzer:
         )
         return trace.get_ndv(range_s=range_s, range_e=range_e)
     
-    def _get_candid_entries(self, trace_filter, cache_cap_frac_filter, algo_filter):
-        def entry_filter(entry: AnalyzerEntry):
-            if trace_filter(entry.trace_path) == False:
-                return False
-            if cache_cap_frac_filter(entry.cache_cap_frac) == False:
-                return False
-            if algo_filter(entry.algo) == False:
-                return False
-            return True
-        return [e for e in self.entries if entry_filter(e) == True]
+    def _get_candid_entries(self, algo=None, cache_cap_frac: float=None, trace_path_list: list=None, trace_filter=None, engine: str=None):
+        '''
+        Indexed lookup in the result store: `algo` (and `engine`, see `utils.get_engine`) may be a name or a list of names, and `None` matches anything.
+        - trace_path_list (list): the traces to match, by basename
+        - trace_filter (func): trace_path -> True/False, applied on the matching entries
+        '''
+        entries = [AnalyzerEntry.from_dict(d) for d in self.store.find(
+            "miss_ratio",
+            algo=algo,
+            cache_cap_frac=cache_cap_frac,
+            engine=engine,
+            trace=[os.path.basename(t) for t in trace_path_list] if trace_path_list != None else None
+        )]
+        if trace_filter != None:
+            entries = [e for e in entries if trace_filter(e.trace_path) == True]
+        return entries
+
+    def get_prior_results(self, algo: str, cache_cap_frac: float):
+        '''
+        The default and tuned observations of `algo` on every analyzed trace, for `WarmStarter`.
+        '''
+        prior_results = []
+        for entry in self._get_candid_entries(algo=algo, cache_cap_frac=cache_cap_frac):
+            prior_results.append(PriorResult(entry.trace_path, entry.miss_ratio_info.default_params, entry.miss_ratio_info.default_mr))
+            prior_results.append(PriorResult(entry.trace_path, entry.miss_ratio_info.tuned_params, entry.miss_ratio_info.tuned_mr))
+        return prior_results
     
-    def simulate(self, trace_path: str, cache_cap_frac: float, algo: str, is_sota: bool):
+    def simulate(self, trace_path: str, cache_cap_frac: float, algo: str, is_sota: bool, warm_start: bool=False):
         '''
         Args:
         - trace_path (str): absolute path to the trace
@@ -123,6 +165,7 @@ class Analyzer:
             - if `is_sota` == True, this is the sota algorithm name
             - else, this is the absolute path to the code
         - is_sota (bool): whether this is sota algorithm that can be simulated by libcachesim
+        - warm_start (bool): seed the tuning with the tuned params of `algo` on the most similar analyzed traces
         '''
         assert os.path.exists(trace_path)
         if not is_sota == True:
@@ -131,11 +174,7 @@ class Analyzer:
         # algo_name = algo if is_sota == True else os.path.basename(algo).replace(".py", "")
         algo_name = algo
 
-        candid_entries = self._get_candid_entries(
-            trace_filter=lambda p: os.path.basename(p) == os.path.basename(trace_path),
-            cache_cap_frac_filter=lambda ccf: ccf == cache_cap_frac,
-            algo_filter=lambda alg: alg == algo
-        )
+        candid_entries = self._get_candid_entries(algo=algo, cache_cap_frac=cache_cap_frac, trace_path_list=[trace_path], engine=get_engine(algo, is_sota))
         if len(candid_entries) > 0:
             assert len(candid_entries) == 1
             logging.info(f"({trace_path}, {algo}, {cache_cap_frac}) has already been simulated")
@@ -146,13 +185,23 @@ class Analyzer:
         if cache_cap < 1:
             cache_cap = 1
 
+        warm_starter = None
+        if warm_start == True:
+            warm_starter = WarmStarter(self.get_prior_results(algo, cache_cap_frac))
+
         if is_sota == True:
             miss_ratio_info_tuple = tune_libcachesim(
                 trace=trace_path,
                 alg=algo,
                 cache_cap=cache_cap,
+                warm_starter=warm_starter,
             )
             assert miss_ratio_info_tuple != None
+            # the costs are memoized with the miss ratios of the runs
+            default_cost = get_libcachesim_cost(trace_path, algo, cache_cap)
+            tuned_cost = default_cost
+            if miss_ratio_info_tuple[3] != miss_ratio_info_tuple[2]:
+                tuned_cost = get_libcachesim_cost(trace_path, algo, cache_cap, " -e " + libcachesim_params_to_str(algo, miss_ratio_info_tuple[3]))
             entry = AnalyzerEntry(
                 trace_path=trace_path,
                 cache_cap=cache_cap,
@@ -162,7 +211,9 @@ class Analyzer:
                 default_mr=miss_ratio_info_tuple[0],
                 tuned_mr=miss_ratio_info_tuple[1],
                 default_params=miss_ratio_info_tuple[2],
-                tuned_params=miss_ratio_info_tuple[3]
+                tuned_params=miss_ratio_info_tuple[3],
+                default_cost=default_cost,
+                tuned_cost=tuned_cost
             )
         else: 
             simulator = SimulatorCache(
@@ -197,15 +248,21 @@ class Analyzer:
                 need_save=False,
             )
             assert default_mr != None
+            default_cost = simulator.last_run_cost
             tuned_mr, default_params, tuned_params = simulator.tune(
                 code=code,
                 code_id=code_id,
                 fixed_default_param=False,
-                need_log=True
+                need_log=True,
+                warm_starter=warm_starter
             )
+            tuned_cost = default_cost
             if tuned_mr == None or tuned_mr > default_mr:
                 tuned_mr = default_mr
                 tuned_params = default_params
+            elif tuned_params != default_params:
+                tuned_cost = simulator.get_cost(code, tuned_params)
+            simulator.close()
             entry = AnalyzerEntry(
                 trace_path=trace_path,
                 cache_cap=cache_cap,
@@ -215,77 +272,75 @@ class Analyzer:
                 default_mr=default_mr,
                 tuned_mr=tuned_mr,
                 default_params=default_params,
-                tuned_params=tuned_params
+                tuned_params=tuned_params,
+                default_cost=default_cost,
+                tuned_cost=tuned_cost
             )
         
-        self.entries.append(entry)
-        write_to_file(
-            dest_path=self.miss_ratio_jsonl_path,
-            contents=entry.to_jsonl() + "\n",
-            is_append=True,
-            is_json=False
-        )
+        self.store.put("miss_ratio", entry.store_columns, entry.to_dict())
         return entry
     
-    def _plot(self, m_algo_mr: dict, png_path):
-        markers = itertools.cycle("<^osv>v*p")
-        colors = itertools.cycle(
-            reversed(["#b2182b", "#ef8a62", "#fddbc7", "#d1e5f0", "#67a9cf", "#2166ac"])
-        )
-        algo_list = list(m_algo_mr.keys())
-        assert "fifo" not in algo_list
-        # plot
-        plt.figure(figsize=(28, 8))
-        percentiles = [10, 25, 50, 75, 90]
-        # algo_list.remove("fifo")
-        for perc in percentiles:
-            y = [np.percentile(m_algo_mr[algo], perc) for algo in algo_list]
-            plt.scatter(range(len(y)), y, label=f"P{perc}", marker=next(markers), color=next(colors), s=480)
-            if perc == 50:
-                # Mean
-                y = [np.mean(m_algo_mr[algo]) for algo in algo_list]
-                plt.scatter(range(len(y)), y, label="Mean", marker=next(markers), color=next(colors), s=480)
-        if plt.ylim()[0] < -0.1:
-            plt.ylim(bottom=-0.04)
-        plt.xticks(range(len(algo_list)), [os.path.basename(a).replace(".py", "") for a in algo_list], fontsize=32, rotation=90)
-        plt.ylabel(f"Miss ratio reduction from FIFO")
-        plt.grid(linestyle="--")
-        plt.legend(
-            ncol=8,
-            loc="upper left",
-            fontsize=38,
-            bbox_to_anchor=(-0.02, 1.2),
-            frameon=False,
-        )
-        plt.savefig(png_path, bbox_inches="tight")
-        plt.clf()
+    def simulate_joint(self, trace_path_list, cache_cap_frac: float, algo: str, is_sota: bool, aggregate="mean", sample_rate: float=1.0, num_processes: int=None):
+        '''
+        Tune one parameter set of `algo` for all the traces (see `JointTuner`) instead of one per trace. The result is not stored in the result store.
+        - aggregate ("mean" | float): the objective is the mean or this percentile of the miss ratio reduction over the traces
+        - sample_rate (float): run the trials on spatially sampled traces
+        Return: JointTuningResult | `None` if `algo` has no tunable parameters
+        '''
+        for trace_path in trace_path_list:
+            assert os.path.exists(trace_path)
+        if not is_sota == True:
+            assert os.path.exists(algo)
+        cache_cap_list = [max(int(self.get_trace_ndv(trace_path) * cache_cap_frac), 1) for trace_path in trace_path_list]
+        logging.info(f"Jointly tuning ({algo}, {len(trace_path_list)} traces, {cache_cap_frac})...")
+        return JointTuner(
+            algo=algo,
+            is_sota=is_sota,
+            trace_path_list=trace_path_list,
+            cache_cap_list=cache_cap_list,
+            aggregate=aggregate,
+            sample_rate=sample_rate,
+            num_processes=num_processes
+        ).tune()
 
+    def _plot(self, m_algo_mr: dict, png_path, m_algo_cost: dict=None, rank_by: str=None, max_cost: dict=None):
+        '''
+        See `utils.plot_mr`.
+        '''
+        plot_mr(m_algo_mr, png_path, m_algo_cost=m_algo_cost, rank_by=rank_by, max_cost=max_cost)
 
-    def plot_miss_ratio_percentile(self, trace_filter, algo_list: list, cache_cap_frac: float, png_path: str, use_default: bool):
+    def plot_miss_ratio_percentile(self, trace_filter, algo_list: list, cache_cap_frac: float, png_path: str, use_default: bool, rank_by: str=None, max_cost: dict=None):
         '''
         Args:
         - trace_filter (func):
             - input: trace_path (str)
             - output: True/False
+        - rank_by, max_cost: rank or filter the algorithms by miss ratio or by cost, see `utils.plot_mr`
+        Only the entries of the engine that currently runs each algorithm are plotted (see `utils.get_engine`).
         '''
         if "fifo" not in algo_list:
             algo_list.append("fifo")
 
         # load
-        candid_entries = [e for e in self.entries if e.algo in algo_list and e.cache_cap_frac == cache_cap_frac and trace_filter(e.trace_path) == True]
+        candid_entries = self._get_candid_entries(algo=algo_list, cache_cap_frac=cache_cap_frac, trace_filter=trace_filter)
+        candid_entries = [e for e in candid_entries if e.engine == get_engine(e.algo, e.is_sota)]
         m_algo_entry = {
             algo: sorted([e for e in candid_entries if e.algo == algo], key=lambda e: e.trace_path)
             for algo in algo_list
         }
         m_algo_mr = dict()
+        m_algo_cost = dict()
         for algo in m_algo_entry:
             if algo == "fifo":
                 continue
             assert list([os.path.basename(e.trace_path) for e in m_algo_entry[algo]]) == list([os.path.basename(e.trace_path) for e in m_algo_entry["fifo"]])
             m_algo_mr[algo] = list()
+            m_algo_cost[algo] = list()
             for e, fifo_e in zip(m_algo_entry[algo], m_algo_entry["fifo"]):
                 if use_default == False:
                     m_algo_mr[algo].append(miss_ratio_reduction(e.miss_ratio_info.tuned_mr, fifo_e.miss_ratio_info.tuned_mr))
+                    m_algo_cost[algo].append(e.miss_ratio_info.tuned_cost)
                 else:
                     m_algo_mr[algo].append(miss_ratio_reduction(e.miss_ratio_info.default_mr, fifo_e.miss_ratio_info.default_mr))
-        self._plot(m_algo_mr, png_path)
\ No newline at end of file
+                    m_algo_cost[algo].append(e.miss_ratio_info.default_cost)
+        self._plot(m_algo_mr, png_path, m_algo_cost=m_algo_cost, rank_by=rank_by, max_cost=max_cost)
\ No newline at end of file
@@ -1,10 +1,11 @@
 import os
 import json
 from Simulator import SimulatorCache, SimulatorConfig
-from cache import CacheConfig, Trace
+from cache import CacheConfig, Trace, SharedTraceStore
 from Analyzer import Analyzer, AnalyzerEntry
-from utils import write_to_file, run_libcachesim, miss_ratio_reduction
-from multiprocessing import Pool
+from utils import run_libcachesim_many, miss_ratio_reduction, get_libcachesim_cost
+from ResultStore import ResultStore, hash_params
+from Scheduler import map_scheduled, estimate_cost
 import logging
 import logging_config
 import numpy as np
@@ -23,6 +24,10 @@ def cross_validate_simulate(simulator: SimulatorCache):
         default_params=None,
     )
 
+def cross_validate_simulate_lockstep(args):
+    simulator, code_list = args
+    return simulator.simulate_lockstep(code_list)
+
 
 class CrossValidatorEntry:
     def __init__(
@@ -35,6 +40,7 @@ class CrossValidatorEntry:
             trace_path: str, 
             cache_cap: int, 
             cache_cap_frac: float,
+            cost: dict=None,
         ):
         self.algo = algo
         self.is_sota = is_sota
@@ -43,6 +49,7 @@ class CrossValidatorEntry:
         self.trace_path = trace_path
         self.cache_cap = cache_cap
         self.cache_cap_frac = cache_cap_frac
+        self.cost = cost # see `Telemetry.make_cost`; `None` if unknown
 
     @property
     def signature(self):
@@ -55,6 +62,18 @@ class CrossValidatorEntry:
             self.algo,
             self.params,
         )
+
+    @property
+    def store_columns(self):
+        '''
+        The key columns in `ResultStore`, i.e., the signature.
+        '''
+        return {
+            "algo": self.algo,
+            "cache_cap_frac": self.cache_cap_frac,
+            "params_hash": hash_params(self.params),
+            "trace": os.path.basename(self.trace_path)
+        }
     
     @classmethod
     def from_dict(cls, trace_cross_validate_entry_dict):
@@ -66,6 +85,7 @@ class CrossValidatorEntry:
             trace_path=trace_cross_validate_entry_dict["trace_path"],
             cache_cap=trace_cross_validate_entry_dict["cache_cap"],
             cache_cap_frac=trace_cross_validate_entry_dict["cache_cap_frac"],
+            cost=trace_cross_validate_entry_dict.get("cost", None),
         )
     
     @classmethod
@@ -80,7 +100,8 @@ class CrossValidatorEntry:
             "mr": self.mr,
             "trace_path": self.trace_path,
             "cache_cap": self.cache_cap,
-            "cache_cap_frac": self.cache_cap_frac
+            "cache_cap_frac": self.cache_cap_frac,
+            "cost": self.cost
         }
     
     def to_jsonl(self):
@@ -91,10 +112,11 @@ class CrossValidator:
     cross_validate_jsonl_path = os.path.join(Analyzer.trace_analysis_folder, "cross_validate.jsonl")
 
     def __init__(self):
-        with open(self.cross_validate_jsonl_path, 'r') as file:
-            file_lines = file.readlines()
-        self.cross_validate_entries = [CrossValidatorEntry.from_jsonl(l) for l in file_lines]
         self.trace_analyzer = Analyzer()
+        self.store = self.trace_analyzer.store
+        # the results of the legacy JSONL file are stored once
+        self.store.import_jsonl("cross_validate", self.cross_validate_jsonl_path, lambda d: CrossValidatorEntry.from_dict(d).store_columns)
+        self.shared_traces = SharedTraceStore() # the pool workers attach to the decoded traces instead of decoding their own copies
 
     def _params_dict_to_str(self, params: dict):
         params_str = ""
@@ -104,49 +126,49 @@ class CrossValidator:
             params_str += f"{key}={value}"
         return params_str
     
-    def _get_candid_entries(self, filter_trace_path, filter_cache_cap_frac, filter_algo, filter_params):
+    def _get_candid_entries(self, algo: str, cache_cap_frac: float, params: dict, trace_path_list: list=None, trace_filter=None):
         '''
-        Retrieved from cross_validate_entries
+        Indexed lookup of the cross validation entries of (algo, cache_cap_frac, params).
+        - trace_path_list (list): the traces to match, by basename; `None` matches any
+        - trace_filter (func): trace_path -> True/False, applied on the matching entries
         '''
-        def filter_entry(entry: CrossValidatorEntry):
-            if filter_trace_path(entry.trace_path) == False:
-                return False
-            if filter_cache_cap_frac(entry.cache_cap_frac) == False:
-                return False
-            if filter_algo(entry.algo) == False:
-                return False
-            if filter_params(entry.params) == False:
-                return False
-            return True
-        return [e for e in self.cross_validate_entries if filter_entry(e) == True]
+        entries = [CrossValidatorEntry.from_dict(d) for d in self.store.find(
+            "cross_validate",
+            algo=algo,
+            cache_cap_frac=cache_cap_frac,
+            params_hash=hash_params(params),
+            trace=[os.path.basename(t) for t in trace_path_list] if trace_path_list != None else None
+        )]
+        if trace_filter != None:
+            entries = [e for e in entries if trace_filter(e.trace_path) == True]
+        return entries
 
-    def _get_candid_params(self, filter_trace_path, filter_cache_cap_frac, filter_algo):
+    def _get_candid_params(self, algo: str, cache_cap_frac: float, trace_path_list: list=None, trace_filter=None):
         '''
-        Retrieved from miss_ratio_entries.
+        Retrieved from the miss ratio entries.
         '''
         candid_miss_ratio_entries = self.trace_analyzer._get_candid_entries(
-            trace_filter=filter_trace_path,
-            cache_cap_frac_filter=filter_cache_cap_frac,
-            algo_filter=filter_algo
+            algo=algo,
+            cache_cap_frac=cache_cap_frac,
+            trace_path_list=trace_path_list,
+            trace_filter=trace_filter
         )
         candid_params_str = set([json.dumps(e.miss_ratio_info.tuned_params) for e in candid_miss_ratio_entries])
         if len(candid_miss_ratio_entries) > 0:
             candid_params_str.add(json.dumps(candid_miss_ratio_entries[0].miss_ratio_info.default_params))
         return [dict(json.loads(ps)) if ps != "null" else None for ps in candid_params_str]
 
-    def _add_entry(self, new_entry: CrossValidatorEntry):
-        self.cross_validate_entries.append(new_entry)
-        write_to_file(
-            dest_path=self.cross_validate_jsonl_path,
-            contents=new_entry.to_jsonl() + "\n",
-            is_append=True,
-            is_json=False
-        )
+    def _add_entries(self, new_entries: list):
+        '''
+        Stored in one transaction.
+        '''
+        self.store.put_many("cross_validate", [(e.store_columns, e.to_dict()) for e in new_entries])
 
     def _get_simulator(self, trace_path_list: list, cache_cap_frac: float):
         trace_cap_list = []
         for trace_path in trace_path_list:
             trace = Trace(trace_path, True)
+            self.shared_traces.publish(trace_path, trace)
             cap = int(trace.get_ndv() * cache_cap_frac)
             if cap < 1:
                 cap = 1
@@ -175,7 +197,7 @@ class CrossValidator:
 
         return simulator_list
 
-    def _simulate(
+    def _get_pending_trace_paths(
             self, 
             algo: str, # algo: if sota, algo_name; else, code_path
             is_sota: bool,
@@ -183,59 +205,65 @@ class CrossValidator:
             trace_path_list: list, 
             cache_cap_frac: float,
         ):
-        logging.info(f"Simulating {(algo, params)}")
-        if is_sota == False:
-            assert os.path.exists(algo)
-
-        # check cross_validate_entries
-        cross_validate_entries = self._get_candid_entries(
-            filter_trace_path=lambda p: os.path.basename(p) in [os.path.basename(t) for t in trace_path_list],
-            filter_cache_cap_frac=lambda ccf: ccf == cache_cap_frac,
-            filter_algo=lambda alg: alg == algo,
-            filter_params=lambda p: p == params
-        )
+        '''
+        Reuse the cross validation and miss ratio entries.
+        Return: the traces on which (algo, params) still needs to be simulated
+        '''
+        # check cross validation entries
+        cross_validate_entries = self._get_candid_entries(algo, cache_cap_frac, params, trace_path_list=trace_path_list)
         for trace_path in [e.trace_path for e in cross_validate_entries]:
-            logging.info(f"\t{(algo, params, trace_path, cache_cap_frac)} already existed in cross_validate.jsonl")
+            logging.info(f"\t{(algo, params, trace_path, cache_cap_frac)} already cross validated")
 
-        first_cleaned_trace_path_list = [t for t in trace_path_list if os.path.basename(t) not in [os.path.basename(e.trace_path) for e in cross_validate_entries]]
+        validated_traces = set([os.path.basename(e.trace_path) for e in cross_validate_entries])
+        first_cleaned_trace_path_list = [t for t in trace_path_list if os.path.basename(t) not in validated_traces]
         if len(first_cleaned_trace_path_list) == 0:
-            return
+            return []
         
-        # check miss_ratio_entries
-        candid_miss_ratio_entries = self.trace_analyzer._get_candid_entries(
-            trace_filter=lambda p: os.path.basename(p) in [os.path.basename(t) for t in first_cleaned_trace_path_list],
-            cache_cap_frac_filter=lambda ccf: ccf == cache_cap_frac,
-            algo_filter=lambda alg: alg == algo
-        )
+        # check miss ratio entries
+        candid_miss_ratio_entries = self.trace_analyzer._get_candid_entries(algo=algo, cache_cap_frac=cache_cap_frac, trace_path_list=first_cleaned_trace_path_list)
         miss_ratio_entries = [e for e in candid_miss_ratio_entries if e.miss_ratio_info.tuned_params == params or e.miss_ratio_info.default_params == params]
+        new_cross_validator_entries = []
         for entry in miss_ratio_entries:
             if entry.miss_ratio_info.tuned_params == params:
-                mr = entry.miss_ratio_info.tuned_mr
+                mr, cost = entry.miss_ratio_info.tuned_mr, entry.miss_ratio_info.tuned_cost
             else:
                 assert entry.miss_ratio_info.default_params == params
-                mr = entry.miss_ratio_info.default_mr
-            new_cross_validator_entry = CrossValidatorEntry(algo=algo, is_sota=is_sota, params=params, mr=mr, trace_path=entry.trace_path, cache_cap=entry.cache_cap, cache_cap_frac=cache_cap_frac)
-            self._add_entry(new_cross_validator_entry)
-            logging.info(f"\t{(algo, params, entry.trace_path, cache_cap_frac)} already existed in miss_ratio.jsonl")
+                mr, cost = entry.miss_ratio_info.default_mr, entry.miss_ratio_info.default_cost
+            new_cross_validator_entries.append(CrossValidatorEntry(algo=algo, is_sota=is_sota, params=params, mr=mr, trace_path=entry.trace_path, cache_cap=entry.cache_cap, cache_cap_frac=cache_cap_frac, cost=cost))
+            logging.info(f"\t{(algo, params, entry.trace_path, cache_cap_frac)} already simulated by Analyzer")
+        self._add_entries(new_cross_validator_entries)
         
-        cleaned_trace_path_list = [t for t in first_cleaned_trace_path_list if os.path.basename(t) not in [os.path.basename(e.trace_path) for e in miss_ratio_entries]]
+        simulated_traces = set([os.path.basename(e.trace_path) for e in miss_ratio_entries])
+        cleaned_trace_path_list = [t for t in first_cleaned_trace_path_list if os.path.basename(t) not in simulated_traces]
+        return cleaned_trace_path_list
 
+    def _simulate(
+            self, 
+            algo: str, # algo: if sota, algo_name; else, code_path
+            is_sota: bool,
+            params: dict,
+            trace_path_list: list, 
+            cache_cap_frac: float,
+        ):
+        logging.info(f"Simulating {(algo, params)}")
+        if is_sota == False:
+            assert os.path.exists(algo)
+
+        cleaned_trace_path_list = self._get_pending_trace_paths(algo, is_sota, params, trace_path_list, cache_cap_frac)
         if len(cleaned_trace_path_list) == 0:
             return
         
-        
         simulator_list = self._get_simulator(cleaned_trace_path_list, cache_cap_frac)
         # is_sota = True
         if is_sota == True:
-            for sim in simulator_list:
-                mr = run_libcachesim(
-                    cache_trace=sim.config.trace_path,
-                    cache_alg=algo,
-                    cache_cap=sim.config.capacity,
-                    params=self._params_dict_to_str(params)
+            mr_list = run_libcachesim_many([(sim.config.trace_path, algo, sim.config.capacity, self._params_dict_to_str(params)) for sim in simulator_list])
+            self._add_entries([
+                CrossValidatorEntry(
+                    algo=algo, is_sota=is_sota, params=params, mr=mr, trace_path=sim.config.trace_path, cache_cap=sim.config.capacity, cache_cap_frac=cache_cap_frac,
+                    cost=get_libcachesim_cost(sim.config.trace_path, algo, sim.config.capacity, self._params_dict_to_str(params))
                 )
-                new_cross_validator_entry = CrossValidatorEntry(algo=algo, is_sota=is_sota, params=params, mr=mr, trace_path=sim.config.trace_path, cache_cap=sim.config.capacity, cache_cap_frac=cache_cap_frac)
-                self._add_entry(new_cross_validator_entry)
+                for (sim, mr) in zip(simulator_list, mr_list)
+            ])
             return 
 
         # is_sota = False
@@ -244,16 +272,73 @@ class CrossValidator:
         with open(algo, 'r') as file:
             raw_code = file.read()
         assert os.path.exists(copy_dst)
+        code = example_sim._fix_default_param_for_code(raw_code, params)
         with open(copy_dst, 'w') as file:
-            file.write(example_sim._fix_default_param_for_code(raw_code, params))
-        with Pool(len(simulator_list) * 2) as p:
-            mr_list = p.map(cross_validate_simulate, simulator_list)
-        assert len(mr_list) == len(simulator_list)
-        for mr, sim in zip(mr_list, simulator_list):
-            new_cross_validator_entry = CrossValidatorEntry(algo=algo, is_sota=is_sota, params=params, mr=mr, trace_path=sim.config.trace_path, cache_cap=sim.config.capacity, cache_cap_frac=cache_cap_frac)
-            self._add_entry(new_cross_validator_entry)
+            file.write(code)
+        def on_result(sim_id: int, mr):
+            sim = simulator_list[sim_id]
+            # the workers memoized the cost with the miss ratio
+            new_cross_validator_entry = CrossValidatorEntry(algo=algo, is_sota=is_sota, params=params, mr=mr, trace_path=sim.config.trace_path, cache_cap=sim.config.capacity, cache_cap_frac=cache_cap_frac, cost=sim.get_cost(code))
+            self._add_entries([new_cross_validator_entry])
+        map_scheduled(
+            cross_validate_simulate,
+            simulator_list,
+            [estimate_cost(sim.config.trace_path, sim.config.capacity) for sim in simulator_list],
+            on_result=on_result
+        )
 
-    def plot_miss_ratio_percentile(self, trace_filter, algo_list: list, cache_cap_frac: float, png_path: str):
+    def _simulate_lockstep(
+            self,
+            algo: str, # code_path
+            params_list: list,
+            trace_path_list: list,
+            cache_cap_frac: float,
+        ):
+        '''
+        Simulate the params × traces matrix of a non-sota algorithm: one lockstep pass per trace covers every pending params.
+        '''
+        assert os.path.exists(algo)
+        m_trace_params_ids = {t: [] for t in trace_path_list}
+        for params_id, params in enumerate(params_list):
+            logging.info(f"Simulating {(algo, params)}")
+            for trace_path in self._get_pending_trace_paths(algo, False, params, trace_path_list, cache_cap_frac):
+                m_trace_params_ids[trace_path].append(params_id)
+        pending_trace_path_list = [t for t in trace_path_list if len(m_trace_params_ids[t]) > 0]
+        if len(pending_trace_path_list) == 0:
+            return
+
+        simulator_list = self._get_simulator(pending_trace_path_list, cache_cap_frac)
+        with open(algo, 'r') as file:
+            raw_code = file.read()
+        example_sim = simulator_list[0]
+        m_params_id_code = {
+            params_id: example_sim._fix_default_param_for_code(raw_code, params)
+            for params_id, params in enumerate(params_list)
+        }
+        jobs = [
+            (sim, [m_params_id_code[params_id] for params_id in m_trace_params_ids[sim.config.trace_path]])
+            for sim in simulator_list
+        ]
+        def on_result(sim_id: int, mr_list):
+            sim = simulator_list[sim_id]
+            self._add_entries([
+                CrossValidatorEntry(
+                    algo=algo, is_sota=False, params=params_list[params_id], mr=mr, trace_path=sim.config.trace_path, cache_cap=sim.config.capacity, cache_cap_frac=cache_cap_frac,
+                    cost=sim.get_cost(m_params_id_code[params_id])
+                )
+                for params_id, mr in zip(m_trace_params_ids[sim.config.trace_path], mr_list)
+            ])
+        map_scheduled(
+            cross_validate_simulate_lockstep,
+            jobs,
+            [estimate_cost(sim.config.trace_path, sim.config.capacity, policy_cost=len(code_list)) for (sim, code_list) in jobs],
+            on_result=on_result
+        )
+
+    def plot_miss_ratio_percentile(self, trace_filter, algo_list: list, cache_cap_frac: float, png_path: str, rank_by: str=None, max_cost: dict=None):
+        '''
+        - rank_by, max_cost: rank or filter the algorithms by miss ratio or by cost, see `utils.plot_mr`
+        '''
         if "fifo" not in algo_list:
             algo_list.append("fifo")
 
@@ -261,21 +346,12 @@ class CrossValidator:
         m_algo_entry = dict() # list of entries for each algorithm in algo_list
         for algo in algo_list:
             # collect candid params
-            candid_params = self._get_candid_params(
-                filter_trace_path=trace_filter,
-                filter_cache_cap_frac=lambda ccf: ccf == cache_cap_frac,
-                filter_algo=lambda alg: alg == algo
-            )
+            candid_params = self._get_candid_params(algo, cache_cap_frac, trace_filter=trace_filter)
             # categorize them by params
             candid_params_str = set([json.dumps(p) for p in candid_params])
             m_params_str_to_entries = {
                 ps: sorted(
-                    self._get_candid_entries(
-                        filter_trace_path=trace_filter,
-                        filter_cache_cap_frac=lambda ccf: ccf == cache_cap_frac,
-                        filter_algo=lambda alg: alg == algo,
-                        filter_params=lambda p: json.dumps(p) == ps
-                    ), 
+                    self._get_candid_entries(algo, cache_cap_frac, json.loads(ps), trace_filter=trace_filter),
                     key=lambda e: os.path.basename(e.trace_path))
                 for ps in candid_params_str
             }
@@ -296,6 +372,7 @@ class CrossValidator:
             m_algo_entry[algo] = m_params_str_to_entries[target_ps]
 
         m_algo_mr = dict() # list of miss ratios for each algorithm in algo_list
+        m_algo_cost = dict() # list of costs for each algorithm in algo_list
         for algo in m_algo_entry:
             if algo == "fifo":
                 continue
@@ -303,8 +380,9 @@ class CrossValidator:
             m_algo_mr[algo] = list()
             for e, fifo_e in zip(m_algo_entry[algo], m_algo_entry["fifo"]):
                 m_algo_mr[algo].append(miss_ratio_reduction(e.mr, fifo_e.mr))
+            m_algo_cost[algo] = [e.cost for e in m_algo_entry[algo]]
 
-        self.trace_analyzer._plot(m_algo_mr, png_path)
+        self.trace_analyzer._plot(m_algo_mr, png_path, m_algo_cost=m_algo_cost, rank_by=rank_by, max_cost=max_cost)
 
     def simulate(
             self, 
@@ -312,15 +390,21 @@ class CrossValidator:
             is_sota: bool,
             trace_path_list: list, 
             cache_cap_frac: float,
+            lockstep: bool=True,
     ):
         '''
         The simulation is executed in parallel.
+        - lockstep (bool): for non-sota algorithms, simulate all the candidate params in one pass over each trace
         '''
-        candid_params = self._get_candid_params(
-            filter_trace_path=lambda p: os.path.basename(p) in [os.path.basename(t) for t in trace_path_list],
-            filter_cache_cap_frac=lambda ccf: ccf == cache_cap_frac,
-            filter_algo=lambda alg: alg == algo
-        )
+        candid_params = self._get_candid_params(algo, cache_cap_frac, trace_path_list=trace_path_list)
+        if is_sota == False and lockstep == True:
+            self._simulate_lockstep(
+                algo=algo,
+                params_list=candid_params,
+                trace_path_list=trace_path_list,
+                cache_cap_frac=cache_cap_frac,
+            )
+            return
         for param in candid_params:
             self._simulate(
                 algo=algo,
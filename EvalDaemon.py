@@ -0,0 +1,335 @@
+import os
+import time
+import stat
+import signal
+import secrets
+import argparse
+import tempfile
+import threading
+import traceback
+import itertools
+import multiprocessing
+from multiprocessing.connection import Listener, Client
+from typing import Dict, List
+import logging_config
+import logging
+from cache import CacheConfig, SharedTraceStore
+from Simulator import SimulatorBase, SimulatorCache, SimulatorConfig
+from Sandbox import SandboxError, SandboxResult, SandboxStatus, limit_address_space
+
+# the connections unpickle jobs and run policy code: the socket lives in a directory private to the user, and there is no default key
+private_folder = os.path.join(tempfile.gettempdir(), f"cache_eval_daemon-{os.getuid()}")
+default_address = os.path.join(private_folder, "daemon.sock")
+authkey_env = "CACHE_EVAL_DAEMON_AUTHKEY"
+
+def make_private_folder(folder: str):
+    '''
+    Create `folder` with mode 0700, or check that the existing one is a directory owned by this user and make it 0700.
+    Raise `PermissionError` otherwise, e.g., if another user created it first.
+    '''
+    os.makedirs(folder, mode=0o700, exist_ok=True)
+    folder_stat = os.lstat(folder)
+    if not stat.S_ISDIR(folder_stat.st_mode) or folder_stat.st_uid != os.getuid():
+        raise PermissionError(f"{folder} is not a directory owned by this user")
+    os.chmod(folder, 0o700)
+
+def get_authkey_path(address: str):
+    return address + ".authkey"
+
+def get_authkey(address: str, authkey: bytes=None):
+    '''
+    Return: `authkey` | the key in the `CACHE_EVAL_DAEMON_AUTHKEY` environment variable | the key file written by the daemon listening on `address` | `None`
+    '''
+    if authkey != None:
+        return authkey
+    if os.environ.get(authkey_env, "") != "":
+        return os.environ[authkey_env].encode()
+    if isinstance(address, str) and os.path.exists(get_authkey_path(address)):
+        with open(get_authkey_path(address), 'rb') as file:
+            return file.read().strip()
+    return None
+
+def _get_simulator(job: Dict):
+    return SimulatorCache(
+        SimulatorConfig(
+            name="Cache",
+            config=CacheConfig(
+                capacity=job["capacity"],
+                consider_obj_size=job.get("consider_obj_size", False),
+                trace_path=job["trace_path"],
+                key_col_id=1,
+                size_col_id=2,
+                has_header=False,
+                delimiter=","
+            ),
+            system_path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache"),
+            tune_runs=0,
+            code_folder=None,
+            tune_int_upper=None
+        )
+    )
+
+def _evaluate(job: Dict):
+    '''
+    Replay `job["code"]` with `job["params"]` injected (see `PolicyTemplate`) in this process; My.py is not touched.
+    Return: `SandboxResult` whose value is the miss ratio
+    '''
+    try:
+        simulator = _get_simulator(job)
+        simulator.use_sandbox = False
+        simulator._run(job["code"], params=job.get("params") or dict())
+        return simulator.last_run_result
+    except SandboxError as error:
+        return error.result
+    except Exception as error:
+        return SandboxResult(SandboxStatus.EXCEPTION, error=repr(error), traceback_msg=traceback.format_exc().strip())
+
+def _worker_main(worker_id: int, state, job_queue, result_queue, memory_limit: int):
+    '''
+    Entry point of a warm worker: the modules are imported by the daemon before the fork, and the decoded traces stay resident across jobs.
+    '''
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if memory_limit != None:
+        limit_address_space(memory_limit)
+    while True:
+        message = job_queue.get()
+        if message == None:
+            break
+        job_id, job = message
+        # written to shared memory at once, so the daemon knows the job even if this worker dies without a word
+        state[0], state[1] = job_id, time.time()
+        result_queue.put((worker_id, job_id, _evaluate(job)))
+        state[0] = -1
+
+class EvalDaemon:
+    '''
+    A long-lived pool of warm evaluation workers. Each job is a dict:
+    - code (str): the policy source,
+    - params (dict | None): injected into a fresh policy namespace; `None` keeps the values in the code,
+    - trace_path (str), capacity (int), consider_obj_size (bool, default `False`).
+    The preloaded traces are published once into shared memory (see `SharedTraceStore`); the other traces are decoded by each worker on first use and kept in its LRU.
+    A job runs in a worker under the SIGALRM timeout and RLIMIT_AS of `SimulatorBase`; a worker that hangs past the wall-clock limit or dies is replaced, and its job fails with status "timeout", "oom" or "exception".
+    Jobs are submitted in-process with `evaluate_many()`, or by `EvalClient`s through a local socket once `serve_forever()` runs.
+    '''
+    def __init__(self, num_workers: int=None, preload_traces: List[str]=None, trace_cache_size: int=16, address=None, authkey: bytes=None):
+        self.num_workers = num_workers if num_workers != None else os.cpu_count()
+        self.preload_traces = preload_traces if preload_traces != None else []
+        self.trace_cache_size = trace_cache_size
+        self.address = address if address != None else default_address
+        self.authkey = authkey # `None`: see `serve_forever`
+        self.wall_limit = SimulatorBase.timeout_limit + 5 # the SIGALRM timeout fires first unless the policy hangs in C code
+        self._ctx = multiprocessing.get_context("fork")
+        # `SimpleQueue.put` writes synchronously: a message is not lost in a feeder thread when a worker dies
+        self._job_queue = self._ctx.SimpleQueue()
+        self._result_queue = self._ctx.SimpleQueue()
+        self._workers = dict() # worker_id -> (process, state: shared [running job_id or -1, start time])
+        self._pending = dict() # job_id -> [threading.Event, SandboxResult]
+        self._lock = threading.Lock()
+        self._job_ids = itertools.count()
+        self._worker_ids = itertools.count()
+        self._closed = threading.Event()
+        self._threads = []
+        self.shared_traces = SharedTraceStore()
+
+    def start(self):
+        SimulatorBase.trace_cache_size = self.trace_cache_size
+        for trace_path in self.preload_traces:
+            self.shared_traces.publish(trace_path)
+        for _ in range(self.num_workers):
+            self._spawn()
+        for target in [self._collect, self._monitor]:
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def _spawn(self):
+        worker_id = next(self._worker_ids)
+        state = self._ctx.Array('d', [-1, 0.0], lock=False)
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(worker_id, state, self._job_queue, self._result_queue, SimulatorBase.memory_limit),
+            daemon=True
+        )
+        process.start()
+        self._workers[worker_id] = (process, state)
+
+    def _finish(self, job_id: int, result: SandboxResult):
+        with self._lock:
+            pending = self._pending.pop(job_id, None)
+        if pending != None:
+            pending[1] = result
+            pending[0].set()
+
+    def _collect(self):
+        while True:
+            message = self._result_queue.get()
+            if message == None:
+                break
+            _, job_id, result = message
+            self._finish(job_id, result)
+
+    def _monitor(self):
+        while not self._closed.wait(0.5):
+            for worker_id, (process, state) in list(self._workers.items()):
+                running = (int(state[0]), state[1]) if state[0] >= 0 else None
+                if process.is_alive():
+                    if running == None or time.time() - running[1] <= self.wall_limit:
+                        continue
+                    logging.warning(f"Eval worker {process.pid} exceeded the wall-clock limit ({self.wall_limit}s) and is killed")
+                    process.kill()
+                    result = SandboxResult(SandboxStatus.TIMEOUT, error=f"Wall-clock limit ({self.wall_limit}s) exceeded")
+                elif process.exitcode == -signal.SIGKILL:
+                    result = SandboxResult(SandboxStatus.OOM, error="Worker was killed (SIGKILL)")
+                else:
+                    result = SandboxResult(SandboxStatus.EXCEPTION, error=f"Worker exited with code {process.exitcode}")
+                process.join()
+                del self._workers[worker_id]
+                if running != None:
+                    result.latency = time.time() - running[1]
+                    self._finish(running[0], result)
+                if not self._closed.is_set():
+                    self._spawn()
+
+    def evaluate_many(self, jobs: List[Dict]):
+        '''
+        Return: list of `SandboxResult`, in the order of `jobs`
+        '''
+        waiting = []
+        for job in jobs:
+            job_id = next(self._job_ids)
+            pending = [threading.Event(), None]
+            with self._lock:
+                self._pending[job_id] = pending
+            self._job_queue.put((job_id, job))
+            waiting.append(pending)
+        results = []
+        for pending in waiting:
+            pending[0].wait()
+            results.append(pending[1])
+        return results
+
+    def _serve_connection(self, conn):
+        try:
+            while True:
+                jobs = conn.recv()
+                conn.send([result.to_dict() for result in self.evaluate_many(jobs)])
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def _prepare_listening(self):
+        '''
+        Without `authkey` nor `CACHE_EVAL_DAEMON_AUTHKEY`, generate a random key into a 0600 file next to the socket, where local `EvalClient`s of the same user find it.
+        '''
+        if self.address == default_address:
+            make_private_folder(private_folder)
+        if os.environ.get(authkey_env, "") != "" and self.authkey == None:
+            self.authkey = os.environ[authkey_env].encode()
+        if self.authkey == None:
+            self.authkey = secrets.token_hex(16).encode()
+            key_path = get_authkey_path(self.address)
+            if os.path.exists(key_path):
+                os.remove(key_path)
+            fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, 'wb') as file:
+                file.write(self.authkey)
+        if os.path.exists(self.address):
+            os.remove(self.address)
+
+    def serve_forever(self):
+        self._prepare_listening()
+        with Listener(self.address, authkey=self.authkey) as listener:
+            # connecting to a unix socket needs write permission on it
+            os.chmod(self.address, 0o600)
+            logging.info(f"Eval daemon: {self.num_workers} workers, listening on {self.address}")
+            while not self._closed.is_set():
+                try:
+                    conn = listener.accept()
+                except (EOFError, OSError, multiprocessing.AuthenticationError) as error:
+                    logging.warning(f"Eval daemon: rejected a connection: {repr(error)}")
+                    continue
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+    def close(self):
+        self._closed.set()
+        for _ in self._workers:
+            self._job_queue.put(None)
+        for (process, _) in list(self._workers.values()):
+            process.join(1)
+            if process.is_alive():
+                process.kill()
+                process.join()
+        self._workers.clear()
+        self._result_queue.put(None)
+        with self._lock:
+            pending_list = list(self._pending.values())
+            self._pending.clear()
+        for pending in pending_list:
+            pending[1] = SandboxResult(SandboxStatus.EXCEPTION, error="Eval daemon closed")
+            pending[0].set()
+        self.shared_traces.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+class EvalClient:
+    '''
+    Submit jobs (see `EvalDaemon`) to a running daemon.
+    '''
+    def __init__(self, address=None, authkey: bytes=None):
+        '''
+        Raise `ValueError` if no key is found, see `get_authkey`.
+        '''
+        address = address if address != None else default_address
+        authkey = get_authkey(address, authkey)
+        if authkey == None:
+            raise ValueError(f"No key to connect to the eval daemon at {address}: set {authkey_env}, pass authkey, or start the daemon as this user")
+        self._conn = Client(address, authkey=authkey)
+        self._lock = threading.Lock()
+
+    def evaluate_many(self, jobs: List[Dict]):
+        '''
+        Return: list of `SandboxResult`, in the order of `jobs`
+        '''
+        with self._lock:
+            self._conn.send(jobs)
+            result_dicts = self._conn.recv()
+        return [SandboxResult(**d) for d in result_dicts]
+
+    def evaluate(self, code: str, trace_path: str, capacity: int, params: Dict=None, consider_obj_size: bool=False):
+        return self.evaluate_many([{
+            "code": code,
+            "params": params,
+            "trace_path": trace_path,
+            "capacity": capacity,
+            "consider_obj_size": consider_obj_size
+        }])[0]
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve policy evaluations from warm workers")
+    parser.add_argument("--address", default=default_address, help="unix socket path")
+    parser.add_argument("--num-workers", type=int, default=None)
+    parser.add_argument("--trace-cache-size", type=int, default=16)
+    parser.add_argument("--preload", nargs="*", default=[], help="trace paths to publish into shared memory at startup")
+    args = parser.parse_args()
+    daemon = EvalDaemon(num_workers=args.num_workers, preload_traces=args.preload, trace_cache_size=args.trace_cache_size, address=args.address).start()
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.close()
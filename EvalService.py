@@ -0,0 +1,151 @@
+import asyncio
+import itertools
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+from Sandbox import SandboxResult, SandboxStatus
+from EvalDaemon import EvalDaemon
+import logging_config
+import logging
+
+class EvalFuture:
+    '''
+    The pending evaluation of one policy on several traces, returned by `EvalService.submit()`.
+    - `await` it for the list of `SandboxResult`s, in the order of the traces (raise `asyncio.CancelledError` if cancelled),
+    - `results`: the partial results so far (`None` for the pending traces),
+    - `async for index, result in future.as_completed()`: the results per trace as they arrive,
+    - `cancel()`: the traces that have not started are dropped; the results of the running ones are discarded.
+    '''
+    def __init__(self, code: str, trace_path_list: List[str], cache_cap_list: List[int], params: Dict, priority: float, on_result=None):
+        assert len(trace_path_list) == len(cache_cap_list) and len(trace_path_list) > 0
+        self.code = code
+        self.trace_path_list = trace_path_list
+        self.cache_cap_list = cache_cap_list
+        self.params = params
+        self.priority = priority
+        self.on_result = on_result # called with (index, result) as each trace completes
+        self.results: List[SandboxResult] = [None for _ in trace_path_list]
+        self._num_done = 0
+        self._future = asyncio.get_running_loop().create_future()
+        self._updates = asyncio.Queue()
+
+    def _get_job(self, index: int):
+        return {
+            "code": self.code,
+            "params": self.params,
+            "trace_path": self.trace_path_list[index],
+            "capacity": self.cache_cap_list[index]
+        }
+
+    def _set_result(self, index: int, result: SandboxResult):
+        if self._future.done():
+            return
+        self.results[index] = result
+        self._num_done += 1
+        self._updates.put_nowait((index, result))
+        # resolve the future before the user callback, which must not stall the waiters if it raises
+        if self._num_done == len(self.results):
+            self._future.set_result(list(self.results))
+        if self.on_result != None:
+            try:
+                self.on_result(index, result)
+            except Exception:
+                logging.warning(f"EvalFuture: on_result failed on trace {index}\nTraceback:\n{traceback.format_exc()}")
+
+    @property
+    def num_done(self):
+        return self._num_done
+
+    def done(self):
+        return self._future.done()
+
+    def cancelled(self):
+        return self._future.cancelled()
+
+    def cancel(self):
+        if not self._future.cancel():
+            return False
+        self._updates.put_nowait(None)
+        return True
+
+    def __await__(self):
+        return self._future.__await__()
+
+    async def as_completed(self):
+        for _ in range(len(self.results)):
+            update = await self._updates.get()
+            if update == None:
+                return
+            yield update
+
+class EvalService:
+    '''
+    An asyncio front end of an `EvalDaemon`: `submit()` returns an `EvalFuture` at once, so callers can overlap candidate generation with evaluation.
+    The (policy, trace) runs are queued by priority (higher first, then first submitted first), and at most `max_concurrency` run at a time.
+    Use it as `async with EvalService() as service:`, from a running event loop.
+    '''
+    def __init__(self, daemon: EvalDaemon=None, max_concurrency: int=None):
+        self._own_daemon = daemon == None
+        self.daemon = daemon if daemon != None else EvalDaemon(num_workers=max_concurrency)
+        self.max_concurrency = max_concurrency if max_concurrency != None else self.daemon.num_workers
+        # latent variables
+        self._queue = None
+        self._executor = None
+        self._dispatchers = []
+        self._seq = itertools.count()
+
+    async def start(self):
+        if self._own_daemon == True:
+            await asyncio.get_running_loop().run_in_executor(None, self.daemon.start)
+        self._queue = asyncio.PriorityQueue()
+        self._executor = ThreadPoolExecutor(self.max_concurrency)
+        self._dispatchers = [asyncio.create_task(self._dispatch()) for _ in range(self.max_concurrency)]
+        return self
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, future, index = await self._queue.get()
+            if future.done():
+                # cancelled
+                continue
+            try:
+                result = (await loop.run_in_executor(self._executor, self.daemon.evaluate_many, [future._get_job(index)]))[0]
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                result = SandboxResult(SandboxStatus.EXCEPTION, error=repr(error), traceback_msg=traceback.format_exc().strip())
+            # a dead dispatcher would stall every queued run: keep it alive whatever happens
+            try:
+                future._set_result(index, result)
+            except Exception:
+                logging.warning(f"EvalService: fail to deliver a result\nTraceback:\n{traceback.format_exc()}")
+
+    def submit(self, code: str, trace_path_list: List[str], cache_cap_list: List[int], params: Dict=None, priority: float=0.0, on_result=None):
+        '''
+        Queue the evaluation of `code` (with `params` injected, see `PolicyTemplate`) on every trace.
+        Return: `EvalFuture`
+        '''
+        assert self._queue != None, "EvalService is not started"
+        future = EvalFuture(code, trace_path_list, cache_cap_list, params, priority, on_result)
+        for index in range(len(trace_path_list)):
+            self._queue.put_nowait((-priority, next(self._seq), future, index))
+        return future
+
+    async def close(self):
+        for dispatcher in self._dispatchers:
+            dispatcher.cancel()
+        await asyncio.gather(*self._dispatchers, return_exceptions=True)
+        self._dispatchers = []
+        if self._own_daemon == True:
+            # also fails the runs still in the daemon
+            self.daemon.close()
+        if self._executor != None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc_value, exc_traceback):
+        await self.close()
@@ -0,0 +1,285 @@
+import os
+import json
+import time
+import socket
+import secrets
+import argparse
+import threading
+import traceback
+import collections
+from multiprocessing.managers import BaseManager
+from typing import Dict, List
+import logging_config
+import logging
+
+authkey_env = "CACHE_JOB_BROKER_AUTHKEY"
+
+def get_authkey(authkey: bytes=None):
+    '''
+    The manager connections unpickle what the peer sends: anyone holding the key can run code on the broker, so there is no default key.
+    Return: `authkey` | the key in the `CACHE_JOB_BROKER_AUTHKEY` environment variable | `None` if neither is set
+    '''
+    if authkey != None:
+        return authkey
+    if os.environ.get(authkey_env, "") != "":
+        return os.environ[authkey_env].encode()
+    return None
+
+def get_job_key(job: Dict):
+    return json.dumps(job, sort_keys=True)
+
+class JobBroker:
+    '''
+    Hand out `PolicyEvaluator.eval` jobs to workers on any number of hosts.
+    A job is a dict of the keyword arguments of `PolicyEvaluator.eval` (trace_type, trace_file_name, train_frac, cache_cap_frac, algo, is_sota, and optionally warm_start and test_mode).
+    - A worker leases a job and sends heartbeats while it runs; a lease without heartbeat for `lease_timeout` seconds (e.g., a lost host) is re-queued.
+    - A job that fails or is lost `max_attempts` times is given up.
+    - `on_result(job, result)` is called in the broker process with each completed job's `Entry` dict, e.g., to append it to the shared result store.
+    All methods are thread-safe: the manager server serves every connection in its own thread.
+    '''
+    def __init__(self, lease_timeout: float=120.0, max_attempts: int=3, on_result=None):
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.on_result = on_result
+        self._lock = threading.Lock()
+        self._jobs = dict() # job_id -> job
+        self._job_ids = dict() # job key -> job_id
+        self._attempts = collections.Counter() # job_id -> #leases
+        self._pending = collections.deque() # job_id
+        self._leases = dict() # job_id -> (worker_id, deadline)
+        self._done = dict() # job_id -> result
+        self._failed = dict() # job_id -> last error
+        self._workers = dict() # worker_id -> last seen
+
+    def submit(self, jobs: List[Dict]):
+        '''
+        Queue the jobs that are not already queued, running or done.
+        Return: the job id of every job
+        '''
+        job_ids = []
+        with self._lock:
+            for job in jobs:
+                job_key = get_job_key(job)
+                if job_key not in self._job_ids:
+                    job_id = len(self._jobs)
+                    self._job_ids[job_key] = job_id
+                    self._jobs[job_id] = job
+                    self._pending.append(job_id)
+                elif self._job_ids[job_key] in self._failed:
+                    # retry a given-up job on explicit resubmission
+                    job_id = self._job_ids[job_key]
+                    del self._failed[job_id]
+                    self._attempts[job_id] = 0
+                    self._pending.append(job_id)
+                job_ids.append(self._job_ids[job_key])
+        return job_ids
+
+    def _requeue_expired(self):
+        now = time.time()
+        for job_id, (worker_id, deadline) in list(self._leases.items()):
+            if deadline >= now:
+                continue
+            del self._leases[job_id]
+            logging.warning(f"Job broker: worker {worker_id} lost job {job_id}")
+            self._retry(job_id, f"lease of worker {worker_id} expired")
+
+    def _retry(self, job_id: int, error: str):
+        if self._attempts[job_id] >= self.max_attempts:
+            self._failed[job_id] = error
+        else:
+            self._pending.appendleft(job_id)
+
+    def lease(self, worker_id: str):
+        '''
+        Return: (job_id, job) | `None` if no job is pending
+        '''
+        with self._lock:
+            self._workers[worker_id] = time.time()
+            self._requeue_expired()
+            if len(self._pending) == 0:
+                return None
+            job_id = self._pending.popleft()
+            self._attempts[job_id] += 1
+            self._leases[job_id] = (worker_id, time.time() + self.lease_timeout)
+            return job_id, self._jobs[job_id]
+
+    def heartbeat(self, worker_id: str, job_id: int):
+        '''
+        Return: whether the worker still holds the lease
+        '''
+        with self._lock:
+            self._workers[worker_id] = time.time()
+            if job_id not in self._leases or self._leases[job_id][0] != worker_id:
+                return False
+            self._leases[job_id] = (worker_id, time.time() + self.lease_timeout)
+            return True
+
+    def complete(self, worker_id: str, job_id: int, result: Dict):
+        '''
+        A result is accepted even if the lease has expired meanwhile, as long as the job is not done yet.
+        '''
+        with self._lock:
+            self._workers[worker_id] = time.time()
+            if job_id in self._done:
+                return False
+            lease = self._leases.get(job_id)
+            if lease != None and lease[0] == worker_id:
+                del self._leases[job_id]
+            if job_id in self._pending:
+                self._pending.remove(job_id)
+            self._failed.pop(job_id, None)
+            self._done[job_id] = result
+            job = self._jobs[job_id]
+        if self.on_result != None:
+            try:
+                self.on_result(job, result)
+            except Exception:
+                logging.warning(f"Job broker: fail to store the result of job {job_id}\n{traceback.format_exc()}")
+        return True
+
+    def fail(self, worker_id: str, job_id: int, error: str):
+        with self._lock:
+            self._workers[worker_id] = time.time()
+            lease = self._leases.get(job_id)
+            if lease == None or lease[0] != worker_id:
+                return
+            del self._leases[job_id]
+            logging.warning(f"Job broker: job {job_id} failed on worker {worker_id}: {error}")
+            self._retry(job_id, error)
+
+    def get_result(self, job_id: int):
+        with self._lock:
+            return self._done.get(job_id)
+
+    def status(self):
+        with self._lock:
+            self._requeue_expired()
+            return {
+                "pending": len(self._pending),
+                "running": len(self._leases),
+                "done": len(self._done),
+                "failed": dict(self._failed),
+                "workers": dict(self._workers)
+            }
+
+class BrokerManager(BaseManager):
+    pass
+
+def serve_broker(broker: JobBroker, address, authkey: bytes=None):
+    '''
+    Serve `broker` at `address` ((host, port)) until the process is killed.
+    Without `authkey` nor `CACHE_JOB_BROKER_AUTHKEY`, a random key is generated and printed: pass it to the workers.
+    '''
+    authkey = get_authkey(authkey)
+    if authkey == None:
+        authkey = secrets.token_hex(16).encode()
+        print(f"Job broker: no {authkey_env} set, generated the key {authkey.decode()}; run the workers with {authkey_env}={authkey.decode()}", flush=True)
+    BrokerManager.register("get_broker", callable=lambda: broker)
+    manager = BrokerManager(address=address, authkey=authkey)
+    server = manager.get_server()
+    logging.info(f"Job broker: listening on {server.address}")
+    server.serve_forever()
+
+def connect_broker(address, authkey: bytes=None):
+    '''
+    Raise `ValueError` if neither `authkey` nor `CACHE_JOB_BROKER_AUTHKEY` is set.
+    Return: a proxy of the remote `JobBroker`; use one proxy per thread
+    '''
+    authkey = get_authkey(authkey)
+    if authkey == None:
+        raise ValueError(f"No key to connect to the job broker: set {authkey_env} or pass authkey")
+    BrokerManager.register("get_broker")
+    manager = BrokerManager(address=address, authkey=authkey)
+    manager.connect()
+    return manager.get_broker()
+
+def _heartbeat(address, authkey: bytes, worker_id: str, job_id: int, interval: float, stop: threading.Event):
+    broker = connect_broker(address, authkey)
+    while not stop.wait(interval):
+        if not broker.heartbeat(worker_id, job_id):
+            logging.warning(f"Job broker worker {worker_id}: lost the lease of job {job_id}")
+            return
+
+class PolicyEvalRunner:
+    '''
+    Run a job with a local `PolicyEvaluator`, without saving the entry: the broker stores it.
+    '''
+    def __init__(self):
+        from PolicyEvaluator import PolicyEvaluator
+        self.evaluator = PolicyEvaluator()
+
+    def __call__(self, job: Dict):
+        return self.evaluator.eval(**job, need_save=False).to_dict()
+
+class PolicyEvalStore:
+    '''
+    `JobBroker.on_result` that appends each entry to the `PolicyEvaluator` results of the broker host, once.
+    '''
+    def __init__(self):
+        from PolicyEvaluator import PolicyEvaluator
+        self.evaluator = PolicyEvaluator()
+        self._lock = threading.Lock()
+
+    def __call__(self, job: Dict, result: Dict):
+        from PolicyEvaluator import Entry
+        entry = Entry.from_dict(result)
+        with self._lock:
+            if self.evaluator.find_entry(job["trace_type"], job["trace_file_name"], job["train_frac"], job["cache_cap_frac"], job["algo"], job.get("test_mode", "cold"), entry.engine) == None:
+                self.evaluator.add_entry(entry)
+
+def run_worker(address, authkey: bytes=None, worker_id: str=None, evaluate=None, heartbeat_interval: float=10.0, idle_wait: float=5.0, exit_when_idle: bool=False):
+    '''
+    Lease and run jobs until killed, or, if `exit_when_idle`, until the broker has no pending or running job.
+    - evaluate (callable): job -> result dict; default: `PolicyEvalRunner()`
+    '''
+    if worker_id == None:
+        worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    if evaluate == None:
+        evaluate = PolicyEvalRunner()
+    broker = connect_broker(address, authkey)
+    while True:
+        lease = broker.lease(worker_id)
+        if lease == None:
+            if exit_when_idle == True:
+                status = broker.status()
+                if status["pending"] == 0 and status["running"] == 0:
+                    return
+            time.sleep(idle_wait)
+            continue
+        job_id, job = lease
+        logging.info(f"Job broker worker {worker_id}: running job {job_id} {job}")
+        stop = threading.Event()
+        heartbeat_thread = threading.Thread(target=_heartbeat, args=(address, authkey, worker_id, job_id, heartbeat_interval, stop), daemon=True)
+        heartbeat_thread.start()
+        try:
+            result = evaluate(job)
+            broker.complete(worker_id, job_id, result)
+        except Exception as error:
+            broker.fail(worker_id, job_id, repr(error))
+        finally:
+            stop.set()
+            heartbeat_thread.join()
+
+def _parse_address(address: str):
+    host, _, port = address.rpartition(":")
+    return (host, int(port))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distribute PolicyEvaluator jobs over hosts")
+    subparsers = parser.add_subparsers(dest="role", required=True)
+    broker_parser = subparsers.add_parser("broker")
+    broker_parser.add_argument("--address", default="127.0.0.1:50051", help="host:port to listen on; listen on a public interface only on a trusted network")
+    broker_parser.add_argument("--authkey", default=None, help=f"shared key of the broker and workers (default: ${authkey_env}, else a random key is printed)")
+    broker_parser.add_argument("--lease-timeout", type=float, default=120.0)
+    broker_parser.add_argument("--max-attempts", type=int, default=3)
+    worker_parser = subparsers.add_parser("worker")
+    worker_parser.add_argument("--address", required=True, help="host:port of the broker")
+    worker_parser.add_argument("--heartbeat-interval", type=float, default=10.0)
+    worker_parser.add_argument("--exit-when-idle", action="store_true")
+    worker_parser.add_argument("--authkey", default=None, help=f"shared key of the broker and workers (default: ${authkey_env})")
+    args = parser.parse_args()
+    authkey = args.authkey.encode() if args.authkey != None else None
+    if args.role == "broker":
+        serve_broker(JobBroker(lease_timeout=args.lease_timeout, max_attempts=args.max_attempts, on_result=PolicyEvalStore()), _parse_address(args.address), authkey)
+    else:
+        run_worker(_parse_address(args.address), authkey, heartbeat_interval=args.heartbeat_interval, exit_when_idle=args.exit_when_idle)
@@ -0,0 +1,251 @@
+import os
+import logging_config
+import logging
+import traceback
+from typing import Dict, List
+from multiprocessing import Pool
+import numpy as np
+from cache import CacheConfig, Trace, is_sampled_key
+from Simulator import SimulatorCache, SimulatorConfig
+from Sandbox import SandboxError
+from ResultCache import ResultCache
+from Optimizers import minimize
+from Scheduler import get_num_workers
+from utils import run_libcachesim, miss_ratio_reduction, get_libcachesim_param_info, get_libcachesim_space, libcachesim_params_to_str
+
+reduced_trace_version = 2 # bump when the content of the sampled or prefix traces changes, e.g., version 2 recomputes next_vtime as a request index (see `Trace.set_next_vtime`)
+
+def get_sampled_trace_path(trace_path: str, sample_rate: float, sampled_trace_folder: str):
+    '''
+    Spatially sample a trace (see `cache.is_sampled_key`).
+    The sampled trace is written once per (trace content, rate, `reduced_trace_version`).
+    Return: (sampled_trace_path, ndv of the sampled trace)
+    '''
+    trace_hash = ResultCache.default().hash_trace(trace_path)
+    sampled_trace_path = os.path.join(sampled_trace_folder, f"{trace_hash[:16]}_{sample_rate}_v{reduced_trace_version}.oracleGeneral.bin")
+    trace = None
+    if not os.path.exists(sampled_trace_path):
+        trace = Trace(trace_path, True)
+        trace.entries = [e for e in trace.entries if is_sampled_key(e.key, sample_rate)]
+        trace.set_next_vtime()
+        os.makedirs(sampled_trace_folder, exist_ok=True)
+        tmp_path = sampled_trace_path + f".{os.getpid()}.tmp"
+        trace.to_bin(tmp_path)
+        os.replace(tmp_path, sampled_trace_path)
+    if trace == None:
+        trace = Trace(sampled_trace_path, True)
+    return sampled_trace_path, trace.get_ndv()
+
+def get_prefix_trace_path(trace_path: str, prefix_frac: float, prefix_trace_folder: str):
+    '''
+    The first `prefix_frac` of the requests of a trace, with the next_vtime column recomputed.
+    The prefix is written once per (trace content, fraction, `reduced_trace_version`).
+    Return: (prefix_trace_path, ndv of the prefix)
+    '''
+    trace_hash = ResultCache.default().hash_trace(trace_path)
+    prefix_trace_path = os.path.join(prefix_trace_folder, f"{trace_hash[:16]}_prefix{prefix_frac}_v{reduced_trace_version}.oracleGeneral.bin")
+    trace = None
+    if not os.path.exists(prefix_trace_path):
+        trace = Trace(trace_path, True)
+        trace.entries = trace.entries[:max(1, int(len(trace.entries) * prefix_frac))]
+        trace.set_next_vtime()
+        os.makedirs(prefix_trace_folder, exist_ok=True)
+        tmp_path = prefix_trace_path + f".{os.getpid()}.tmp"
+        trace.to_bin(tmp_path)
+        os.replace(tmp_path, prefix_trace_path)
+    if trace == None:
+        trace = Trace(prefix_trace_path, True)
+    return prefix_trace_path, trace.get_ndv()
+
+def _get_simulator(trace_path: str, cache_cap: int, tune_int_upper: int=None):
+    return SimulatorCache(
+        SimulatorConfig(
+            name="Cache",
+            config=CacheConfig(
+                capacity=cache_cap,
+                consider_obj_size=False,
+                trace_path=trace_path,
+                key_col_id=1,
+                size_col_id=2,
+                has_header=False,
+                delimiter=","
+            ),
+            system_path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache"),
+            tune_runs=0,
+            code_folder=None,
+            tune_int_upper=tune_int_upper
+        )
+    )
+
+def simulate_params(args):
+    '''
+    Args: (algo, is_sota, trace_path, cache_cap, params)
+    - algo: the sota algorithm name if `is_sota`, else the path to the code
+    Return: miss ratio | `None` if fail
+    '''
+    algo, is_sota, trace_path, cache_cap, params = args
+    if is_sota == True:
+        return run_libcachesim(trace_path, algo, cache_cap, libcachesim_params_to_str(algo, params) if len(params) > 0 else "")
+    simulator = _get_simulator(trace_path, cache_cap)
+    with open(algo, 'r') as file:
+        code = file.read()
+    try:
+        return simulator._run(code, params=params)
+    except SandboxError as error:
+        logging.warning(f"Joint tuning: {os.path.basename(algo)} on {os.path.basename(trace_path)} with {params}: FAIL...\n\tError message: {repr(error)}")
+        return None
+    finally:
+        simulator.close()
+
+class JointTuningResult:
+    def __init__(self, default_params: Dict, tuned_params: Dict, default_mr_list: List[float], tuned_mr_list: List[float], default_score: float, tuned_score: float):
+        self.default_params = default_params
+        self.tuned_params = tuned_params
+        self.default_mr_list = default_mr_list # miss ratio per (full) trace, `None` if fail
+        self.tuned_mr_list = tuned_mr_list
+        self.default_score = default_score # aggregated miss ratio reduction over the full traces
+        self.tuned_score = tuned_score
+
+    def to_dict(self):
+        return {
+            "default_params": self.default_params,
+            "tuned_params": self.tuned_params,
+            "default_mr_list": self.default_mr_list,
+            "tuned_mr_list": self.tuned_mr_list,
+            "default_score": self.default_score,
+            "tuned_score": self.tuned_score
+        }
+
+class JointTuner:
+    '''
+    Tune one parameter set of `algo` for a family of traces.
+    Each trial simulates the proposed params on every trace in parallel, and the objective is an aggregate of the miss ratio reduction over FIFO:
+    - aggregate = "mean": the mean reduction,
+    - aggregate = p (float in [0, 100]): the p-th percentile of the reductions, e.g., 10 to tune for the bad traces.
+    If `sample_rate` < 1, the trials run on spatially sampled traces (with the capacity scaled by `sample_rate`) whenever the sampled trace keeps at least `min_sampled_ndv` distinct keys. The default and tuned params are finally evaluated on the full traces.
+    '''
+    sampled_trace_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "analysis", "sampled_trace")
+
+    def __init__(
+        self,
+        algo: str,
+        is_sota: bool,
+        trace_path_list: List[str],
+        cache_cap_list: List[int],
+        aggregate="mean",
+        sample_rate: float=1.0,
+        min_sampled_ndv: int=100,
+        tune_runs: int=20,
+        num_processes: int=None,
+        optimizer: str="auto"
+    ):
+        assert len(trace_path_list) == len(cache_cap_list) and len(trace_path_list) > 0
+        assert aggregate == "mean" or 0 <= float(aggregate) <= 100
+        assert 0 < sample_rate <= 1
+        self.algo = algo
+        self.is_sota = is_sota
+        self.trace_path_list = trace_path_list
+        self.cache_cap_list = cache_cap_list
+        self.aggregate = aggregate
+        self.sample_rate = sample_rate
+        self.min_sampled_ndv = min_sampled_ndv
+        self.tune_runs = tune_runs
+        self.optimizer = optimizer
+        self.num_processes = num_processes if num_processes != None else get_num_workers(len(trace_path_list))
+        # latent variables
+        self._pool = None
+        self._fifo_mr = dict() # (trace_path, cache_cap) -> mr
+
+    def _get_trial_traces(self):
+        '''
+        Return: list of (trace_path, cache_cap) the trials run on
+        '''
+        if self.sample_rate >= 1:
+            return list(zip(self.trace_path_list, self.cache_cap_list))
+        trial_traces = []
+        for trace_path, cache_cap in zip(self.trace_path_list, self.cache_cap_list):
+            sampled_trace_path, sampled_ndv = get_sampled_trace_path(trace_path, self.sample_rate, self.sampled_trace_folder)
+            if sampled_ndv < self.min_sampled_ndv:
+                trial_traces.append((trace_path, cache_cap))
+            else:
+                trial_traces.append((sampled_trace_path, max(1, int(cache_cap * self.sample_rate))))
+        return trial_traces
+
+    def _get_space(self):
+        '''
+        The search space, with the bounds of the smallest cache in the family.
+        '''
+        min_cache_cap = min(self.cache_cap_list)
+        if self.is_sota == True:
+            m_trace_params = get_libcachesim_param_info(self.trace_path_list[0], min_cache_cap)
+            if self.algo not in m_trace_params:
+                return None
+            return get_libcachesim_space(m_trace_params[self.algo])
+        with open(self.algo, 'r') as file:
+            code = file.read()
+        return _get_simulator(self.trace_path_list[0], self.cache_cap_list[0], tune_int_upper=min_cache_cap)._get_configspace(code)
+
+    def _aggregate(self, mrr_list: List[float]):
+        if self.aggregate == "mean":
+            return float(np.mean(mrr_list))
+        return float(np.percentile(mrr_list, float(self.aggregate)))
+
+    def _simulate(self, params: Dict, traces: List):
+        '''
+        Return: (mr_list, score)
+        - score: the aggregated miss ratio reduction; a failed run counts as miss ratio 1.0
+        '''
+        pending = [t for t in traces if t not in self._fifo_mr]
+        if len(pending) > 0:
+            fifo_mr_list = self._pool.map(simulate_params, [("fifo", True, trace_path, cache_cap, dict()) for (trace_path, cache_cap) in pending])
+            for t, fifo_mr in zip(pending, fifo_mr_list):
+                assert fifo_mr != None, f"Fail to simulate FIFO on {t[0]}"
+                self._fifo_mr[t] = fifo_mr
+        mr_list = self._pool.map(simulate_params, [(self.algo, self.is_sota, trace_path, cache_cap, params) for (trace_path, cache_cap) in traces])
+        mrr_list = [
+            miss_ratio_reduction(mr if mr != None else 1.0, self._fifo_mr[t])
+            for t, mr in zip(traces, mr_list)
+        ]
+        return mr_list, self._aggregate(mrr_list)
+
+    def tune(self):
+        '''
+        Return: JointTuningResult | `None` if `algo` has no tunable parameters
+        '''
+        space = self._get_space()
+        if space == None:
+            return None
+        default_params = {k: v.default_value for k, v in dict(space).items()}
+        trial_traces = self._get_trial_traces()
+        full_traces = list(zip(self.trace_path_list, self.cache_cap_list))
+
+        with Pool(self.num_processes) as pool:
+            self._pool = pool
+            def objective(params: Dict):
+                _, score = self._simulate(params, trial_traces)
+                return [-score] # maximize the reduction
+
+            tuned_params = default_params
+            try:
+                history = minimize(
+                    objective=objective,
+                    space=space,
+                    max_runs=self.tune_runs,
+                    optimizer=self.optimizer,
+                    surrogate_type="prf"
+                )
+                if len(history.get_incumbents()) > 0:
+                    tuned_params = dict(history.get_incumbent_configs()[0]).copy()
+            except Exception as error:
+                logging.warning(f"Joint tuning of {self.algo}: FAIL...\n\tError message: {repr(error)}\n{traceback.format_exc()}")
+
+            default_mr_list, default_score = self._simulate(default_params, full_traces)
+            tuned_mr_list, tuned_score = default_mr_list, default_score
+            if tuned_params != default_params:
+                tuned_mr_list, tuned_score = self._simulate(tuned_params, full_traces)
+            self._pool = None
+
+        if tuned_score < default_score:
+            # the trials may have been misled by sampling
+            tuned_params, tuned_mr_list, tuned_score = default_params, default_mr_list, default_score
+        return JointTuningResult(default_params, tuned_params, default_mr_list, tuned_mr_list, default_score, tuned_score)
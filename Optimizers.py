@@ -0,0 +1,445 @@
+import math
+import logging_config
+import logging
+from abc import ABC, abstractmethod
+from typing import Dict, List
+import numpy as np
+
+class IntParam:
+    def __init__(self, name: str, lower: int, upper: int, default_value: int):
+        self.name = name
+        self.lower = int(lower)
+        self.upper = int(upper)
+        self.default_value = int(default_value)
+
+    def __repr__(self):
+        return f"IntParam({self.name}, [{self.lower}, {self.upper}], default={self.default_value})"
+
+class RealParam:
+    def __init__(self, name: str, lower: float, upper: float, default_value: float):
+        self.name = name
+        self.lower = float(lower)
+        self.upper = float(upper)
+        self.default_value = float(default_value)
+
+    def __repr__(self):
+        return f"RealParam({self.name}, [{self.lower}, {self.upper}], default={self.default_value})"
+
+class CategoricalParam:
+    def __init__(self, name: str, choices: List, default_value):
+        assert default_value in choices
+        self.name = name
+        self.choices = list(choices)
+        self.default_value = default_value
+
+    def __repr__(self):
+        return f"CategoricalParam({self.name}, {self.choices}, default={self.default_value})"
+
+class SearchSpace:
+    '''
+    The parameters to tune, in insertion order. A mapping from name to `IntParam` / `RealParam` / `CategoricalParam`, so `dict(space)` works as for an openbox space.
+    Configurations are plain dicts from name to value.
+    '''
+    def __init__(self, params: List=None):
+        self.params = dict()
+        for param in params if params != None else []:
+            self.add(param)
+
+    def add(self, param):
+        assert param.name not in self.params
+        self.params[param.name] = param
+
+    def __getitem__(self, name):
+        return self.params[name]
+
+    def __iter__(self):
+        return iter(self.params)
+
+    def __len__(self):
+        return len(self.params)
+
+    def keys(self):
+        return self.params.keys()
+
+    def __repr__(self):
+        return f"SearchSpace({list(self.params.values())})"
+
+    def get_default_params(self):
+        return {name: param.default_value for name, param in self.params.items()}
+
+    def clip(self, params: Dict):
+        '''
+        Map `params` into the space, clipping numeric values to the bounds. `None` if they do not fit.
+        '''
+        values = dict()
+        for name, param in self.params.items():
+            if name not in params:
+                return None
+            value = params[name]
+            if isinstance(param, CategoricalParam):
+                if value not in param.choices:
+                    return None
+            elif isinstance(param, IntParam):
+                value = int(np.clip(int(round(float(value))), param.lower, param.upper))
+            else:
+                value = float(np.clip(float(value), param.lower, param.upper))
+            values[name] = value
+        return values
+
+    def from_unit(self, units: np.ndarray):
+        '''
+        Args:
+        - units (np.ndarray): (n, len(space)) points in [0, 1]; a categorical coordinate u picks choice floor(u * #choices)
+        Return: list of n params
+        '''
+        columns = dict()
+        for i, (name, param) in enumerate(self.params.items()):
+            u = np.clip(units[:, i], 0.0, 1.0)
+            if isinstance(param, CategoricalParam):
+                indices = np.minimum((u * len(param.choices)).astype(int), len(param.choices) - 1)
+                columns[name] = [param.choices[j] for j in indices]
+            elif isinstance(param, IntParam):
+                columns[name] = [int(v) for v in np.clip(np.floor(param.lower + u * (param.upper - param.lower + 1)), param.lower, param.upper)]
+            else:
+                columns[name] = [float(v) for v in param.lower + u * (param.upper - param.lower)]
+        return [{name: columns[name][k] for name in self.params} for k in range(units.shape[0])]
+
+    def to_unit(self, params_list: List[Dict]):
+        '''
+        Inverse of `from_unit`: the center of the cell of each value. Return: (n, len(space)) np.ndarray
+        '''
+        units = np.zeros((len(params_list), len(self.params)))
+        for i, (name, param) in enumerate(self.params.items()):
+            for k, params in enumerate(params_list):
+                if isinstance(param, CategoricalParam):
+                    units[k, i] = (param.choices.index(params[name]) + 0.5) / len(param.choices)
+                elif isinstance(param, IntParam):
+                    units[k, i] = (params[name] - param.lower + 0.5) / (param.upper - param.lower + 1)
+                elif param.upper > param.lower:
+                    units[k, i] = (params[name] - param.lower) / (param.upper - param.lower)
+        return units
+
+class Trial:
+    def __init__(self, params: Dict, objectives: List[float]):
+        self.params = params
+        self.objectives = objectives
+
+    def __repr__(self):
+        return f"Trial({self.params}, {self.objectives})"
+
+class TuningHistory:
+    '''
+    The evaluated trials. All objectives are minimized.
+    '''
+    def __init__(self, num_objectives: int=1):
+        self.num_objectives = num_objectives
+        self.trials: List[Trial] = []
+
+    def __len__(self):
+        return len(self.trials)
+
+    def add(self, params: Dict, objectives: List[float]):
+        assert len(objectives) == self.num_objectives
+        self.trials.append(Trial(params, [float(o) for o in objectives]))
+
+    def get_objectives(self):
+        '''
+        Return: (len(history), num_objectives) np.ndarray
+        '''
+        return np.array([t.objectives for t in self.trials]).reshape(len(self.trials), self.num_objectives)
+
+    def get_incumbents(self):
+        '''
+        Return: the (first) best trials, a single-objective history only
+        '''
+        assert self.num_objectives == 1
+        if len(self.trials) == 0:
+            return []
+        best = min(t.objectives[0] for t in self.trials)
+        return [t for t in self.trials if t.objectives[0] == best]
+
+    def get_incumbent_value(self):
+        return self.get_incumbents()[0].objectives[0]
+
+    def get_incumbent_configs(self):
+        return [t.params for t in self.get_incumbents()]
+
+    def get_pareto_front(self):
+        '''
+        Return: the non-dominated trials
+        '''
+        objectives = self.get_objectives()
+        return [
+            t for i, t in enumerate(self.trials)
+            if not np.any(np.all(objectives <= objectives[i], axis=1) & np.any(objectives < objectives[i], axis=1))
+        ]
+
+class OptimizerBackend(ABC):
+    '''
+    An ask-tell optimizer over a `SearchSpace`.
+    - `ask(n)`: propose n configurations, e.g., one batch to evaluate in parallel or in lockstep
+    - `tell(params_list, objectives_list)`: report their objectives (all minimized)
+    Backend-specific keyword arguments that a backend does not understand are ignored.
+    '''
+    def __init__(self, space: SearchSpace, num_objectives: int=1, batch_size: int=1, initial_configurations: List[Dict]=None, seed: int=42, **kwargs):
+        self.space = space
+        self.num_objectives = num_objectives
+        self.batch_size = batch_size # the usual number of configurations per `ask()`
+        self.history = TuningHistory(num_objectives)
+        self.rng = np.random.default_rng(seed)
+        # configurations to propose first: the default one, then e.g. warm-start configurations
+        self._initial_configurations = [space.get_default_params()]
+        for params in initial_configurations if initial_configurations != None else []:
+            params = space.clip(params)
+            if params != None and params not in self._initial_configurations:
+                self._initial_configurations.append(params)
+        if len(kwargs) > 0:
+            logging.debug(f"{type(self).__name__} ignores {sorted(kwargs.keys())}")
+
+    def _pop_initial_configurations(self, n: int):
+        params_list = self._initial_configurations[:n]
+        self._initial_configurations = self._initial_configurations[n:]
+        return params_list
+
+    def _sample_uniform(self, n: int):
+        '''
+        Latin hypercube sample of n configurations.
+        '''
+        if n <= 0:
+            return []
+        strata = np.argsort(self.rng.random((n, len(self.space))), axis=0)
+        units = (strata + self.rng.random((n, len(self.space)))) / n
+        return self.space.from_unit(units)
+
+    @abstractmethod
+    def ask(self, n: int=1) -> List[Dict]:
+        pass
+
+    def tell(self, params_list: List[Dict], objectives_list: List[List[float]]):
+        for params, objectives in zip(params_list, objectives_list):
+            self.history.add(params, objectives)
+
+class RandomSearch(OptimizerBackend):
+    '''
+    Latin hypercube random search; the default configuration is evaluated first.
+    '''
+    def ask(self, n: int=1):
+        params_list = self._pop_initial_configurations(n)
+        return params_list + self._sample_uniform(n - len(params_list))
+
+class TPE(OptimizerBackend):
+    '''
+    Tree-structured Parzen estimator in NumPy.
+    After `num_startup` random trials, the trials are split into the best `gamma` fraction and the rest. Each part is modeled by a Parzen density with a uniform prior component: Gaussian kernels for numeric params (in the unit cube), smoothed frequencies for categorical ones. The proposals are the candidates, sampled from the good density, that maximize good / bad; a fraction `rand_prob` of the proposals is random.
+    Several objectives are scalarized by a random augmented Chebyshev weighting per `ask()` (as ParEGO).
+    '''
+    def __init__(self, space: SearchSpace, num_objectives: int=1, batch_size: int=1, initial_configurations: List[Dict]=None, seed: int=42, num_startup: int=None, gamma: float=0.25, num_candidates: int=64, rand_prob: float=0.1, **kwargs):
+        super().__init__(space, num_objectives, batch_size, initial_configurations, seed, **kwargs)
+        self.num_startup = num_startup if num_startup != None else max(3, min(10, len(space) + 1))
+        self.gamma = gamma
+        self.num_candidates = num_candidates
+        self.rand_prob = rand_prob
+        self._is_categorical = np.array([isinstance(p, CategoricalParam) for p in space.params.values()])
+        self._num_choices = np.array([len(p.choices) if isinstance(p, CategoricalParam) else 0 for p in space.params.values()])
+
+    def _get_scores(self):
+        objectives = self.history.get_objectives()
+        finite = np.isfinite(objectives)
+        for j in range(objectives.shape[1]):
+            column = objectives[:, j]
+            worst = column[finite[:, j]].max() + 1.0 if finite[:, j].any() else 0.0
+            column[~finite[:, j]] = worst # failed trials
+        if objectives.shape[1] == 1:
+            return objectives[:, 0]
+        lower = objectives.min(axis=0)
+        scale = objectives.max(axis=0) - lower
+        scale[scale == 0] = 1.0
+        normalized = (objectives - lower) / scale
+        weights = self.rng.dirichlet(np.ones(objectives.shape[1]))
+        return (normalized * weights).max(axis=1) + 0.05 * (normalized * weights).sum(axis=1)
+
+    def _to_choice(self, units: np.ndarray):
+        return np.minimum((units * np.maximum(self._num_choices, 1)).astype(int), np.maximum(self._num_choices - 1, 0))
+
+    def _fit(self, units: np.ndarray):
+        '''
+        Return: (points, bandwidth of each numeric dim, choice probabilities of each categorical dim)
+        '''
+        n = units.shape[0]
+        numeric = units[:, ~self._is_categorical]
+        std = numeric.std(axis=0) if n > 1 else np.ones(numeric.shape[1])
+        bandwidth = np.clip(std * n ** (-1 / (len(self.space) + 4)), 1.0 / min(100, n + 1), 1.0)
+        choices = self._to_choice(units)
+        probs = []
+        for i in np.nonzero(self._is_categorical)[0]:
+            counts = np.bincount(choices[:, i], minlength=self._num_choices[i]) + 1.0 # uniform prior
+            probs.append(counts / counts.sum())
+        return units, bandwidth, probs
+
+    def _log_density(self, units: np.ndarray, model):
+        '''
+        log of (sum of the kernels at the points + the uniform prior) / (#points + 1); categorical dims are independent.
+        '''
+        points, bandwidth, probs = model
+        diff = (units[:, None, ~self._is_categorical] - points[None, :, ~self._is_categorical]) / bandwidth
+        log_kernels = (-0.5 * diff ** 2 - np.log(bandwidth * math.sqrt(2 * math.pi))).sum(axis=2)
+        log_kernels = np.concatenate([log_kernels, np.zeros((units.shape[0], 1))], axis=1) # uniform prior
+        top = log_kernels.max(axis=1, keepdims=True)
+        log_density = (top + np.log(np.exp(log_kernels - top).sum(axis=1, keepdims=True)))[:, 0] - math.log(points.shape[0] + 1)
+        choices = self._to_choice(units)
+        for i, p in zip(np.nonzero(self._is_categorical)[0], probs):
+            log_density += np.log(p[choices[:, i]])
+        return log_density
+
+    def _sample(self, model, num: int):
+        points, bandwidth, probs = model
+        centers = points[self.rng.integers(0, points.shape[0], num)]
+        from_prior = self.rng.random(num) < 1.0 / (points.shape[0] + 1)
+        centers[from_prior] = self.rng.random((int(from_prior.sum()), points.shape[1]))
+        units = centers.copy()
+        units[:, ~self._is_categorical] = np.clip(centers[:, ~self._is_categorical] + self.rng.normal(size=(num, bandwidth.shape[0])) * bandwidth, 0.0, 1.0)
+        for i, p in zip(np.nonzero(self._is_categorical)[0], probs):
+            units[:, i] = (self.rng.choice(len(p), size=num, p=p) + 0.5) / len(p)
+        return units
+
+    def ask(self, n: int=1):
+        params_list = self._pop_initial_configurations(n)
+        n -= len(params_list)
+        if n <= 0 or len(self.history) < self.num_startup:
+            return params_list + self._sample_uniform(n)
+
+        num_random = int((self.rng.random(n) < self.rand_prob).sum())
+        n -= num_random
+        units = self.space.to_unit([t.params for t in self.history.trials])
+        order = np.argsort(self._get_scores(), kind="stable")
+        num_good = max(1, int(math.ceil(self.gamma * len(order))))
+        good_model = self._fit(units[order[:num_good]])
+        bad_model = self._fit(units[order[num_good:]] if num_good < len(order) else units)
+
+        candidates = self._sample(good_model, self.num_candidates * max(n, 1))
+        ratios = self._log_density(candidates, good_model) - self._log_density(candidates, bad_model)
+        evaluated = [t.params for t in self.history.trials] + params_list
+        for k in np.argsort(-ratios, kind="stable"):
+            if n == 0:
+                break
+            params = self.space.from_unit(candidates[k:k + 1])[0]
+            if params in evaluated:
+                continue
+            params_list.append(params)
+            evaluated.append(params)
+            n -= 1
+        # random proposals, and a fill-up if the space is exhausted (e.g., few integer values)
+        return params_list + self._sample_uniform(n + num_random)
+
+class OpenBoxBackend(OptimizerBackend):
+    '''
+    OpenBox's Bayesian optimization (`openbox.Advisor`, or `openbox.SyncBatchAdvisor` if `batch_size` > 1). openbox is imported on construction only.
+    - surrogate_type, acq_type, init_strategy: as for `openbox.Optimizer`
+    - transfer_learning_history (List[(task_id, List[(params, objectives)])]): source tasks for a transfer-learning surrogate
+    '''
+    def __init__(self, space: SearchSpace, num_objectives: int=1, batch_size: int=1, initial_configurations: List[Dict]=None, seed: int=42, surrogate_type: str="prf", acq_type: str="auto", init_strategy: str="random_explore_first", transfer_learning_history: List=None, **kwargs):
+        super().__init__(space, num_objectives, batch_size, initial_configurations, seed, **kwargs)
+        import openbox
+        from openbox import space as sp
+        self._openbox = openbox
+        self._space = sp.Space()
+        for param in space.params.values():
+            if isinstance(param, IntParam):
+                self._space.add_variable(sp.Int(param.name, param.lower, param.upper, default_value=param.default_value))
+            elif isinstance(param, RealParam):
+                self._space.add_variable(sp.Real(param.name, param.lower, param.upper, default_value=param.default_value))
+            else:
+                self._space.add_variable(sp.Categorical(param.name, choices=param.choices, default_value=param.default_value))
+        advisor_kwargs = dict(
+            config_space=self._space,
+            num_objectives=num_objectives,
+            num_constraints=0,
+            init_strategy=init_strategy,
+            surrogate_type=surrogate_type,
+            acq_type=acq_type,
+            random_state=seed
+        )
+        if initial_configurations != None:
+            # the default configuration is proposed first, as by `openbox.Optimizer`
+            advisor_kwargs["initial_trials"] = len(self._initial_configurations)
+            advisor_kwargs["initial_configurations"] = [self._to_configuration(params) for params in self._initial_configurations]
+        if transfer_learning_history != None:
+            advisor_kwargs["transfer_learning_history"] = [self._to_history(task_id, trials) for (task_id, trials) in transfer_learning_history]
+        self._initial_configurations = [] # proposed by the advisor
+        if batch_size > 1:
+            self._advisor = openbox.SyncBatchAdvisor(batch_size=batch_size, **advisor_kwargs)
+        else:
+            self._advisor = openbox.Advisor(**advisor_kwargs)
+
+    def _to_configuration(self, params: Dict):
+        from openbox import space as sp
+        return sp.Configuration(self._space, params)
+
+    def _to_history(self, task_id: str, trials: List):
+        history = self._openbox.History(task_id=task_id, num_objectives=self.num_objectives, num_constraints=0, config_space=self._space)
+        for params, objectives in trials:
+            history.update_observation(self._openbox.Observation(config=self._to_configuration(params), objectives=objectives))
+        return history
+
+    def ask(self, n: int=1):
+        if self.batch_size > 1:
+            configs = self._advisor.get_suggestions(batch_size=n)
+        else:
+            configs = [self._advisor.get_suggestion() for _ in range(n)]
+        return [dict(config).copy() for config in configs]
+
+    def tell(self, params_list: List[Dict], objectives_list: List[List[float]]):
+        super().tell(params_list, objectives_list)
+        observations = [
+            self._openbox.Observation(config=self._to_configuration(params), objectives=list(objectives))
+            for params, objectives in zip(params_list, objectives_list)
+        ]
+        if self.batch_size > 1:
+            self._advisor.update_observations(observations)
+        else:
+            for observation in observations:
+                self._advisor.update_observation(observation)
+
+optimizer_backends = {
+    "random": RandomSearch,
+    "tpe": TPE,
+    "openbox": OpenBoxBackend,
+}
+
+def register_optimizer(name: str, backend: type):
+    '''
+    Make a subclass of `OptimizerBackend` available as `optimizer=name`.
+    '''
+    assert issubclass(backend, OptimizerBackend)
+    optimizer_backends[name] = backend
+
+def resolve_optimizer(optimizer: str="auto"):
+    '''
+    "auto" is "tpe", which fits no surrogate; "openbox" is opt-in.
+    '''
+    if optimizer == "auto":
+        return "tpe"
+    if optimizer not in optimizer_backends:
+        raise ValueError(f"Unknown optimizer: {optimizer}. Choose from {['auto'] + list(optimizer_backends.keys())}")
+    return optimizer
+
+def get_optimizer(space: SearchSpace, optimizer: str="auto", num_objectives: int=1, batch_size: int=1, **kwargs) -> OptimizerBackend:
+    return optimizer_backends[resolve_optimizer(optimizer)](space, num_objectives=num_objectives, batch_size=batch_size, **kwargs)
+
+def minimize(objective, space: SearchSpace, max_runs: int, optimizer: str="auto", num_objectives: int=1, batch_size: int=1, evaluate_batch=None, **kwargs):
+    '''
+    Args:
+    - objective (func): params (dict) -> objectives (list of floats, all minimized)
+    - evaluate_batch (func | None): list of params -> list of objectives; evaluates each batch of `batch_size` at once instead of calling `objective`
+    - kwargs: backend-specific, e.g., `initial_configurations`, `surrogate_type`
+    Return: TuningHistory
+    '''
+    backend = get_optimizer(space, optimizer, num_objectives, batch_size, **kwargs)
+    while len(backend.history) < max_runs:
+        params_list = backend.ask(min(batch_size, max_runs - len(backend.history)))
+        if evaluate_batch != None:
+            objectives_list = evaluate_batch(params_list)
+        else:
+            objectives_list = [objective(params) for params in params_list]
+        backend.tell(params_list, objectives_list)
+    return backend.history
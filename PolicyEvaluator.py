@@ -1,28 +1,90 @@
 from typing import Dict, List
 import os
 import json
+import heapq
+import itertools
+import traceback
 import logging
 import logging_config
-from cache import Trace
-from utils import tune_libcachesim, run_libcachesim, write_to_file, plot_mr, miss_ratio_reduction
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+from cache import Trace, load_trace_columns, load_trace_keys, get_trace_length
+from utils import get_engine, get_stored_engine, tune_libcachesim, run_libcachesim, run_libcachesim_many, run_libcachesim_warm, get_libcachesim_cost, libcachesim_params_to_str, plot_mr, miss_ratio_reduction
 from cache import CacheConfig
 from Simulator import SimulatorCache, SimulatorConfig
+from WarmStarter import PriorResult, WarmStarter
+from JointTuner import JointTuner, simulate_params
+from ResultStore import ResultStore, hash_params
+from Scheduler import get_num_workers, estimate_cost
+from multiprocessing import Pool
+
+def get_trace_ndv(trace_path: str):
+    return len(np.unique(load_trace_columns(trace_path)["key"]))
+
+_split_checks = dict() # ((path, size, mtime) of the train, test and full traces) -> whether the train and test traces split the full one
+
+def is_trace_split(train_trace_path: str, test_trace_path: str, full_trace_path: str, num_checked_keys: int=64):
+    '''
+    Whether the train and test traces are the two contiguous parts of the full trace: the lengths must add up, and the first and last `num_checked_keys` keys of each part must match the full trace.
+    Memoized per version of the three files.
+    '''
+    check_key = tuple([(path, os.path.getsize(path), os.path.getmtime(path)) for path in [train_trace_path, test_trace_path, full_trace_path]])
+    if check_key not in _split_checks:
+        train_len, test_len = get_trace_length(train_trace_path), get_trace_length(test_trace_path)
+        is_split = train_len + test_len == get_trace_length(full_trace_path)
+        for (path, offset, length) in [(train_trace_path, 0, train_len), (test_trace_path, train_len, test_len)]:
+            for start in sorted(set([0, max(0, length - num_checked_keys)])):
+                if is_split == True:
+                    count = min(num_checked_keys, length - start)
+                    is_split = np.array_equal(load_trace_keys(path, start, count), load_trace_keys(full_trace_path, offset + start, count))
+        _split_checks[check_key] = is_split
+    return _split_checks[check_key]
+
+_worker_evaluator = None # the `PolicyEvaluator` of an `eval_many` worker process
+
+def _run_eval_stage(args):
+    '''
+    Run one stage of an `eval_many` job in a worker process.
+    Args: (stage, stage_args)
+    - "stats": full_trace_path -> ndv
+    - "tune": (algo, is_sota, train_trace_path, cache_cap, prior_results | None, need_default_run) -> (default_mr, tuned_mr, default_params, tuned_params)
+    - "test": (algo, is_sota, test_trace_path, cache_cap, params) -> miss ratio | `None` if fail
+    - "warm": (algo, is_sota, train_trace_path, test_trace_path, full_trace_path, cache_cap, params_list) -> (train mr, warm test mr) pairs, see `PolicyEvaluator._simulate_warm`
+    '''
+    global _worker_evaluator
+    stage, stage_args = args
+    if stage == "stats":
+        return get_trace_ndv(stage_args)
+    if _worker_evaluator == None:
+        _worker_evaluator = PolicyEvaluator()
+    if stage == "tune":
+        algo, is_sota, trace_path, cache_cap, prior_results, need_default_run = stage_args
+        return _worker_evaluator._tune(algo, is_sota, trace_path, cache_cap, WarmStarter(prior_results) if prior_results != None else None, need_default_run)
+    if stage == "warm":
+        algo, is_sota, train_trace_path, test_trace_path, full_trace_path, cache_cap, params_list = stage_args
+        return _worker_evaluator._simulate_warm(algo, train_trace_path, test_trace_path, full_trace_path, cache_cap, params_list, is_sota)
+    algo, is_sota, trace_path, cache_cap, params = stage_args
+    return _worker_evaluator._simulate(algo, trace_path, cache_cap, params, is_sota)
 
 class MissRatioInfo:
-    def __init__(self, params: Dict, mr_train: float, mr_test: float):
+    def __init__(self, params: Dict, mr_train: float, mr_test: float, cost_train: Dict=None, cost_test: Dict=None):
         self.params = params
         self.mr_train = mr_train
         self.mr_test = mr_test
+        self.cost_train = cost_train # see `Telemetry.make_cost`; `None` if unknown
+        self.cost_test = cost_test
 
     def to_dict(self):
         return {
             "params": self.params,
             "mr_train": self.mr_train,
-            "mr_test": self.mr_test
+            "mr_test": self.mr_test,
+            "cost_train": self.cost_train,
+            "cost_test": self.cost_test
         }
     
 class Entry:
-    def __init__(self, trace_type: str, trace_file_name: str, train_frac: int, cache_cap: int, cache_cap_frac: float, algo: str, is_sota: bool, init_param_mr_info: MissRatioInfo, tuned_param_mr_info: MissRatioInfo):
+    def __init__(self, trace_type: str, trace_file_name: str, train_frac: int, cache_cap: int, cache_cap_frac: float, algo: str, is_sota: bool, init_param_mr_info: MissRatioInfo, tuned_param_mr_info: MissRatioInfo, joint_tuning: Dict=None, test_mode: str="cold", engine: str=None):
         self.trace_type = trace_type
         self.trace_file_name = trace_file_name
         self.train_frac = train_frac # 10-base frac, thus this is an integer
@@ -32,6 +94,9 @@ class Entry:
         self.is_sota = is_sota
         self.init_param_mr_info = init_param_mr_info
         self.tuned_param_mr_info = tuned_param_mr_info
+        self.joint_tuning = joint_tuning # `None` if tuned on this trace alone, else {"trace_file_names", "aggregate", "sample_rate"}
+        self.test_mode = test_mode # "cold": the test split is replayed on an empty cache; "warm": on the cache warmed by the train split
+        self.engine = engine if engine != None else get_engine(algo, is_sota) # see `utils.get_engine`
 
     def __str__(self):
         return f"({self.algo}, {self.trace_type}, {self.trace_file_name}, train={self.train_frac}, ccf={self.cache_cap_frac})"
@@ -39,6 +104,22 @@ class Entry:
     def __repr__(self):
         return f"({self.algo}, {self.trace_type}, {self.trace_file_name}, train={self.train_frac}, ccf={self.cache_cap_frac})"
 
+    @property
+    def store_columns(self):
+        '''
+        The key columns in `ResultStore`.
+        '''
+        return {
+            "algo": self.algo,
+            "cache_cap_frac": self.cache_cap_frac,
+            "train_frac": self.train_frac,
+            "trace_type": self.trace_type,
+            "joint_hash": hash_params(self.joint_tuning),
+            "test_mode": self.test_mode,
+            "engine": self.engine,
+            "trace": self.trace_file_name
+        }
+
     @classmethod
     def from_dict(cls, trace_analysis_entry_dict):
         return Entry(
@@ -53,12 +134,19 @@ class Entry:
                 params=trace_analysis_entry_dict["init_param_mr_info"]["params"], 
                 mr_train=trace_analysis_entry_dict["init_param_mr_info"]["mr_train"], 
                 mr_test=trace_analysis_entry_dict["init_param_mr_info"]["mr_test"], 
+                cost_train=trace_analysis_entry_dict["init_param_mr_info"].get("cost_train", None),
+                cost_test=trace_analysis_entry_dict["init_param_mr_info"].get("cost_test", None),
             ),
             tuned_param_mr_info=MissRatioInfo(
                 params=trace_analysis_entry_dict["tuned_param_mr_info"]["params"], 
                 mr_train=trace_analysis_entry_dict["tuned_param_mr_info"]["mr_train"], 
                 mr_test=trace_analysis_entry_dict["tuned_param_mr_info"]["mr_test"], 
+                cost_train=trace_analysis_entry_dict["tuned_param_mr_info"].get("cost_train", None),
+                cost_test=trace_analysis_entry_dict["tuned_param_mr_info"].get("cost_test", None),
             ),
+            joint_tuning=trace_analysis_entry_dict.get("joint_tuning", None),
+            test_mode=trace_analysis_entry_dict.get("test_mode", "cold"),
+            engine=get_stored_engine(trace_analysis_entry_dict),
         )
 
     @classmethod
@@ -77,6 +165,9 @@ class Entry:
             "is_sota": self.is_sota,
             "init_param_mr_info": self.init_param_mr_info.to_dict(),
             "tuned_param_mr_info": self.tuned_param_mr_info.to_dict(),
+            "joint_tuning": self.joint_tuning,
+            "test_mode": self.test_mode,
+            "engine": self.engine,
         }
         return trace_analysis_entry_dict
     
@@ -90,11 +181,44 @@ class PolicyEvaluator:
     policy_eval_jsonl_path = os.path.join(trace_analysis_folder, "policy_eval.jsonl")
 
     def __init__(self):
-        with open(self.policy_eval_jsonl_path, 'r') as file:
-            file_lines = file.readlines()
-        self.entries = [Entry.from_jsonl(l) for l in file_lines]
+        self.store = ResultStore.default()
+        # the results of the legacy JSONL file (e.g., absent on the worker hosts of a `JobBroker`) are stored once
+        self.store.import_jsonl("policy_eval", self.policy_eval_jsonl_path, lambda d: Entry.from_dict(d).store_columns)
+
+    def find_entries(self, **conditions):
+        '''
+        Indexed lookup, see `ResultStore.find`: the conditions are on algo, cache_cap_frac, train_frac, trace_type, joint_hash, test_mode, engine and trace (the trace file name).
+        Return: list of `Entry`
+        '''
+        return [Entry.from_dict(d) for d in self.store.find("policy_eval", **conditions)]
 
-    def _get_trace_path(self, trace_type, trace_file_name, train_frac: int, is_train: bool):
+    def find_entry(self, trace_type: str, trace_file_name: str, train_frac: int, cache_cap_frac: float, algo: str, test_mode: str="cold", engine: str=None):
+        '''
+        - engine (str | None): see `utils.get_engine`; `None` matches any engine
+        Return: the evaluated (not jointly tuned) `Entry` | `None`
+        '''
+        entries = self.find_entries(
+            algo=algo,
+            cache_cap_frac=cache_cap_frac,
+            train_frac=train_frac,
+            trace_type=trace_type,
+            joint_hash=hash_params(None),
+            test_mode=test_mode,
+            engine=engine,
+            trace=trace_file_name
+        )
+        return entries[0] if len(entries) > 0 else None
+
+    def add_entries(self, entries: List[Entry]):
+        '''
+        Stored in one transaction; an entry whose key is already stored is skipped.
+        '''
+        self.store.put_many("policy_eval", [(e.store_columns, e.to_dict()) for e in entries])
+
+    def add_entry(self, entry: Entry):
+        self.add_entries([entry])
+
+    def _get_trace_path(self, trace_type, trace_file_name, train_frac: int, is_train: bool, must_exist: bool=True):
         # full trace
         if is_train == None:
             if trace_type == "fwe" or trace_type == "multikey":
@@ -120,7 +244,8 @@ class PolicyEvaluator:
                 assert trace_file_name in trace_file_name
             else:
                 raise ValueError(f"Unknown trace type: {trace_type}")
-        assert os.path.exists(trace_path)
+        if must_exist == True:
+            assert os.path.exists(trace_path)
         return trace_path
 
     def _get_simulator(self, trace_path, cache_cap):
@@ -143,70 +268,97 @@ class PolicyEvaluator:
             )
         )
 
-    def _tune_sota(self, algo, trace_path, cache_cap):
+    def get_prior_results(self, algo, train_frac: int, cache_cap_frac: float):
+        '''
+        The init and tuned observations of `algo` on the train split of every evaluated trace, for `WarmStarter`.
+        '''
+        prior_results = []
+        for entry in self.find_entries(algo=algo, train_frac=train_frac, cache_cap_frac=cache_cap_frac):
+            try:
+                train_trace_path = self._get_trace_path(entry.trace_type, entry.trace_file_name, entry.train_frac, is_train=True, must_exist=False)
+            except ValueError:
+                continue
+            for mr_info in [entry.init_param_mr_info, entry.tuned_param_mr_info]:
+                prior_results.append(PriorResult(train_trace_path, mr_info.params, mr_info.mr_train))
+        return prior_results
+
+    def _tune_sota(self, algo, trace_path, cache_cap, warm_starter=None, need_default_run: bool=True):
         miss_ratio_info_tuple = tune_libcachesim(
             trace=trace_path,
             alg=algo,
-            cache_cap=cache_cap
+            cache_cap=cache_cap,
+            warm_starter=warm_starter,
+            need_default_run=need_default_run
         )
         assert miss_ratio_info_tuple != None
         return miss_ratio_info_tuple
 
-    def _tune_not_sota(self, algo, trace_path, cache_cap):
+    def _tune_not_sota(self, algo, trace_path, cache_cap, warm_starter=None, need_default_run: bool=True):
         simulator = self._get_simulator(trace_path, cache_cap)
         code_path = algo
         code_id = algo
         with open(code_path, 'r') as file:
             code = file.read()
-        default_mr = simulator.simulate(
-            code=code,
-            code_id="tune_not_sota",
-            need_log=True,
-            check_code_exists=False,
-            fix_default_param=False,
-            need_save=False,
-        )
-        assert default_mr != None
+        default_mr = None
+        if need_default_run == True:
+            default_mr = self._run_not_sota(simulator, code, params=dict())
+            assert default_mr != None
         tuned_mr, default_params, tuned_params = simulator.tune(
             code=code,
             code_id=code_id,
             fixed_default_param=False,
-            need_log=True
+            need_log=True,
+            need_copy_code=False,
+            warm_starter=warm_starter
         )
-        if tuned_mr == None or tuned_mr > default_mr:
+        simulator.close()
+        if tuned_mr == None or (default_mr != None and tuned_mr > default_mr):
             tuned_mr = default_mr
             tuned_params = default_params
         
         return tuple([default_mr, tuned_mr, default_params, tuned_params])
 
-    def _simulate_sota(self, algo, trace_path, cache_cap, params: Dict):
+    def _get_sota_param_str(self, params: Dict):
         param_str = ""
         for param_name, param_val in params.items():
             if param_str != "":
                 param_str += ","
             param_str += f"{param_name}={param_val}"
-        
+        return param_str
+
+    def _simulate_sota(self, algo, trace_path, cache_cap, params: Dict):
         return run_libcachesim(
             cache_trace=trace_path,
             cache_alg=algo,
             cache_cap=cache_cap,
-            params=param_str
+            params=self._get_sota_param_str(params)
         )
+
+    def _simulate_sota_many(self, algo, trace_path, cache_cap, params_list: List[Dict]):
+        '''
+        Return: the miss ratio of every params, simulated concurrently
+        '''
+        return run_libcachesim_many([(trace_path, algo, cache_cap, self._get_sota_param_str(params)) for params in params_list])
     
+    def _run_not_sota(self, simulator: SimulatorCache, code: str, params: Dict):
+        '''
+        The params are injected into a fresh policy namespace (see `PolicyTemplate`): My.py is not touched, so concurrent evaluations do not interfere.
+        Return: miss ratio | `None` if fail
+        '''
+        try:
+            return simulator._run(code, params=params if params != None else dict())
+        except Exception as error:
+            logging.warning(f"{os.path.basename(simulator.config.trace_path)} with {params}: FAIL...\n\tError message: {repr(error)}")
+            return None
+
     def _simulate_not_sota(self, algo, trace_path, cache_cap, params: Dict):
         simulator = self._get_simulator(trace_path, cache_cap)
         with open(algo, 'r') as file:
             code_str = file.read()
-        return simulator.simulate(
-            code=code_str,
-            code_id="simulate_not_sota",
-            need_log=True,
-            check_code_exists=False,
-            fix_default_param=True,
-            need_save=False,
-            need_copy_code=True,
-            default_params=params
-        )
+        try:
+            return self._run_not_sota(simulator, code_str, params)
+        finally:
+            simulator.close()
     
     def _simulate(self, algo, trace_path, cache_cap, params, is_sota):
         if is_sota == True:
@@ -214,6 +366,117 @@ class PolicyEvaluator:
         else:
             return self._simulate_not_sota(algo, trace_path, cache_cap, params)
 
+    def _simulate_warm(self, algo, train_trace_path, test_trace_path, full_trace_path, cache_cap, params_list: List[Dict], is_sota):
+        '''
+        Replay the full trace once for every params: the train miss ratio is the one of the train split, and the test miss ratio the one of the requests after it, on the cache warmed by the train split.
+        Raise `ValueError` if the train and test splits are not the two contiguous parts of the full trace (see `is_trace_split`).
+        Return: the (train mr, warm test mr) pair of every params, `None` if fail
+        '''
+        if not is_trace_split(train_trace_path, test_trace_path, full_trace_path):
+            raise ValueError(f"{train_trace_path} and {test_trace_path} do not split {full_trace_path}: use test_mode=\"cold\"")
+        if is_sota == True:
+            mr_pairs = run_libcachesim_warm(full_trace_path, train_trace_path, algo, cache_cap, [self._get_sota_param_str(params) for params in params_list])
+        else:
+            simulator = self._get_simulator(full_trace_path, cache_cap)
+            with open(algo, 'r') as file:
+                code = file.read()
+            try:
+                mr_pairs = simulator.simulate_lockstep([code for _ in params_list], [params if params != None else dict() for params in params_list], split=get_trace_length(train_trace_path))
+            finally:
+                simulator.close()
+        return [tuple(mr_pair) if mr_pair != None else None for mr_pair in mr_pairs]
+
+    def _get_test_params_list(self, entry: Entry):
+        '''
+        The params to test: [init params] if tuning kept them, else [init params, tuned params].
+        '''
+        if entry.tuned_param_mr_info.params == entry.init_param_mr_info.params:
+            return [entry.init_param_mr_info.params]
+        return [entry.init_param_mr_info.params, entry.tuned_param_mr_info.params]
+
+    def _set_warm_results(self, entry: Entry, mr_pairs: List):
+        '''
+        `mr_pairs`: the `_simulate_warm` pairs of `_get_test_params_list(entry)`, tuned with `need_default_run=False`.
+        The train miss ratios come from the warm replay, which also decides between the init and the tuned params.
+        '''
+        if mr_pairs[0] == None:
+            raise ValueError(f"{str(entry)}: fail to replay the init params")
+        if mr_pairs[-1] == None or mr_pairs[-1][0] > mr_pairs[0][0]:
+            # the tuning failed, or its incumbent is worse than the init params
+            entry.tuned_param_mr_info.params = entry.init_param_mr_info.params
+            mr_pairs = mr_pairs[:1]
+        entry.init_param_mr_info.mr_train, entry.init_param_mr_info.mr_test = mr_pairs[0]
+        entry.tuned_param_mr_info.mr_train, entry.tuned_param_mr_info.mr_test = mr_pairs[-1]
+
+    def _get_cost(self, algo, is_sota, trace_path, cache_cap, params: Dict, split: int=None):
+        '''
+        The cost (see `Telemetry.make_cost`) memoized with the miss ratio of a run of `_simulate`, or of `_simulate_warm` with `split`.
+        Return: cost dict | `None` if not memoized
+        '''
+        if is_sota == True:
+            return get_libcachesim_cost(trace_path, algo, cache_cap, self._get_sota_param_str(params), split)
+        with open(algo, 'r') as file:
+            code = file.read()
+        return self._get_simulator(trace_path, cache_cap).get_cost(code, params if params != None else dict(), split)
+
+    def _set_costs(self, entry: Entry, train_trace_path, test_trace_path, full_trace_path):
+        '''
+        Copy the cost of every run of the entry from the `ResultCache`, where the runs (possibly in worker processes) memoized it with their miss ratio.
+        '''
+        init_info, tuned_info = entry.init_param_mr_info, entry.tuned_param_mr_info
+        if entry.test_mode == "warm":
+            # both splits come from one replay of the full trace
+            for mr_info in [init_info, tuned_info]:
+                mr_info.cost_test = self._get_cost(entry.algo, entry.is_sota, full_trace_path, entry.cache_cap, mr_info.params, split=get_trace_length(train_trace_path))
+                mr_info.cost_train = mr_info.cost_test
+            return
+        # train: the default run of `_tune`, then the tuning trial of the tuned params
+        if entry.is_sota == True:
+            init_info.cost_train = get_libcachesim_cost(train_trace_path, entry.algo, entry.cache_cap)
+        else:
+            init_info.cost_train = self._get_cost(entry.algo, False, train_trace_path, entry.cache_cap, dict())
+        tuned_info.cost_train = init_info.cost_train
+        if tuned_info.params != init_info.params:
+            if entry.is_sota == True:
+                tuned_info.cost_train = get_libcachesim_cost(train_trace_path, entry.algo, entry.cache_cap, " -e " + libcachesim_params_to_str(entry.algo, tuned_info.params))
+            else:
+                tuned_info.cost_train = self._get_cost(entry.algo, False, train_trace_path, entry.cache_cap, tuned_info.params)
+        # test
+        for mr_info in [init_info, tuned_info]:
+            mr_info.cost_test = self._get_cost(entry.algo, entry.is_sota, test_trace_path, entry.cache_cap, mr_info.params)
+
+    def _tune(self, algo, is_sota, trace_path, cache_cap, warm_starter=None, need_default_run: bool=True):
+        '''
+        - need_default_run (bool): run the default params on the train trace; a "warm" `test_mode` skips it, as its replay of the full trace gives the train miss ratio of the default params (see `_set_warm_results`)
+        Return: (default_mr, tuned_mr, default_params, tuned_params); default_mr is `None` without `need_default_run`
+        '''
+        if is_sota == True:
+            miss_ratio_info_tuple = self._tune_sota(algo=algo, trace_path=trace_path, cache_cap=cache_cap, warm_starter=warm_starter, need_default_run=need_default_run)
+        else:
+            miss_ratio_info_tuple = self._tune_not_sota(algo=algo, trace_path=trace_path, cache_cap=cache_cap, warm_starter=warm_starter, need_default_run=need_default_run)
+        assert miss_ratio_info_tuple != None
+        return miss_ratio_info_tuple
+
+    def _new_entry(self, job: Dict, cache_cap: int):
+        return Entry(
+            trace_type=job["trace_type"],
+            trace_file_name=job["trace_file_name"],
+            train_frac=job["train_frac"],
+            cache_cap=cache_cap,
+            cache_cap_frac=job["cache_cap_frac"],
+            algo=job["algo"],
+            is_sota=job["is_sota"],
+            init_param_mr_info=MissRatioInfo(None, None, None),
+            tuned_param_mr_info=MissRatioInfo(None, None, None),
+            test_mode=job.get("test_mode", "cold")
+        )
+
+    def _set_train_results(self, entry: Entry, miss_ratio_info_tuple):
+        entry.init_param_mr_info.mr_train = miss_ratio_info_tuple[0] # defualt_mr
+        entry.tuned_param_mr_info.mr_train = miss_ratio_info_tuple[1] # tuned_mr
+        entry.init_param_mr_info.params = miss_ratio_info_tuple[2] # default_param
+        entry.tuned_param_mr_info.params = miss_ratio_info_tuple[3] # tuned_param
+
     def eval(
         self,
         trace_type: str,
@@ -221,18 +484,23 @@ class PolicyEvaluator:
         train_frac: int,
         cache_cap_frac: float,
         algo: str,
-        is_sota: bool
+        is_sota: bool,
+        warm_start: bool=False,
+        test_mode: str="cold",
+        need_save: bool=True
     ):
+        '''
+        - warm_start (bool): seed the tuning with the tuned params of `algo` on the most similar evaluated train traces
+        - test_mode ("cold" | "warm"): replay the test split on an empty cache, or replay the full trace once so that the test split runs on the cache warmed by the train split, as in production
+        - need_save (bool): store the new entry in the result store; a `JobBroker` worker leaves it to the broker
+        '''
+        assert test_mode in ["cold", "warm"]
         # Check whether the entry has already be evaluated
-        for entry in self.entries:
-            if (entry.trace_type == trace_type and 
-                entry.trace_file_name == trace_file_name and
-                entry.train_frac == train_frac and
-                entry.cache_cap_frac == cache_cap_frac and
-                entry.algo == algo):
-                logging.info(f"{str(entry)} has already be simulated!")
-                return entry
-            
+        entry = self.find_entry(trace_type, trace_file_name, train_frac, cache_cap_frac, algo, test_mode, get_engine(algo, is_sota))
+        if entry != None:
+            logging.info(f"{str(entry)} has already be simulated!")
+            return entry
+
         
         # Prepare train and test traces
         train_trace_path = self._get_trace_path(trace_type=trace_type, trace_file_name=trace_file_name, train_frac=train_frac, is_train=True)
@@ -242,59 +510,57 @@ class PolicyEvaluator:
             assert os.path.exists(algo)
             
         # Simulating
-        full_trace = Trace(full_trace_path)
-        cache_cap = int(full_trace.get_ndv() * 0.1)
+        cache_cap = int(get_trace_ndv(full_trace_path) * 0.1)
         if cache_cap < 1:
             cache_cap = 1
-        entry = Entry(
-            trace_type=trace_type,
-            trace_file_name=trace_file_name,
-            train_frac=train_frac,
-            cache_cap=cache_cap,
-            cache_cap_frac=cache_cap_frac,
-            algo=algo,
-            is_sota=is_sota,
-            init_param_mr_info=MissRatioInfo(None, None, None),
-            tuned_param_mr_info=MissRatioInfo(None, None, None)
-        )
+        entry = self._new_entry(dict(trace_type=trace_type, trace_file_name=trace_file_name, train_frac=train_frac, cache_cap_frac=cache_cap_frac, algo=algo, is_sota=is_sota, test_mode=test_mode), cache_cap)
         logging.info(f"Simulating {str(entry)}")
 
         # Train parameters
         logging.info(f"\ttraining...")
-        if is_sota == True:
-            miss_ratio_info_tuple = self._tune_sota(
-                algo=algo,
-                trace_path=train_trace_path,
-                cache_cap=cache_cap
-            )
-        else:
-            miss_ratio_info_tuple = self._tune_not_sota(
-                algo=algo,
-                trace_path=train_trace_path,
-                cache_cap=cache_cap
-            )
-        assert miss_ratio_info_tuple != None
-        entry.init_param_mr_info.mr_train = miss_ratio_info_tuple[0] # defualt_mr
-        entry.tuned_param_mr_info.mr_train = miss_ratio_info_tuple[1] # tuned_mr
-        entry.init_param_mr_info.params = miss_ratio_info_tuple[2] # default_param
-        entry.tuned_param_mr_info.params = miss_ratio_info_tuple[3] # tuned_param
+        warm_starter = None
+        if warm_start == True:
+            warm_starter = WarmStarter(self.get_prior_results(algo, train_frac, cache_cap_frac))
+        self._set_train_results(entry, self._tune(algo, is_sota, train_trace_path, cache_cap, warm_starter, need_default_run=test_mode != "warm"))
 
         # Test parameters
         logging.info(f"\ttesting...")
-        ## init_params
         logging.info(f"\t\tinit_params: {entry.init_param_mr_info.params}")
-        entry.init_param_mr_info.mr_test = self._simulate(
-            algo=algo,
-            trace_path=test_trace_path,
-            cache_cap=cache_cap,
-            params=entry.init_param_mr_info.params,
-            is_sota=is_sota
-        )
-        ## tuned_params
         logging.info(f"\t\ttuned_params: {entry.tuned_param_mr_info.params}")
-        if entry.tuned_param_mr_info.params == entry.init_param_mr_info.params:
+        if test_mode == "warm":
+            self._set_warm_results(entry, self._simulate_warm(
+                algo=algo,
+                train_trace_path=train_trace_path,
+                test_trace_path=test_trace_path,
+                full_trace_path=full_trace_path,
+                cache_cap=cache_cap,
+                params_list=self._get_test_params_list(entry),
+                is_sota=is_sota
+            ))
+        elif entry.tuned_param_mr_info.params == entry.init_param_mr_info.params:
+            entry.init_param_mr_info.mr_test = self._simulate(
+                algo=algo,
+                trace_path=test_trace_path,
+                cache_cap=cache_cap,
+                params=entry.init_param_mr_info.params,
+                is_sota=is_sota
+            )
             entry.tuned_param_mr_info.mr_test = entry.init_param_mr_info.mr_test
+        elif is_sota == True:
+            entry.init_param_mr_info.mr_test, entry.tuned_param_mr_info.mr_test = self._simulate_sota_many(
+                algo=algo,
+                trace_path=test_trace_path,
+                cache_cap=cache_cap,
+                params_list=[entry.init_param_mr_info.params, entry.tuned_param_mr_info.params]
+            )
         else:
+            entry.init_param_mr_info.mr_test = self._simulate(
+                algo=algo,
+                trace_path=test_trace_path,
+                cache_cap=cache_cap,
+                params=entry.init_param_mr_info.params,
+                is_sota=is_sota
+            )
             entry.tuned_param_mr_info.mr_test = self._simulate(
                 algo=algo,
                 trace_path=test_trace_path,
@@ -304,15 +570,233 @@ class PolicyEvaluator:
             )
         
         # save
-        self.entries.append(entry)
-        write_to_file(
-            dest_path=self.policy_eval_jsonl_path,
-            contents=entry.to_jsonl() + "\n",
-            is_append=True,
-            is_json=False
-        )
+        self._set_costs(entry, train_trace_path, test_trace_path, full_trace_path)
+        if need_save == True:
+            self.add_entry(entry)
 
         return entry
+
+    def eval_many(self, jobs: List[Dict], num_workers: int=None, need_save: bool=True):
+        '''
+        `eval` every job (a dict of the keyword arguments of `eval`, as for `JobBroker`) on a pool of `num_workers` processes (default: the available cores).
+        Each job is a DAG of stages: the ndv of the full trace (computed once per trace) -> tuning on the train split -> the test runs of the init and the tuned params, which run in parallel (one lockstep replay of the full trace for a "warm" `test_mode`).
+        The stages of different jobs overlap. Among the ready stages, those closest to completing an entry run first, then the costliest (see `Scheduler.estimate_cost`).
+        Each entry is stored as soon as its test runs complete, so an interrupted sweep resumes where it stopped.
+        Return: list of `Entry`, in the order of `jobs` (`None` if a stage of the job failed)
+        '''
+        entries = [None for _ in jobs]
+        get_key = lambda job: (job["trace_type"], job["trace_file_name"], job["train_frac"], job["cache_cap_frac"], job["algo"], job.get("test_mode", "cold"), get_engine(job["algo"], job["is_sota"]))
+        m_key_job_ids = dict() # (trace_type, trace_file_name, train_frac, cache_cap_frac, algo, test_mode, engine) -> ids of the jobs to evaluate
+        for job_id, job in enumerate(jobs):
+            key = get_key(job)
+            if key in m_key_job_ids:
+                m_key_job_ids[key].append(job_id)
+                continue
+            entries[job_id] = self.find_entry(*key)
+            if entries[job_id] != None:
+                logging.info(f"{str(entries[job_id])} has already be simulated!")
+                continue
+            m_key_job_ids[key] = [job_id]
+        pending_job_ids = [job_ids[0] for job_ids in m_key_job_ids.values()]
+        if len(pending_job_ids) == 0:
+            return entries
+
+        m_job_paths = dict() # job_id -> (train_trace_path, test_trace_path, full_trace_path)
+        m_trace_job_ids = dict() # full_trace_path -> ids of the jobs waiting for its ndv
+        for job_id in pending_job_ids:
+            job = jobs[job_id]
+            assert job.get("test_mode", "cold") in ["cold", "warm"]
+            if not job["is_sota"] == True:
+                assert os.path.exists(job["algo"])
+            m_job_paths[job_id] = tuple([
+                self._get_trace_path(trace_type=job["trace_type"], trace_file_name=job["trace_file_name"], train_frac=job["train_frac"], is_train=is_train)
+                for is_train in [True, False, None]
+            ])
+            m_trace_job_ids.setdefault(m_job_paths[job_id][2], []).append(job_id)
+
+        # ready stages: (-#stages to an entry, -cost, seq, node, stage args), where node is ("stats", full_trace_path) | ("tune", job_id) | ("test", job_id, "init" | "tuned" | "both" | "warm")
+        ready = []
+        seq = itertools.count()
+        m_job_entry = dict() # job_id -> `Entry` being evaluated
+        m_job_num_tests = dict() # job_id -> #test runs still running
+        for full_trace_path in m_trace_job_ids:
+            heapq.heappush(ready, (0, -os.path.getsize(full_trace_path), next(seq), ("stats", full_trace_path), full_trace_path))
+
+        def push_test(job_id: int, which: str, params: Dict):
+            job, entry = jobs[job_id], m_job_entry[job_id]
+            test_trace_path = m_job_paths[job_id][1]
+            heapq.heappush(ready, (-2, -estimate_cost(test_trace_path, entry.cache_cap), next(seq), ("test", job_id, which), (job["algo"], job["is_sota"], test_trace_path, entry.cache_cap, params)))
+
+        def on_result(node, result):
+            if node[0] == "stats":
+                cache_cap = max(int(result * 0.1), 1)
+                for job_id in m_trace_job_ids[node[1]]:
+                    job = jobs[job_id]
+                    m_job_entry[job_id] = self._new_entry(job, cache_cap)
+                    logging.info(f"Simulating {str(m_job_entry[job_id])}")
+                    prior_results = None
+                    if job.get("warm_start", False) == True:
+                        prior_results = self.get_prior_results(job["algo"], job["train_frac"], job["cache_cap_frac"])
+                    train_trace_path = m_job_paths[job_id][0]
+                    heapq.heappush(ready, (-1, -estimate_cost(train_trace_path, cache_cap), next(seq), ("tune", job_id), (job["algo"], job["is_sota"], train_trace_path, cache_cap, prior_results, job.get("test_mode", "cold") != "warm")))
+            elif node[0] == "tune":
+                job_id = node[1]
+                entry = m_job_entry[job_id]
+                self._set_train_results(entry, result)
+                if entry.test_mode == "warm":
+                    m_job_num_tests[job_id] = 1
+                    job = jobs[job_id]
+                    train_trace_path, test_trace_path, full_trace_path = m_job_paths[job_id]
+                    heapq.heappush(ready, (-2, -estimate_cost(full_trace_path, entry.cache_cap), next(seq), ("test", job_id, "warm"), (job["algo"], job["is_sota"], train_trace_path, test_trace_path, full_trace_path, entry.cache_cap, self._get_test_params_list(entry))))
+                elif entry.tuned_param_mr_info.params == entry.init_param_mr_info.params:
+                    m_job_num_tests[job_id] = 1
+                    push_test(job_id, "both", entry.init_param_mr_info.params)
+                else:
+                    m_job_num_tests[job_id] = 2
+                    push_test(job_id, "init", entry.init_param_mr_info.params)
+                    push_test(job_id, "tuned", entry.tuned_param_mr_info.params)
+            else:
+                _, job_id, which = node
+                entry = m_job_entry[job_id]
+                if which == "warm":
+                    self._set_warm_results(entry, result)
+                if which in ["init", "both"]:
+                    entry.init_param_mr_info.mr_test = result
+                if which in ["tuned", "both"]:
+                    entry.tuned_param_mr_info.mr_test = result
+                m_job_num_tests[job_id] -= 1
+                if m_job_num_tests[job_id] > 0:
+                    return
+                self._set_costs(entry, *m_job_paths[job_id])
+                if need_save == True:
+                    self.add_entry(entry)
+                logging.info(f"Evaluated {str(entry)}: test mr {entry.init_param_mr_info.mr_test} -> {entry.tuned_param_mr_info.mr_test}")
+                for same_job_id in m_key_job_ids[get_key(jobs[job_id])]:
+                    entries[same_job_id] = entry
+
+        if num_workers == None:
+            num_workers = get_num_workers()
+        failed_job_ids = set()
+        with ProcessPoolExecutor(num_workers) as executor:
+            running = dict() # future -> node
+            while len(ready) > 0 or len(running) > 0:
+                while len(ready) > 0 and len(running) < num_workers:
+                    _, _, _, node, stage_args = heapq.heappop(ready)
+                    if node[0] != "stats" and node[1] in failed_job_ids:
+                        continue
+                    stage = "warm" if node[-1] == "warm" else node[0]
+                    running[executor.submit(_run_eval_stage, (stage, stage_args))] = node
+                if len(running) == 0:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    node = running.pop(future)
+                    try:
+                        on_result(node, future.result())
+                    except Exception as error:
+                        failed = m_trace_job_ids[node[1]] if node[0] == "stats" else [node[1]]
+                        failed_job_ids.update(failed)
+                        logging.warning(f"Stage {node} failed for {[str(jobs[job_id]) for job_id in failed]}: {repr(error)}\nTraceback:\n{''.join(traceback.format_exception(error))}")
+        return entries
+    
+    def eval_joint(
+        self,
+        trace_type: str,
+        trace_file_name_list: List[str],
+        train_frac: int,
+        cache_cap_frac: float,
+        algo: str,
+        is_sota: bool,
+        aggregate="mean",
+        sample_rate: float=1.0,
+        num_processes: int=None
+    ):
+        '''
+        Tune one parameter set of `algo` for the train splits of all `trace_file_name_list` (see `JointTuner`), and test it on each test split.
+        - aggregate ("mean" | float): the objective is the mean or this percentile of the miss ratio reduction over the traces
+        - sample_rate (float): run the trials on spatially sampled train traces
+        Return: list of `Entry`, one per trace, all sharing the tuned params
+        '''
+        joint_tuning = {
+            "trace_file_names": sorted(trace_file_name_list),
+            "aggregate": aggregate,
+            "sample_rate": sample_rate
+        }
+        candid_entries = self.find_entries(
+            algo=algo,
+            cache_cap_frac=cache_cap_frac,
+            train_frac=train_frac,
+            trace_type=trace_type,
+            joint_hash=hash_params(joint_tuning),
+            trace=trace_file_name_list
+        )
+        if len(candid_entries) == len(trace_file_name_list):
+            logging.info(f"({algo}, {trace_type}, {len(trace_file_name_list)} traces, train={train_frac}, ccf={cache_cap_frac}) has already be jointly tuned!")
+            return sorted(candid_entries, key=lambda e: trace_file_name_list.index(e.trace_file_name))
+        if not is_sota == True:
+            assert os.path.exists(algo)
+
+        train_trace_path_list = [self._get_trace_path(trace_type, n, train_frac, is_train=True) for n in trace_file_name_list]
+        test_trace_path_list = [self._get_trace_path(trace_type, n, train_frac, is_train=False) for n in trace_file_name_list]
+        cache_cap_list = [
+            max(int(Trace(self._get_trace_path(trace_type, n, train_frac, is_train=None)).get_ndv() * 0.1), 1)
+            for n in trace_file_name_list
+        ]
+
+        # Train parameters
+        logging.info(f"Jointly tuning ({algo}, {trace_type}, {len(trace_file_name_list)} traces, train={train_frac}, ccf={cache_cap_frac})...")
+        tuner = JointTuner(
+            algo=algo,
+            is_sota=is_sota,
+            trace_path_list=train_trace_path_list,
+            cache_cap_list=cache_cap_list,
+            aggregate=aggregate,
+            sample_rate=sample_rate,
+            num_processes=num_processes
+        )
+        result = tuner.tune()
+        if result == None:
+            # No tunable parameters: evaluate the code as is
+            with Pool(tuner.num_processes) as pool:
+                mr_list = pool.map(simulate_params, [(algo, is_sota, p, c, dict()) for (p, c) in zip(train_trace_path_list, cache_cap_list)])
+            default_params, tuned_params = dict(), dict()
+            default_mr_list, tuned_mr_list = mr_list, mr_list
+        else:
+            default_params, tuned_params = result.default_params, result.tuned_params
+            default_mr_list, tuned_mr_list = result.default_mr_list, result.tuned_mr_list
+            logging.info(f"\tscore: {result.default_score} -> {result.tuned_score}, tuned_params: {tuned_params}")
+
+        # Test parameters
+        logging.info(f"\ttesting...")
+        with Pool(tuner.num_processes) as pool:
+            init_mr_test_list = pool.map(simulate_params, [(algo, is_sota, p, c, default_params) for (p, c) in zip(test_trace_path_list, cache_cap_list)])
+            tuned_mr_test_list = init_mr_test_list
+            if tuned_params != default_params:
+                tuned_mr_test_list = pool.map(simulate_params, [(algo, is_sota, p, c, tuned_params) for (p, c) in zip(test_trace_path_list, cache_cap_list)])
+
+        # save
+        entries = []
+        for i, trace_file_name in enumerate(trace_file_name_list):
+            # the train runs may be sampled: only the test runs of `simulate_params` memoize their cost
+            if is_sota == True:
+                get_test_cost = lambda params: get_libcachesim_cost(test_trace_path_list[i], algo, cache_cap_list[i], libcachesim_params_to_str(algo, params) if len(params) > 0 else "")
+            else:
+                get_test_cost = lambda params: self._get_cost(algo, False, test_trace_path_list[i], cache_cap_list[i], params)
+            entry = Entry(
+                trace_type=trace_type,
+                trace_file_name=trace_file_name,
+                train_frac=train_frac,
+                cache_cap=cache_cap_list[i],
+                cache_cap_frac=cache_cap_frac,
+                algo=algo,
+                is_sota=is_sota,
+                init_param_mr_info=MissRatioInfo(default_params, default_mr_list[i], init_mr_test_list[i], cost_test=get_test_cost(default_params)),
+                tuned_param_mr_info=MissRatioInfo(tuned_params, tuned_mr_list[i], tuned_mr_test_list[i], cost_test=get_test_cost(tuned_params)),
+                joint_tuning=joint_tuning
+            )
+            entries.append(entry)
+        self.add_entries(entries)
+        return entries
     
     def plot_miss_ratio_percentile(
         self,
@@ -322,54 +806,65 @@ class PolicyEvaluator:
         algo_list: List[str],
         png_path: str,
         use_init: bool,
-        use_test: bool
+        use_test: bool,
+        use_joint: bool=False,
+        test_mode: str="cold",
+        rank_by: str=None,
+        max_cost: dict=None
     ):
         '''
         Args:
+        - use_joint (bool): plot the jointly tuned entries of the non-FIFO algorithms instead of the per-trace tuned ones
+        - test_mode ("cold" | "warm"): plot the entries evaluated in this mode, see `eval`
+        - rank_by, max_cost: rank or filter the algorithms by miss ratio or by the cost of the plotted runs, see `utils.plot_mr`
         - trace_filter (func):
             - input: trace_path (str)
             - output: True/False
+        Only the entries of the engine that currently runs each algorithm are plotted (see `utils.get_engine`).
         '''
         if "fifo" not in algo_list:
             algo_list.append("fifo")
 
-        # load
-        candid_entries = [e for e in self.entries if (e.algo in algo_list and 
-                                                      e.cache_cap_frac == cache_cap_frac and 
-                                                      e.trace_type == trace_type and
-                                                      e.train_frac == train_frac)]
-        m_algo_entry = {
-            algo: sorted([e for e in candid_entries if e.algo == algo], key=lambda e: e.trace_file_name)
-            for algo in algo_list
-        }
+        # load only the needed columns
+        mr_info_field = "init_param_mr_info" if use_init == True else "tuned_param_mr_info"
+        mr_field = f"{mr_info_field}.mr_test" if use_test == True else f"{mr_info_field}.mr_train"
+        cost_field = f"{mr_info_field}.cost_test" if use_test == True else f"{mr_info_field}.cost_train"
+        columns = self.store.export_columns(
+            "policy_eval",
+            ["algo", "trace", "joint_hash", "engine", mr_field, cost_field],
+            algo=algo_list,
+            cache_cap_frac=cache_cap_frac,
+            train_frac=train_frac,
+            trace_type=trace_type,
+            test_mode=test_mode
+        )
+        not_joint_hash = hash_params(None)
+        m_algo_trace_mr = {algo: [] for algo in algo_list} # list of (trace_file_name, mr, cost) for each algorithm in algo_list
+        for algo, trace_file_name, joint_hash, engine, mr, cost in zip(columns["algo"], columns["trace"], columns["joint_hash"], columns["engine"], columns[mr_field], columns[cost_field]):
+            if engine not in [get_engine(algo, True), get_engine(algo, False)]:
+                continue
+            if (joint_hash != not_joint_hash) == (use_joint == True and algo != "fifo"):
+                # json_extract returns the cost object as JSON text
+                m_algo_trace_mr[algo].append((trace_file_name, mr, json.loads(cost) if cost != None else None))
+        for algo in m_algo_trace_mr:
+            m_algo_trace_mr[algo].sort(key=lambda t: t[0])
         m_algo_mr: Dict[str, List] = dict()
-        for algo in m_algo_entry:
+        m_algo_cost: Dict[str, List] = dict()
+        for algo in m_algo_trace_mr:
             if algo == "fifo":
                 continue
             try: 
-                assert list([e.trace_file_name for e in m_algo_entry[algo]]) == list([e.trace_file_name for e in m_algo_entry["fifo"]])
+                assert [t[0] for t in m_algo_trace_mr[algo]] == [t[0] for t in m_algo_trace_mr["fifo"]]
             except Exception:
-                logging.warning(f"{algo}, {[e.trace_file_name for e in m_algo_entry[algo]]}")
+                logging.warning(f"{algo}, {[t[0] for t in m_algo_trace_mr[algo]]}")
                 continue
             m_algo_mr[algo] = list()
-            for e, fifo_e in zip(m_algo_entry[algo], m_algo_entry["fifo"]):
-                if use_init == False:
-                    e_mr_info = e.tuned_param_mr_info
-                    fifo_mr_info = fifo_e.tuned_param_mr_info
-                else:
-                    e_mr_info = e.init_param_mr_info
-                    fifo_mr_info = fifo_e.init_param_mr_info
-                
-                if use_test == True:
-                    e_mr = e_mr_info.mr_test
-                    fifo_mr = fifo_mr_info.mr_test
-                else:
-                    e_mr = e_mr_info.mr_train
-                    fifo_mr = fifo_mr_info.mr_train
+            m_algo_cost[algo] = [t[2] for t in m_algo_trace_mr[algo]]
+            for (_, e_mr, _), (_, fifo_mr, _) in zip(m_algo_trace_mr[algo], m_algo_trace_mr["fifo"]):
                 if e_mr == None:
                     logging.warning(f"{algo}, e_mr=None")
                     break
                 m_algo_mr[algo].append(miss_ratio_reduction(e_mr, fifo_mr))
         # plot
-        plot_mr(m_algo_mr, png_path)
+        plot_mr(m_algo_mr, png_path, m_algo_cost=m_algo_cost, rank_by=rank_by, max_cost=max_cost)
     
\ No newline at end of file
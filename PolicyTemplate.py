@@ -0,0 +1,158 @@
+import ast
+import types
+import collections
+from typing import Dict, List
+from utils import get_type_and_value, is_expr
+
+TUNABLE_BEGIN = "# Put tunable constant parameters below"
+TUNABLE_END = "# Put the metadata specifically maintained by the policy below"
+PARAMS_NAME = "__policy_params__" # the name under which parameter values are injected
+
+class TunableParam:
+    def __init__(self, param_id: str, name: str, param_type: type, default, stmt: ast.stmt):
+        self.param_id = param_id # index in the tunable block, as in the optimizer's config space
+        self.name = name # variable name in the code
+        self.type = param_type # bool, int or float
+        self.default = default
+        self.stmt = stmt # the assignment in the code
+        self.node = stmt.value # the value expression in the code
+
+    def cast(self, value):
+        return self.type(value)
+
+    def __repr__(self):
+        return f"TunableParam({self.param_id}: {self.name}={self.default} ({self.type.__name__}))"
+
+    def to_dict(self):
+        return {
+            "param_id": self.param_id,
+            "name": self.name,
+            "type": self.type.__name__,
+            "default": self.default
+        }
+
+class PolicyTemplate:
+    '''
+    A policy code that is parsed and compiled once.
+    - `params`: the typed schema of the tunable constant parameters, i.e., the literal assignments between the two comments "# Put tunable constant parameters below" and "# Put the metadata specifically maintained by the policy below". A line is a parameter iff `utils.is_expr` and `utils.get_type_and_value` accept it, as for the regex-based parsing.
+    - `instantiate(params)`: execute the compiled code in a fresh namespace in which the parameter assignments read the injected values, i.e., the values are set before the metadata are initialized.
+    - `render(params)`: the code text with the parameter values substituted.
+    - `skeleton`: the code text with every parameter value replaced by its injected form, e.g., `__policy_params__["0"]`; a code and its renderings share it.
+    Params are dicts from `param_id` ("0", "1", ...) to values. Missing params keep the values in the code.
+    '''
+    def __init__(self, code: str):
+        self.code = code
+        tree = ast.parse(code)
+        self.params: List[TunableParam] = self._parse_params(tree, code.split("\n"))
+        for param in self.params:
+            injected_value = ast.Subscript(
+                value=ast.Name(id=PARAMS_NAME, ctx=ast.Load()),
+                slice=ast.Constant(value=param.param_id),
+                ctx=ast.Load()
+            )
+            param.stmt.value = ast.copy_location(injected_value, param.node)
+        ast.fix_missing_locations(tree)
+        self._code_obj = compile(tree, "<My>", "exec")
+        self.skeleton = self._substitute({param.param_id: f"{PARAMS_NAME}[{param.param_id!r}]" for param in self.params})
+
+    def _parse_params(self, tree: ast.Module, lines: List[str]):
+        begin_lineno = None
+        end_lineno = None
+        for lineno, line in enumerate(lines, start=1):
+            if begin_lineno == None and line.startswith(TUNABLE_BEGIN):
+                begin_lineno = lineno
+            elif begin_lineno != None and line.startswith(TUNABLE_END):
+                end_lineno = lineno
+                break
+        if begin_lineno == None or end_lineno == None:
+            return []
+
+        params = []
+        for stmt in tree.body:
+            if stmt.lineno <= begin_lineno or stmt.lineno >= end_lineno:
+                continue
+            if isinstance(stmt, ast.Assign) and len(stmt.targets) == 1 and isinstance(stmt.targets[0], ast.Name):
+                name = stmt.targets[0].id
+            elif isinstance(stmt, ast.AnnAssign) and isinstance(stmt.target, ast.Name) and stmt.value != None:
+                name = stmt.target.id
+            else:
+                continue
+            if not is_expr(lines[stmt.lineno - 1]) or stmt.value.lineno != stmt.value.end_lineno:
+                continue
+            line_bytes = lines[stmt.value.lineno - 1].encode()
+            rhs = line_bytes[stmt.value.col_offset:stmt.value.end_col_offset].decode()
+            type_and_value = get_type_and_value(rhs)
+            if type_and_value == None:
+                continue
+            param = TunableParam(
+                param_id=str(len(params)),
+                name=name,
+                param_type=type_and_value[0],
+                default=type_and_value[0](type_and_value[1]),
+                stmt=stmt
+            )
+            params.append(param)
+        return params
+
+    def get_default_params(self):
+        return {param.param_id: param.default for param in self.params}
+
+    def get_literal_params(self):
+        '''
+        Return: the values written in the code, i.e., the values a run of the code as is (e.g., a reload of My.py) sees; unlike the defaults, they are not cast to the schema types
+        '''
+        return {param.param_id: ast.literal_eval(param.node) for param in self.params}
+
+    def cast_params(self, params: Dict):
+        '''
+        Return: all params, typed according to the schema
+        '''
+        if params == None:
+            params = dict()
+        return {
+            param.param_id: param.cast(params[param.param_id]) if param.param_id in params else param.default
+            for param in self.params
+        }
+
+    def instantiate(self, params: Dict=None, name: str="My"):
+        '''
+        Return: a fresh policy module with `params` injected
+        '''
+        policy = types.ModuleType(name)
+        policy.__dict__[PARAMS_NAME] = self.cast_params(params)
+        exec(self._code_obj, policy.__dict__)
+        return policy
+
+    def render(self, params: Dict):
+        '''
+        The values are cast as by `instantiate` (e.g., a bool param given as 0/1 is rendered as False/True), so that a rendered code runs as the injected params do.
+        '''
+        return self._substitute({param.param_id: str(param.cast(params[param.param_id])) for param in self.params if param.param_id in params})
+
+    def _substitute(self, m_param_text: Dict[str, str]):
+        '''
+        Return: the code text with the value expression of every param in `m_param_text` replaced by its text
+        '''
+        lines = self.code.split("\n")
+        for param in self.params:
+            if param.param_id not in m_param_text:
+                continue
+            line_bytes = lines[param.node.lineno - 1].encode()
+            lines[param.node.lineno - 1] = (line_bytes[:param.node.col_offset] + m_param_text[param.param_id].encode() + line_bytes[param.node.end_col_offset:]).decode()
+        return "\n".join(lines)
+
+_templates = collections.OrderedDict() # code -> PolicyTemplate
+_templates_capacity = 64
+
+def get_policy_template(code: str):
+    '''
+    The `PolicyTemplate` of `code`, memoized per process. Raise `SyntaxError` if the code cannot be parsed.
+    '''
+    if code in _templates:
+        _templates.move_to_end(code)
+        return _templates[code]
+    template = PolicyTemplate(code)
+    _templates[code] = template
+    if len(_templates) > _templates_capacity:
+        _templates.popitem(last=False)
+    return template
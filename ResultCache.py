@@ -0,0 +1,214 @@
+import os
+import ast
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import logging_config
+import logging
+
+def hash_code(code: str):
+    '''
+    Hash of the normalized code: comments, blank lines and formatting do not change the hash.
+    '''
+    try:
+        normalized = ast.dump(ast.parse(code))
+    except SyntaxError:
+        normalized = "\n".join([l.rstrip() for l in code.strip().split("\n") if l.strip() != ""])
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+def canonical_params(params):
+    '''
+    `params` may be a dict, a libcachesim param string (e.g., "a=1,b=2", " -e a=1,b=2"), or `None`.
+    '''
+    if params == None:
+        return "{}"
+    if isinstance(params, str):
+        param_str = params.strip()
+        if param_str.startswith("-e "):
+            param_str = param_str[len("-e "):]
+        params = dict()
+        for kv in param_str.split(","):
+            if kv.strip() == "":
+                continue
+            k, _, v = kv.partition("=")
+            params[k.strip()] = v.strip()
+    return json.dumps(params, sort_keys=True)
+
+class ResultCache:
+    '''
+    A content-addressed, persistent store of simulation results shared by every process on the host.
+    A result is keyed on (engine, engine version, normalized-code hash, canonical params, trace content hash, capacity, extra).
+    For libcachesim runs, the "code" is the algorithm name.
+    '''
+    db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "analysis", "result_cache.sqlite")
+    python_engine = "SimulatorCache"
+    python_engine_version = "2" # bump when the semantics of `SimulatorCache._replay` or `Cache` change
+    libcachesim_engine = "libCacheSim"
+
+    _instances = dict() # (pid, db_path) -> ResultCache
+    _instances_lock = threading.Lock()
+
+    def __init__(self, db_path: str=None):
+        self.db_path = db_path if db_path != None else ResultCache.db_path
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self._local = threading.local()
+        self._trace_hashes = dict() # (abspath, mtime_ns, size) -> hash
+        conn = self._get_conn()
+        with conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                engine TEXT,
+                engine_version TEXT,
+                code_hash TEXT,
+                params TEXT,
+                trace_hash TEXT,
+                capacity INTEGER,
+                extra TEXT,
+                value TEXT,
+                created REAL
+            )''')
+            conn.execute('''CREATE TABLE IF NOT EXISTS trace_hashes (
+                path TEXT,
+                mtime_ns INTEGER,
+                size INTEGER,
+                hash TEXT,
+                PRIMARY KEY (path, mtime_ns, size)
+            )''')
+            conn.execute('''CREATE TABLE IF NOT EXISTS costs (
+                key TEXT PRIMARY KEY,
+                cost TEXT
+            )''')
+            conn.execute('''CREATE TABLE IF NOT EXISTS trace_stats (
+                trace_hash TEXT PRIMARY KEY,
+                stats TEXT
+            )''')
+        # statistics
+        self.hit_count = 0
+        self.miss_count = 0
+
+    @classmethod
+    def default(cls, db_path: str=None):
+        '''
+        One instance per (process, db_path): sqlite connections must not be shared across a fork.
+        '''
+        key = (os.getpid(), db_path if db_path != None else cls.db_path)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = ResultCache(key[1])
+            return cls._instances[key]
+
+    def _get_conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn == None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=60)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def hash_trace(self, trace_path: str):
+        '''
+        sha256 of the trace content, memoized on (path, mtime, size).
+        '''
+        trace_path = os.path.abspath(trace_path)
+        stat = os.stat(trace_path)
+        stat_key = (trace_path, stat.st_mtime_ns, stat.st_size)
+        if stat_key in self._trace_hashes:
+            return self._trace_hashes[stat_key]
+        conn = self._get_conn()
+        row = conn.execute("SELECT hash FROM trace_hashes WHERE path=? AND mtime_ns=? AND size=?", stat_key).fetchone()
+        if row != None:
+            trace_hash = row[0]
+        else:
+            sha = hashlib.sha256()
+            with open(trace_path, 'rb') as file:
+                for chunk in iter(lambda: file.read(1 << 20), b""):
+                    sha.update(chunk)
+            trace_hash = sha.hexdigest()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO trace_hashes VALUES (?, ?, ?, ?)", stat_key + (trace_hash,))
+        self._trace_hashes[stat_key] = trace_hash
+        return trace_hash
+
+    def make_key(self, engine: str, engine_version: str, code: str, params, trace_path: str, capacity: int, extra: dict=None):
+        '''
+        Return: (key, columns)
+        '''
+        columns = {
+            "engine": engine,
+            "engine_version": engine_version,
+            "code_hash": hash_code(code) if engine == self.python_engine else code,
+            "params": canonical_params(params),
+            "trace_hash": self.hash_trace(trace_path),
+            "capacity": int(capacity),
+            "extra": json.dumps(extra if extra != None else dict(), sort_keys=True),
+        }
+        key = hashlib.sha256(json.dumps(columns, sort_keys=True).encode()).hexdigest()
+        return key, columns
+
+    def get(self, engine: str, engine_version: str, code: str, params, trace_path: str, capacity: int, extra: dict=None):
+        '''
+        Return the stored value, or `None` if absent.
+        '''
+        key, _ = self.make_key(engine, engine_version, code, params, trace_path, capacity, extra)
+        try:
+            row = self._get_conn().execute("SELECT value FROM results WHERE key=?", (key,)).fetchone()
+        except sqlite3.Error as error:
+            logging.warning(f"ResultCache lookup failed: {repr(error)}")
+            row = None
+        if row == None:
+            self.miss_count += 1
+            return None
+        self.hit_count += 1
+        return json.loads(row[0])
+
+    def put(self, engine: str, engine_version: str, code: str, params, trace_path: str, capacity: int, value, extra: dict=None, cost: dict=None):
+        '''
+        - cost (dict | None): the cost of the run (see `Telemetry.make_cost`), kept next to the value; costs depend on the machine, so they are informative only
+        '''
+        key, columns = self.make_key(engine, engine_version, code, params, trace_path, capacity, extra)
+        conn = self._get_conn()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, columns["engine"], columns["engine_version"], columns["code_hash"], columns["params"], columns["trace_hash"], columns["capacity"], columns["extra"], json.dumps(value), time.time())
+                )
+                if cost != None:
+                    conn.execute("INSERT OR REPLACE INTO costs VALUES (?, ?)", (key, json.dumps(cost)))
+        except sqlite3.Error as error:
+            logging.warning(f"ResultCache store failed: {repr(error)}")
+
+    def get_cost(self, engine: str, engine_version: str, code: str, params, trace_path: str, capacity: int, extra: dict=None):
+        '''
+        Return the cost stored with the value, or `None` if absent.
+        '''
+        key, _ = self.make_key(engine, engine_version, code, params, trace_path, capacity, extra)
+        try:
+            row = self._get_conn().execute("SELECT cost FROM costs WHERE key=?", (key,)).fetchone()
+        except sqlite3.Error as error:
+            logging.warning(f"ResultCache lookup failed: {repr(error)}")
+            row = None
+        if row == None:
+            return None
+        return json.loads(row[0])
+
+    def get_trace_stats(self, trace_path: str):
+        '''
+        Return the stored `Trace.get_stats()` of the trace content, or `None` if absent.
+        '''
+        row = self._get_conn().execute("SELECT stats FROM trace_stats WHERE trace_hash=?", (self.hash_trace(trace_path),)).fetchone()
+        if row == None:
+            return None
+        return json.loads(row[0])
+
+    def put_trace_stats(self, trace_path: str, stats: dict):
+        conn = self._get_conn()
+        try:
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO trace_stats VALUES (?, ?)", (self.hash_trace(trace_path), json.dumps(stats)))
+        except sqlite3.Error as error:
+            logging.warning(f"ResultCache store failed: {repr(error)}")
@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+import logging_config
+import logging
+
+def hash_params(params):
+    '''
+    Hash of a params dict (or any JSON value), insensitive to the key order; `None` and `{}` differ.
+    '''
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+class ResultStore:
+    '''
+    The entries of `Analyzer`, `CrossValidator` and `PolicyEvaluator`, in a SQLite database shared by every process on the host.
+    Each table stores the entry dicts (the payload) under indexed key columns, at most one per key: the first stored entry wins, so concurrent evaluators may store the same result.
+    '''
+    db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "analysis", "results.sqlite")
+    # table -> key columns, in the order of the unique index
+    tables = {
+        "miss_ratio": ["algo", "cache_cap_frac", "engine", "trace"],
+        "cross_validate": ["algo", "cache_cap_frac", "params_hash", "trace"],
+        "policy_eval": ["algo", "cache_cap_frac", "train_frac", "trace_type", "joint_hash", "test_mode", "engine", "trace"],
+    }
+    column_types = {"cache_cap_frac": "REAL", "train_frac": "INTEGER"} # default: TEXT
+    # the value of a key column added to an existing table: a constant, or a SQL expression of the row
+    column_defaults = {"test_mode": "cold"}
+    column_default_exprs = {"engine": "CASE WHEN json_extract(payload, '$.is_sota') THEN 'cachesim' ELSE 'SimulatorCache' END"} # see `utils.get_stored_engine`
+
+    _instances = dict() # (pid, db_path) -> ResultStore
+    _instances_lock = threading.Lock()
+
+    def __init__(self, db_path: str=None):
+        self.db_path = db_path if db_path != None else ResultStore.db_path
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self._local = threading.local()
+        conn = self._get_conn()
+        with conn:
+            # sqlite3 opens no transaction before DDL: take the write lock first, so that the schema is read and migrated by one process at a time
+            conn.execute("BEGIN IMMEDIATE")
+            for table in self.tables:
+                existing_columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+                if len(existing_columns) > 0 and any([c not in existing_columns for c in self.tables[table]]):
+                    self._migrate(conn, table, existing_columns)
+                else:
+                    self._create_table(conn, table)
+            conn.execute('''CREATE TABLE IF NOT EXISTS imports (
+                tbl TEXT,
+                path TEXT,
+                mtime_ns INTEGER,
+                size INTEGER,
+                PRIMARY KEY (tbl, path, mtime_ns, size)
+            )''')
+
+    def _create_table(self, conn, table: str):
+        key_columns = self.tables[table]
+        columns = ", ".join([f"{c} {self.column_types.get(c, 'TEXT')}" for c in key_columns])
+        conn.execute(f'''CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            {columns},
+            payload TEXT,
+            created REAL,
+            UNIQUE ({", ".join(key_columns)})
+        )''')
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_trace ON {table} (trace)")
+
+    def _migrate(self, conn, table: str, existing_columns: list):
+        '''
+        Rebuild a table whose unique key lacks new key columns; their value in the existing rows is `column_defaults` or `column_default_exprs`.
+        Run in the transaction of `__init__`, in which `existing_columns` were read.
+        '''
+        logging.info(f"ResultStore: adding {[c for c in self.tables[table] if c not in existing_columns]} to the key of {table}")
+        conn.execute(f"DROP INDEX IF EXISTS {table}_trace")
+        conn.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+        self._create_table(conn, table)
+        selects, args = [], []
+        for column in self.tables[table]:
+            if column in existing_columns:
+                selects.append(column)
+            elif column in self.column_default_exprs:
+                selects.append(self.column_default_exprs[column])
+            else:
+                selects.append("?")
+                args.append(self.column_defaults[column])
+        conn.execute(
+            f"INSERT OR IGNORE INTO {table} ({', '.join(self.tables[table])}, payload, created) SELECT {', '.join(selects)}, payload, created FROM {table}_old ORDER BY id",
+            args
+        )
+        conn.execute(f"DROP TABLE {table}_old")
+
+    @classmethod
+    def default(cls, db_path: str=None):
+        '''
+        One instance per (process, db_path): sqlite connections must not be shared across a fork.
+        '''
+        key = (os.getpid(), db_path if db_path != None else cls.db_path)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = ResultStore(key[1])
+            return cls._instances[key]
+
+    def _get_conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn == None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=60)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _where(self, table: str, conditions: dict):
+        '''
+        - conditions: key column -> value | list of values (any of them) | `None` (anything)
+        Return: (sql, args)
+        '''
+        clauses, args = [], []
+        for column, value in conditions.items():
+            assert column in self.tables[table], f"{column} is not a key column of {table}"
+            if value is None:
+                continue
+            if isinstance(value, (list, tuple, set)):
+                value = list(value)
+                if len(value) == 0:
+                    clauses.append("0")
+                    continue
+                clauses.append(f"{column} IN ({', '.join(['?'] * len(value))})")
+                args.extend(value)
+            else:
+                clauses.append(f"{column}=?")
+                args.append(value)
+        if len(clauses) == 0:
+            return "", args
+        return " WHERE " + " AND ".join(clauses), args
+
+    def put_many(self, table: str, rows):
+        '''
+        Store the rows in one transaction; the rows whose key is already stored are skipped.
+        - rows: list of (key columns dict, payload dict)
+        Return: the number of stored rows
+        '''
+        key_columns = self.tables[table]
+        now = time.time()
+        values = [tuple(columns[c] for c in key_columns) + (json.dumps(payload), now) for (columns, payload) in rows]
+        if len(values) == 0:
+            return 0
+        conn = self._get_conn()
+        with conn:
+            cursor = conn.executemany(
+                f"INSERT OR IGNORE INTO {table} ({', '.join(key_columns)}, payload, created) VALUES ({', '.join(['?'] * (len(key_columns) + 2))})",
+                values
+            )
+        return cursor.rowcount
+
+    def put(self, table: str, columns: dict, payload: dict):
+        '''
+        Return: whether the row is stored, i.e., its key was absent
+        '''
+        return self.put_many(table, [(columns, payload)]) == 1
+
+    def find(self, table: str, **conditions):
+        '''
+        Indexed lookup, see `_where`.
+        Return: the payloads of the matching rows, in the order they were stored
+        '''
+        where, args = self._where(table, conditions)
+        rows = self._get_conn().execute(f"SELECT payload FROM {table}{where} ORDER BY id", args).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def count(self, table: str, **conditions):
+        where, args = self._where(table, conditions)
+        return self._get_conn().execute(f"SELECT COUNT(*) FROM {table}{where}", args).fetchone()[0]
+
+    def export_columns(self, table: str, fields, **conditions):
+        '''
+        Columnar export of the matching rows, e.g., for plotting, in the order they were stored.
+        - fields: key columns, or dotted paths into the payload (e.g., "tuned_param_mr_info.mr_test")
+        Return: field -> np.ndarray
+        '''
+        selects, args = [], []
+        for field in fields:
+            if field in self.tables[table]:
+                selects.append(field)
+            else:
+                selects.append("json_extract(payload, ?)")
+                args.append(f"$.{field}")
+        where, where_args = self._where(table, conditions)
+        rows = self._get_conn().execute(f"SELECT {', '.join(selects)} FROM {table}{where} ORDER BY id", args + where_args).fetchall()
+        return {field: np.array([row[i] for row in rows]) for i, field in enumerate(fields)}
+
+    def clear(self, table: str, **conditions):
+        '''
+        Delete the matching rows.
+        Return: the number of deleted rows
+        '''
+        where, args = self._where(table, conditions)
+        conn = self._get_conn()
+        with conn:
+            cursor = conn.execute(f"DELETE FROM {table}{where}", args)
+        return cursor.rowcount
+
+    def import_jsonl(self, table: str, jsonl_path: str, get_columns):
+        '''
+        Store the entries of a legacy JSONL file, once per version of the file.
+        - get_columns (func): entry dict -> key columns dict
+        Return: the number of stored rows
+        '''
+        if not os.path.exists(jsonl_path):
+            return 0
+        jsonl_path = os.path.abspath(jsonl_path)
+        stat = os.stat(jsonl_path)
+        import_key = (table, jsonl_path, stat.st_mtime_ns, stat.st_size)
+        conn = self._get_conn()
+        if conn.execute("SELECT 1 FROM imports WHERE tbl=? AND path=? AND mtime_ns=? AND size=?", import_key).fetchone() != None:
+            return 0
+        with open(jsonl_path, 'r') as file:
+            payloads = [json.loads(l) for l in file if l.strip() != ""]
+        num_stored = self.put_many(table, [(get_columns(p), p) for p in payloads])
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO imports VALUES (?, ?, ?, ?)", import_key)
+        logging.info(f"ResultStore: imported {num_stored}/{len(payloads)} entries of {jsonl_path} into {table}")
+        return num_stored
+
+    def export_jsonl(self, table: str, jsonl_path: str, **conditions):
+        '''
+        Write the payloads of the matching rows as JSONL, in the order they were stored.
+        '''
+        with open(jsonl_path, 'w') as file:
+            for payload in self.find(table, **conditions):
+                file.write(json.dumps(payload) + "\n")
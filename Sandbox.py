@@ -0,0 +1,275 @@
+import time
+import signal
+import resource
+import threading
+import traceback
+import multiprocessing
+import logging_config
+import logging
+
+# Define a custom exception for timeout
+class TimeoutException(Exception):
+    pass
+
+class RejectedException(Exception):
+    '''
+    Raised by a job that declines to run to completion, e.g., because its projected runtime exceeds the budget. The message is the reason.
+    '''
+    pass
+
+class SandboxStatus:
+    SUCCESS = "success"
+    TIMEOUT = "timeout"
+    OOM = "oom"
+    EXCEPTION = "exception"
+    REJECTED = "rejected"
+    APPROXIMATE = "approximate" # completed on a sample of the input only, e.g., by the admission control of `SimulatorBase`
+
+class SandboxResult:
+    def __init__(self, status: str, value=None, error: str=None, traceback_msg: str="", latency: float=0.0):
+        self.status = status
+        self.value = value
+        self.error = error
+        self.traceback_msg = traceback_msg
+        self.latency = latency
+
+    @property
+    def ok(self):
+        return self.status == SandboxStatus.SUCCESS
+
+    def __repr__(self):
+        return f"SandboxResult(status={self.status}, value={self.value}, error={self.error})"
+
+    def to_dict(self):
+        return {
+            "status": self.status,
+            "value": self.value,
+            "error": self.error,
+            "traceback_msg": self.traceback_msg,
+            "latency": self.latency
+        }
+
+class SandboxError(Exception):
+    '''
+    Raised by callers that want a failed `SandboxResult` to surface as an exception.
+    '''
+    def __init__(self, result: SandboxResult):
+        super().__init__(f"[{result.status}] {result.error}")
+        self.result = result
+
+def _classify_exception(error: BaseException):
+    if isinstance(error, MemoryError):
+        return SandboxStatus.OOM
+    if isinstance(error, TimeoutException):
+        return SandboxStatus.TIMEOUT
+    if isinstance(error, RejectedException):
+        return SandboxStatus.REJECTED
+    return SandboxStatus.EXCEPTION
+
+def _format_exception(error: BaseException):
+    if isinstance(error, RejectedException):
+        return str(error)
+    return repr(error)
+
+def _get_vm_size():
+    '''
+    Current virtual memory size (bytes) of this process, or `None` if unknown.
+    '''
+    try:
+        with open("/proc/self/statm", 'r') as file:
+            return int(file.read().split()[0]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        return None
+
+def _set_cpu_limit(cpu_limit: int):
+    '''
+    RLIMIT_CPU counts the CPU time of the whole process, so the soft limit is moved past the time already used by previous jobs.
+    '''
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = int(usage.ru_utime + usage.ru_stime) + 1 + cpu_limit
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+def limit_address_space(memory_limit: int):
+    '''
+    Limit (RLIMIT_AS) the address space this process may allocate to `memory_limit` bytes on top of what it already maps.
+    '''
+    vm_size = _get_vm_size()
+    limit = memory_limit + (vm_size if vm_size != None else 0)
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+def _sandbox_main(conn, memory_limit):
+    '''
+    Entry point of the worker process: receive `(func, args, kwargs, cpu_limit)` jobs and send back `SandboxResult`s.
+    '''
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if memory_limit != None:
+        limit_address_space(memory_limit)
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            break
+        if job == None:
+            break
+        func, args, kwargs, cpu_limit = job
+        if cpu_limit != None:
+            _set_cpu_limit(cpu_limit)
+        start = time.time()
+        try:
+            value = func(*args, **kwargs)
+            result = SandboxResult(SandboxStatus.SUCCESS, value=value)
+        except BaseException as error:
+            result = SandboxResult(_classify_exception(error), error=_format_exception(error), traceback_msg=traceback.format_exc().strip())
+        result.latency = time.time() - start
+        try:
+            conn.send(result)
+        except (EOFError, OSError):
+            break
+        except Exception as error:
+            # e.g., the returned value cannot be pickled
+            conn.send(SandboxResult(SandboxStatus.EXCEPTION, error=repr(error), traceback_msg=traceback.format_exc().strip(), latency=result.latency))
+    conn.close()
+
+class SandboxWorker:
+    '''
+    A long-lived worker process that runs one job at a time under
+    - `memory_limit` (bytes): RLIMIT_AS on top of the worker's baseline address space,
+    - `cpu_limit` (seconds): RLIMIT_CPU per job,
+    - `wall_limit` (seconds): the worker is killed if a job does not finish in time.
+    A worker that is killed or dies is respawned on the next `run()`. Each `run()` returns a `SandboxResult` whose status is one of `SandboxStatus`.
+    `run()` is thread-safe; use one worker per thread to run jobs concurrently.
+    '''
+    def __init__(self, wall_limit: float=None, cpu_limit: int=None, memory_limit: int=None):
+        self.wall_limit = wall_limit
+        self.cpu_limit = cpu_limit
+        self.memory_limit = memory_limit
+        self._ctx = multiprocessing.get_context("fork")
+        self._lock = threading.Lock()
+        self._process = None
+        self._conn = None
+        # statistics
+        self.spawn_count = 0
+        self.job_count = 0
+
+    @classmethod
+    def is_available(cls):
+        '''
+        Daemonic processes (e.g., `multiprocessing.Pool` workers) are not allowed to have children.
+        '''
+        return not multiprocessing.current_process().daemon
+
+    @classmethod
+    def run_local(cls, func, *args, **kwargs):
+        '''
+        Run `func` in the current process and wrap its outcome as a `SandboxResult`. No limit is enforced here.
+        '''
+        start = time.time()
+        try:
+            value = func(*args, **kwargs)
+            result = SandboxResult(SandboxStatus.SUCCESS, value=value)
+        except Exception as error:
+            result = SandboxResult(_classify_exception(error), error=_format_exception(error), traceback_msg=traceback.format_exc().strip())
+        result.latency = time.time() - start
+        return result
+
+    @property
+    def is_alive(self):
+        return self._process != None and self._process.is_alive()
+
+    def _spawn(self):
+        parent_conn, child_conn = self._ctx.Pipe()
+        self._process = self._ctx.Process(target=_sandbox_main, args=(child_conn, self.memory_limit), daemon=True)
+        self._process.start()
+        child_conn.close()
+        self._conn = parent_conn
+        self.spawn_count += 1
+
+    def _kill(self):
+        if self._process != None:
+            if self._process.is_alive():
+                self._process.kill()
+            self._process.join()
+            self._process = None
+        if self._conn != None:
+            self._conn.close()
+            self._conn = None
+
+    def _exit_result(self):
+        '''
+        Classify a worker that died while running a job.
+        '''
+        self._process.join()
+        exitcode = self._process.exitcode
+        if exitcode == -signal.SIGXCPU:
+            return SandboxResult(SandboxStatus.TIMEOUT, error="CPU time limit exceeded")
+        if exitcode == -signal.SIGKILL:
+            # not killed by us: most likely the kernel OOM killer
+            return SandboxResult(SandboxStatus.OOM, error="Worker was killed (SIGKILL)")
+        return SandboxResult(SandboxStatus.EXCEPTION, error=f"Worker exited with code {exitcode}")
+
+    def run(self, func, *args, **kwargs):
+        '''
+        Run `func(*args, **kwargs)` in the worker. `func`, its arguments and its return value must be picklable.
+        Return: `SandboxResult`
+        '''
+        return self.run_with_limits(func, args, kwargs, self.wall_limit, self.cpu_limit)
+
+    def run_with_limits(self, func, args=(), kwargs=None, wall_limit: float=None, cpu_limit: int=None):
+        '''
+        Same as `run()`, but with the wall-clock and CPU limits of this job only.
+        '''
+        if kwargs == None:
+            kwargs = dict()
+        with self._lock:
+            if not self.is_alive:
+                self._kill()
+                self._spawn()
+            self.job_count += 1
+            start = time.time()
+            try:
+                self._conn.send((func, args, kwargs, cpu_limit))
+            except (EOFError, OSError):
+                result = self._exit_result()
+                self._kill()
+                result.latency = time.time() - start
+                return result
+            except Exception as error:
+                # the job cannot be pickled; the worker is still healthy
+                return SandboxResult(SandboxStatus.EXCEPTION, error=repr(error), traceback_msg=traceback.format_exc().strip())
+            try:
+                is_ready = self._conn.poll(wall_limit)
+            except (EOFError, OSError):
+                is_ready = True
+            if not is_ready:
+                logging.warning(f"Sandbox worker {self._process.pid} exceeded the wall-clock limit ({wall_limit}s) and is killed")
+                self._kill()
+                return SandboxResult(SandboxStatus.TIMEOUT, error=f"Wall-clock limit ({wall_limit}s) exceeded", latency=time.time() - start)
+            try:
+                return self._conn.recv()
+            except (EOFError, OSError):
+                result = self._exit_result()
+                self._kill()
+                result.latency = time.time() - start
+                return result
+
+    def close(self):
+        with self._lock:
+            if self.is_alive:
+                try:
+                    self._conn.send(None)
+                except (EOFError, OSError):
+                    pass
+                self._process.join(1)
+            self._kill()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
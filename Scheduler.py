@@ -0,0 +1,53 @@
+import os
+from multiprocessing import Pool
+from typing import List
+from cache import get_trace_length
+
+def get_num_workers(num_jobs: int=None):
+    '''
+    The cores this process may run on, at most `num_jobs`.
+    '''
+    try:
+        num_cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        num_cores = os.cpu_count()
+    if num_jobs == None:
+        return max(1, num_cores)
+    return max(1, min(num_cores, num_jobs))
+
+def estimate_cost(trace_path: str, cache_cap: int, policy_cost: float=1.0):
+    '''
+    Relative cost of replaying a trace: trace length × cache capacity × `policy_cost`, e.g., the measured time per request of the policy, or the number of policies of a lockstep run.
+    '''
+    return get_trace_length(trace_path) * cache_cap * policy_cost
+
+def _run_indexed(args):
+    func, index, job = args
+    return index, func(job)
+
+def imap_scheduled(func, jobs: List, costs: List[float], num_workers: int=None):
+    '''
+    Run `func(job)` for every job in a pool of `num_workers` processes (default: the available cores), the most costly first, so that a long job does not start last.
+    `func` must be picklable, e.g., a module-level function.
+    Yield: (index of the job, result) as the jobs complete
+    '''
+    assert len(jobs) == len(costs)
+    if len(jobs) == 0:
+        return
+    if num_workers == None:
+        num_workers = get_num_workers(len(jobs))
+    order = sorted(range(len(jobs)), key=lambda i: costs[i], reverse=True)
+    with Pool(num_workers) as pool:
+        for index, result in pool.imap_unordered(_run_indexed, [(func, i, jobs[i]) for i in order], chunksize=1):
+            yield index, result
+
+def map_scheduled(func, jobs: List, costs: List[float], num_workers: int=None, on_result=None):
+    '''
+    Same as `imap_scheduled`, but `on_result(index, result)` is called as each job completes (e.g., to persist it at once), and the results are returned in the order of `jobs`.
+    '''
+    results = [None for _ in jobs]
+    for index, result in imap_scheduled(func, jobs, costs, num_workers):
+        results[index] = result
+        if on_result != None:
+            on_result(index, result)
+    return results
@@ -1,12 +1,18 @@
 import os
 import time
-from multiprocessing import Pool
 from typing import List
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+import logging_config
+import logging
 
 from Simulator import SimulatorCache, SimulatorConfig
-from cache import CacheConfig, Trace
-from utils import tune_libcachesim, run_libcachesim
+from cache import CacheConfig, SharedTraceStore, load_trace_columns, compute_next_vtime
+from utils import tune_libcachesim, run_libcachesim_many
+from Scheduler import map_scheduled, estimate_cost, get_num_workers
+from ResultCache import ResultCache, hash_code
+from JointTuner import get_sampled_trace_path, get_prefix_trace_path
+from SignatureIndex import SignatureIndex
 
 def signatary_simulate(simulator: SimulatorCache):
     return simulator.simulate(
@@ -20,18 +26,40 @@ def signatary_simulate(simulator: SimulatorCache):
     )
 
 class Signatary:
-    def __init__(self, test_folder, is_admission=False, trace_filter=None):
+    '''
+    The signature of a policy is its miss ratio on every test trace (one dimension per trace), normalized between Belady (0) and 1.
+    - The Belady baselines and every signature dimension are memoized in the shared `ResultCache`, per (trace hash, capacity) and per (normalized-code hash, trace hash, capacity): a dimension is simulated once per host, and only the missing dimensions of a signature are simulated.
+    - fidelity (float): with `fidelity` < 1, the signatures are computed on reduced test traces: a spatial sample of `fidelity` of the keys, with the capacity scaled accordingly (`fidelity_mode="sample"`), or the first `fidelity` of the requests, with the capacity of 10% of their ndv (`fidelity_mode="prefix"`).
+      `measured_error` is then the largest difference, per dimension, between the reduced and the full-trace signatures of the `reference_algos`.
+    '''
+    reduced_trace_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "analysis", "signature_trace")
+    reference_algos = ["fifo", "lru", "clock", "arc"] # policies with known behaviors, to measure the error of a reduced fidelity
+
+    def __init__(self, test_folder, is_admission=False, trace_filter=None, fidelity: float=1.0, fidelity_mode: str="sample"):
+        assert 0 < fidelity <= 1
+        assert fidelity_mode in ["sample", "prefix"]
         if trace_filter == None:
             test_trace_list = sorted(os.listdir(test_folder))
         else:
             test_trace_list = [t for t in sorted(os.listdir(test_folder)) if trace_filter(t) == False]
-        test_trace_cap_list = []
+        self.fidelity = fidelity
+        self.fidelity_mode = fidelity_mode
+        self.full_trace_cap_list = [] # (full test trace path, capacity)
+        test_trace_cap_list = [] # (replayed test trace path, capacity)
         for test_trace_file in test_trace_list:
-            trace = Trace(trace_path=os.path.join(test_folder, test_trace_file), next_vtime_set=True)
-            cap = int(trace.get_ndv() * 0.1)
-            if cap < 1:
-                cap = 1
-            test_trace_cap_list.append(cap)
+            trace_path = os.path.join(test_folder, test_trace_file)
+            cap = max(1, int(len(np.unique(load_trace_columns(trace_path)["key"])) * 0.1))
+            self.full_trace_cap_list.append((trace_path, cap))
+            if fidelity >= 1:
+                test_trace_cap_list.append((trace_path, cap))
+            elif fidelity_mode == "sample":
+                test_trace_cap_list.append((get_sampled_trace_path(trace_path, fidelity, self.reduced_trace_folder)[0], max(1, int(cap * fidelity))))
+            else:
+                prefix_trace_path, prefix_ndv = get_prefix_trace_path(trace_path, fidelity, self.reduced_trace_folder)
+                test_trace_cap_list.append((prefix_trace_path, max(1, int(prefix_ndv * 0.1))))
+        self.shared_traces = SharedTraceStore() # the pool workers attach to the decoded traces instead of decoding their own copies
+        for (test_trace_path, _) in test_trace_cap_list:
+            self.shared_traces.publish(test_trace_path)
 
         self.test_simulator_list = [SimulatorCache(
                 SimulatorConfig(
@@ -39,7 +67,7 @@ class Signatary:
                     config=CacheConfig(
                         capacity=test_trace_cap,
                         consider_obj_size=False,
-                        trace_path=os.path.join(test_folder, test_trace_file),
+                        trace_path=test_trace_path,
                         key_col_id=1,
                         size_col_id=2,
                         has_header=False,
@@ -51,25 +79,69 @@ class Signatary:
                     tune_int_upper=None
                 )
             )
-            for (test_trace_file, test_trace_cap) in zip(test_trace_list, test_trace_cap_list)
+            for (test_trace_path, test_trace_cap) in test_trace_cap_list
         ]
         self.is_admission = is_admission
-        if is_admission == False:
-            self.belady = [run_libcachesim(
-                                cache_trace=sim.config.trace_path,
-                                cache_alg="belady",
-                                cache_cap=sim.config.capacity,
-                            )
-                            for sim in self.test_simulator_list]
-        else:
-            self.belady = [0.0 for _ in self.test_simulator_list]
-        assert all([b != None for b in self.belady])
+        self.belady = self._get_belady([(sim.config.trace_path, sim.config.capacity) for sim in self.test_simulator_list])
         self.latency = 0.0
+        self.m_code_raw_signature = dict() # code key (see `_get_code_key`) -> miss ratio of every dimension, `None` if not computed yet
+        # an estimate of the error of the reduced fidelity, measured on the `reference_algos` only: not a bound for other policies
+        self.measured_error = [0.0 for _ in self.test_simulator_list]
+        if fidelity < 1:
+            self.measured_error = self._measure_error()
+
+    def _get_belady(self, trace_cap_list):
+        '''
+        Belady's miss ratio on every (trace path, capacity), memoized in the `ResultCache` (keyed on `cache.belady_version`); 0 for admission policies.
+        Raise `ValueError` if a baseline is degenerate, i.e., 1.0 on a trace with a repeated key: every policy would get the signature 0 in this dimension.
+        '''
+        if self.is_admission == True:
+            return [0.0 for _ in trace_cap_list]
+        belady = run_libcachesim_many([(trace_path, "belady", cap) for (trace_path, cap) in trace_cap_list])
+        for (trace_path, cap), belady_mr in zip(trace_cap_list, belady):
+            if belady_mr == None:
+                raise ValueError(f"Fail to simulate Belady on {trace_path} with capacity {cap}")
+            if belady_mr < 1.0:
+                continue
+            if (compute_next_vtime(load_trace_columns(trace_path)["key"]) >= 0).any():
+                raise ValueError(f"Degenerate Belady baseline on {trace_path} with capacity {cap}: miss ratio 1.0 on a trace with repeated keys")
+            logging.warning(f"Signatary: no key of {trace_path} is requested twice, every signature is 0 in this dimension")
+        return belady
+
+    def _measure_error(self):
+        '''
+        Return: the largest difference, per dimension, between the normalized miss ratios of the `reference_algos` on the reduced and on the full test traces
+        '''
+        full_belady = self._get_belady(self.full_trace_cap_list)
+        calls = []
+        for algo in self.reference_algos:
+            calls.extend([(trace_path, algo, cap) for (trace_path, cap) in self.full_trace_cap_list])
+            calls.extend([(sim.config.trace_path, algo, sim.config.capacity) for sim in self.test_simulator_list])
+        mr_list = run_libcachesim_many(calls)
+        measured_error = [0.0 for _ in self.test_simulator_list]
+        for i in range(len(self.reference_algos)):
+            full_mr_list = mr_list[2 * i * self.dimension:(2 * i + 1) * self.dimension]
+            reduced_mr_list = mr_list[(2 * i + 1) * self.dimension:(2 * i + 2) * self.dimension]
+            for d in range(self.dimension):
+                if full_mr_list[d] == None or reduced_mr_list[d] == None:
+                    logging.warning(f"Signatary: fail to run {self.reference_algos[i]} on {self.full_trace_cap_list[d][0]}")
+                    continue
+                full_norm_mr = self._normalize_miss_ratio(full_mr_list[d], full_belady[d])
+                reduced_norm_mr = self._normalize_miss_ratio(reduced_mr_list[d], self.belady[d])
+                measured_error[d] = max(measured_error[d], round(abs(full_norm_mr - reduced_norm_mr), 4))
+        logging.info(f"Signatary: fidelity {self.fidelity} ({self.fidelity_mode}), measured error {measured_error}")
+        return measured_error
 
     @property
     def dimension(self):
         return len(self.belady)
 
+    def new_index(self, p: float=2, use_tree: bool=False):
+        '''
+        Return: an empty `SignatureIndex` for the signatures of this `Signatary`
+        '''
+        return SignatureIndex(self.dimension, p=p, use_tree=use_tree)
+
     def _normalize_miss_ratio(self, mr: float, belady_mr: float):
         if mr == None:
             return None
@@ -81,7 +153,35 @@ class Signatary:
         return [self._normalize_miss_ratio(mr, belady_mr) for (mr, belady_mr) in zip(raw_signature, self.belady)]
 
 
+    def _get_code_key(self, code: str, is_sota: bool):
+        if is_sota == True:
+            return f"sota:{code}"
+        return hash_code(code)
+
+    def _lookup_dimensions(self, code: str, raw_signature: List[float]):
+        '''
+        Fill in the missing dimensions of a signature of `code` (with its default params fixed) from the `ResultCache`.
+        '''
+        for d, sim in enumerate(self.test_simulator_list):
+            if raw_signature[d] == None and sim.use_result_cache == True:
+                raw_signature[d] = ResultCache.default().get(**sim._get_result_cache_key(code))
+
     def sign(self, code: str, is_sota: bool=False):
+        '''
+        Only the dimensions not memoized yet are simulated; a failed dimension is simulated again by the next call.
+        Return: the normalized signature, `None` in the failed dimensions
+        '''
+        if is_sota != True:
+            code = self.test_simulator_list[0]._fix_default_param_for_code(code)
+        code_key = self._get_code_key(code, is_sota)
+        raw_signature = self.m_code_raw_signature.setdefault(code_key, [None for _ in self.test_simulator_list])
+        if is_sota != True:
+            self._lookup_dimensions(code, raw_signature)
+        missing_dims = [d for d in range(self.dimension) if raw_signature[d] == None]
+        if len(missing_dims) == 0:
+            return self._normalize_signature(raw_signature)
+        missing_sims = [self.test_simulator_list[d] for d in missing_dims]
+
         if is_sota == True:
             if self.is_admission == True:
                 alg = "fifo"
@@ -89,9 +189,7 @@ class Signatary:
             else:
                 alg = code
                 admission_alg = ""
-            signature = []
-            start = time.time()
-            for sim in self.test_simulator_list:
+            def sign_trace(sim):
                 mr_info = tune_libcachesim(
                     trace=sim.config.trace_path,
                     alg=alg,
@@ -102,28 +200,36 @@ class Signatary:
                 assert mr_info != None
                 mr = mr_info[1]
                 assert mr != None
-                signature.append(mr)
+                return mr
+            start = time.time()
+            # each trace waits on its own cachesim processes
+            with ThreadPoolExecutor(get_num_workers(len(missing_sims))) as executor:
+                mr_list = list(executor.map(sign_trace, missing_sims))
+            end = time.time()
+        else:
+            example_sim = self.test_simulator_list[0]
+            copy_dest = os.path.join(example_sim.system_path, "My.py")
+            assert os.path.exists(copy_dest)
+            with open(copy_dest, 'w') as file:
+                file.write(code)
+            start = time.time()
+            mr_list = map_scheduled(
+                signatary_simulate,
+                missing_sims,
+                [estimate_cost(sim.config.trace_path, sim.config.capacity) for sim in missing_sims]
+            )
             end = time.time()
-            self.latency += end - start
-            return self._normalize_signature(signature)
-        
-        # is_sota = False
-        example_sim = self.test_simulator_list[0]
-        copy_dest = os.path.join(example_sim.system_path, "My.py")
-        assert os.path.exists(copy_dest)
-        with open(copy_dest, 'w') as file:
-            file.write(example_sim._fix_default_param_for_code(code))
-        signature = []
-        start = time.time()
-        with Pool(len(self.test_simulator_list) * 2) as p:
-            signature = p.map(signatary_simulate, self.test_simulator_list)
-        end = time.time()
         self.latency += end - start
-        return self._normalize_signature(signature)
+        for d, mr in zip(missing_dims, mr_list):
+            raw_signature[d] = mr
+        return self._normalize_signature(raw_signature)
 
     def to_dict(self):
         return {
             "simulators": [sim.to_dict() for sim in self.test_simulator_list],
+            "fidelity": self.fidelity,
+            "fidelity_mode": self.fidelity_mode,
+            "measured_error": self.measured_error,
             "latency": self.latency
         }
 
@@ -0,0 +1,161 @@
+import json
+from typing import List
+import numpy as np
+
+class SignatureIndex:
+    '''
+    Nearest-neighbor index over policy signatures (see `Signatary.sign`), e.g., to place a candidate in a cell-based archive or to find the stored policy closest to it.
+    The signatures are stored column by column (one contiguous array per dimension, grown by doubling), so insertion is amortized O(dimension) and a query is `dimension` vectorized passes over all the signatures.
+    - p (1 | 2 | np.inf): the Minkowski norm of the distance
+    - use_tree (bool): also answer the queries with a `scipy.spatial.cKDTree` (scipy is imported on construction only), rebuilt once the rows inserted since the last build outnumber `rebuild_frac` of the tree; these rows are scanned directly meanwhile
+    '''
+    def __init__(self, dimension: int, p: float=2, use_tree: bool=False, rebuild_frac: float=0.25):
+        assert p in [1, 2, np.inf]
+        self.dimension = dimension
+        self.p = p
+        self.ids = [] # the id of every row
+        self._columns = np.empty((dimension, 1024), dtype=np.float64)
+        self._sq_norms = np.empty(1024, dtype=np.float64) # squared L2 norm of every row, for p=2
+        self._size = 0
+        self.rebuild_frac = rebuild_frac
+        self._tree = None
+        self._tree_size = 0 # rows [0, _tree_size) are in the tree
+        self._cKDTree = None
+        if use_tree == True:
+            from scipy.spatial import cKDTree
+            self._cKDTree = cKDTree
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def matrix(self):
+        '''
+        The signatures, one row per id (a view: do not modify).
+        '''
+        return self._columns[:, :self._size].T
+
+    def _to_vector(self, signature):
+        if any([v == None for v in signature]):
+            raise ValueError(f"Signature with a failed dimension: {signature}")
+        vector = np.asarray(signature, dtype=np.float64)
+        if vector.shape != (self.dimension,):
+            raise ValueError(f"Signature of dimension {vector.shape}, expected {self.dimension}")
+        return vector
+
+    def add(self, id, signature: List[float]):
+        '''
+        Raise `ValueError` if a dimension of the signature is `None` (failed).
+        Return: the row of the signature
+        '''
+        return self.add_many([id], [signature])[0]
+
+    def add_many(self, ids: list, signatures):
+        assert len(ids) == len(signatures)
+        if isinstance(signatures, np.ndarray):
+            vectors = signatures.astype(np.float64).reshape(-1, self.dimension)
+            if np.isnan(vectors).any():
+                raise ValueError("Signature with a failed dimension")
+        else:
+            vectors = np.array([self._to_vector(s) for s in signatures], dtype=np.float64).reshape(-1, self.dimension)
+        new_size = self._size + len(vectors)
+        if new_size > self._columns.shape[1]:
+            capacity = max(new_size, 2 * self._columns.shape[1])
+            columns = np.empty((self.dimension, capacity), dtype=np.float64)
+            columns[:, :self._size] = self._columns[:, :self._size]
+            self._columns = columns
+            self._sq_norms = np.resize(self._sq_norms, capacity)
+        self._columns[:, self._size:new_size] = vectors.T
+        self._sq_norms[self._size:new_size] = np.einsum("ij,ij->i", vectors, vectors)
+        self.ids.extend(ids)
+        rows = list(range(self._size, new_size))
+        self._size = new_size
+        return rows
+
+    def _get_distances(self, vector: np.ndarray, start: int=0):
+        '''
+        Return: the distance from `vector` to every row from `start` on
+        '''
+        columns = self._columns[:, start:self._size]
+        if self.p == 2:
+            # |x - q|^2 = |x|^2 - 2 x.q + |q|^2: one matrix-vector product
+            sq_distances = self._sq_norms[start:self._size] - 2 * (vector @ columns) + vector @ vector
+            return np.sqrt(np.maximum(sq_distances, 0.0))
+        distances = np.abs(columns[0] - vector[0])
+        for j in range(1, self.dimension):
+            if self.p == 1:
+                distances += np.abs(columns[j] - vector[j])
+            else:
+                np.maximum(distances, np.abs(columns[j] - vector[j]), out=distances)
+        return distances
+
+    def _update_tree(self):
+        if self._cKDTree == None or self._size - self._tree_size <= self.rebuild_frac * max(self._tree_size, 1024):
+            return
+        self._tree = self._cKDTree(np.ascontiguousarray(self.matrix))
+        self._tree_size = self._size
+
+    def knn(self, signature: List[float], k: int=1):
+        '''
+        Return: the `k` nearest signatures as (id, distance) pairs, nearest first
+        '''
+        vector = self._to_vector(signature)
+        k = min(k, self._size)
+        if k <= 0:
+            return []
+        self._update_tree()
+        rows, distances = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        if self._tree != None:
+            tree_distances, tree_rows = self._tree.query(vector, k=min(k, self._tree_size), p=self.p)
+            rows, distances = np.atleast_1d(tree_rows).astype(np.int64), np.atleast_1d(tree_distances)
+        start = self._tree_size if self._tree != None else 0
+        if start < self._size:
+            scan_distances = self._get_distances(vector, start)
+            if len(scan_distances) > k:
+                nearest = np.argpartition(scan_distances, k - 1)[:k]
+            else:
+                nearest = np.arange(len(scan_distances))
+            rows = np.concatenate([rows, nearest + start])
+            distances = np.concatenate([distances, scan_distances[nearest]])
+        order = np.argsort(distances, kind="stable")[:k]
+        return [(self.ids[rows[i]], float(distances[i])) for i in order]
+
+    def nearest(self, signature: List[float]):
+        '''
+        Return: (id, distance) of the nearest signature | `None` if the index is empty
+        '''
+        result = self.knn(signature, k=1)
+        return result[0] if len(result) > 0 else None
+
+    def within(self, signature: List[float], radius: float):
+        '''
+        Return: the signatures at most `radius` away as (id, distance) pairs, nearest first
+        '''
+        vector = self._to_vector(signature)
+        self._update_tree()
+        rows = np.empty(0, dtype=np.int64)
+        start = 0
+        if self._tree != None:
+            rows = np.asarray(self._tree.query_ball_point(vector, radius, p=self.p), dtype=np.int64)
+            start = self._tree_size
+        if start < self._size:
+            scan_distances = self._get_distances(vector, start)
+            # a margin for the rounding of the p=2 expansion, then the exact distances decide
+            rows = np.concatenate([rows, np.nonzero(scan_distances <= radius + 1e-9)[0] + start])
+        distances = np.linalg.norm(self._columns[:, rows].T - vector, ord=self.p, axis=1) if len(rows) > 0 else np.empty(0)
+        rows, distances = rows[distances <= radius], distances[distances <= radius]
+        order = np.argsort(distances, kind="stable")
+        return [(self.ids[rows[i]], float(distances[i])) for i in order]
+
+    def save(self, path: str):
+        '''
+        Store the index as an .npz file; the ids must be JSON-serializable.
+        '''
+        np.savez(path, matrix=self.matrix, ids=np.array(json.dumps(self.ids)), p=np.array(self.p))
+
+    @classmethod
+    def load(cls, path: str, use_tree: bool=False):
+        data = np.load(path)
+        index = cls(data["matrix"].shape[1], p=float(data["p"]), use_tree=use_tree)
+        index.add_many(json.loads(str(data["ids"])), data["matrix"])
+        return index
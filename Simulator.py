@@ -1,29 +1,60 @@
 import os
-from cache import Cache, CacheConfig, CacheObj, Trace
+import sys
+import copy
+import random
+import importlib
+import collections
+import numpy as np
+from cache import Cache, CacheConfig, CacheObj, CacheObjView, random_seed, Trace, get_trace_length, load_policy, get_metadata_size, is_sampled_key, sampled_key_mask, attach_shared_trace
 from abc import ABC, abstractmethod
 import time
 import logging_config
 import logging
 import signal
+import threading
 from datetime import datetime
 import traceback
-from utils import extract_string, get_type_and_value, is_expr, modify_string, write_to_file
-from openbox import Optimizer
-from openbox import space as sp
+from utils import write_to_file, get_pareto_front
+from PolicyTemplate import get_policy_template
+from Sandbox import RejectedException, SandboxError, SandboxResult, SandboxStatus, SandboxWorker, TimeoutException
+from ResultCache import ResultCache, hash_code
+from Telemetry import ProgressReporter, CostMeter
+from Optimizers import IntParam, RealParam, SearchSpace, minimize
 
-# Define a custom exception for timeout
-class TimeoutException(Exception):
-    pass
+_decoded_traces = collections.OrderedDict() # (trace path, mtime, size, sample_rate) -> [(key, size)], see `SimulatorBase.trace_cache_size`
+
+def get_decoded_trace(trace_path: str, sample_rate: float=1.0, capacity: int=0):
+    '''
+    The (key, size) of every request of a (spatially sampled) trace. The `capacity` latest decoded traces are kept in this process.
+    '''
+    stat = os.stat(trace_path)
+    memo_key = (os.path.abspath(trace_path), stat.st_mtime_ns, stat.st_size, sample_rate)
+    if memo_key in _decoded_traces:
+        _decoded_traces.move_to_end(memo_key)
+        return _decoded_traces[memo_key]
+    trace = Trace(trace_path, True)
+    entries = trace.entries if sample_rate >= 1 else [entry for entry in trace.entries if is_sampled_key(entry.key, sample_rate)]
+    decoded = [(str(entry.key), entry.size) for entry in entries]
+    if capacity > 0:
+        _decoded_traces[memo_key] = decoded
+        while len(_decoded_traces) > capacity:
+            _decoded_traces.popitem(last=False)
+    return decoded
 
 # Function to handle the timeout
 def timeout_handler(signum, frame):
     raise TimeoutException("Function execution timed out")
 
 # Decorator to add a timeout to a function
-def timeout():
-    seconds = SimulatorBase.get_timeout_limit()
+def timeout(seconds: int=None):
+    if seconds == None:
+        seconds = SimulatorBase.get_timeout_limit()
     def decorator(func):
         def wrapper(*args, **kwargs):
+            # SIGALRM can only be handled in the main thread
+            if threading.current_thread() is not threading.main_thread():
+                logging.warning(f"No timeout for {getattr(func, '__name__', func)} in thread {threading.current_thread().name}: SIGALRM is only handled in the main thread")
+                return func(*args, **kwargs)
             # Set the signal handler and alarm
             signal.signal(signal.SIGALRM, timeout_handler)
             signal.alarm(seconds)
@@ -56,6 +87,17 @@ class SimulatorConfig:
 
 class SimulatorBase(ABC):
     timeout_limit: int=600
+    memory_limit: int=4 * 1024 ** 3 # bytes a sandboxed run may allocate
+    use_sandbox: bool=True # run each simulation in a `SandboxWorker` process
+    use_result_cache: bool=True # look up / store miss ratios in the shared `ResultCache`
+    use_admission_control: bool=True # project the replay time from a calibration prefix, and do not wait for a run projected to exceed `timeout_limit`
+    admission_action: str="reject" # "reject" the run, or "sample": replay a spatially sampled trace that fits the budget instead
+    calibration_requests: int=10000 # length of the calibration prefix
+    progress_path: str=None # append progress events of every replay to this JSONL file, see `Telemetry.ProgressReporter`
+    progress_interval_requests: int=10000
+    progress_interval_seconds: float=5.0
+    trace_cache_size: int=0 # decoded traces kept per process, e.g., by the warm workers of `EvalDaemon`
+    optimizer: str="auto" # tuning backend, see `Optimizers.optimizer_backends`; "auto" is "tpe"
     def __init__(
         self,
         simulator_config: SimulatorConfig
@@ -71,6 +113,9 @@ class SimulatorBase(ABC):
         self.code_path = None # the place the code is stored
         # statistics
         self.latency = 0.0
+        self.last_run_result = None # `SandboxResult` of the latest run
+        self.last_run_cost = None # cost of the latest run (see `Telemetry.make_cost`), `None` if unknown
+        self.progress_callback = None # called with every progress event, in the process that replays the trace
     
     @classmethod
     def get_timeout_limit(cls):
@@ -104,6 +149,17 @@ class SimulatorBase(ABC):
             "config": self.config.to_dict(),
             "system_path": self.system_path,
             "timeout_limit": self.timeout_limit,
+            "memory_limit": self.memory_limit,
+            "use_sandbox": self.use_sandbox,
+            "use_result_cache": self.use_result_cache,
+            "use_admission_control": self.use_admission_control,
+            "admission_action": self.admission_action,
+            "calibration_requests": self.calibration_requests,
+            "progress_path": self.progress_path,
+            "progress_interval_requests": self.progress_interval_requests,
+            "progress_interval_seconds": self.progress_interval_seconds,
+            "trace_cache_size": self.trace_cache_size,
+            "optimizer": self.optimizer,
             "tune_runs": self.tune_runs,
             "code_folder": self.code_folder,
             "tune_int_upper": self.tune_int_upper,
@@ -121,28 +177,405 @@ class SimulatorCache(SimulatorBase):
         self.name = "Cache"
         if self.tune_int_upper == None:
             self.tune_int_upper = self.config.capacity
+        self._sandbox = None
+
+    def __getstate__(self):
+        # the sandbox worker owns a process and a pipe, which cannot be pickled
+        state = self.__dict__.copy()
+        state["_sandbox"] = None
+        return state
+
+    def _get_sandbox(self):
+        if self._sandbox == None:
+            self._sandbox = SandboxWorker(
+                wall_limit=self.timeout_limit,
+                cpu_limit=self.timeout_limit,
+                memory_limit=self.memory_limit
+            )
+        return self._sandbox
+
+    def close(self):
+        if self._sandbox != None:
+            self._sandbox.close()
+            self._sandbox = None
     
-    def _read_trace(self):
+    def _read_trace(self, sample_rate: float=1.0):
+        '''
+        Fresh `CacheObj`s on every call: policies may attach attributes to them.
+        If the trace is published in a `SharedTraceStore`, the objects are created on access from the shared columns.
+        '''
         assert isinstance(self.config, CacheConfig)
-        trace = Trace(self.config.trace_path, True)
+        shared = attach_shared_trace(self.config.trace_path)
+        if shared != None:
+            keys, sizes = shared
+            if sample_rate < 1:
+                mask = sampled_key_mask(keys, sample_rate)
+                keys, sizes = keys[mask], sizes[mask]
+            return CacheObjView(keys, sizes, self.config.consider_obj_size)
+        entries = get_decoded_trace(self.config.trace_path, sample_rate, self.trace_cache_size)
         if self.config.consider_obj_size == True:
-            return [CacheObj(key=str(entry.key), size=entry.size, consider_obj_size=True) for entry in trace.entries]
+            return [CacheObj(key=key, size=size, consider_obj_size=True) for (key, size) in entries]
         else:
-            return [CacheObj(key=str(entry.key), size=1, consider_obj_size=False) for entry in trace.entries]
+            return [CacheObj(key=key, size=1, consider_obj_size=False) for (key, _) in entries]
 
-    @timeout()
-    def _run(self, code, need_copy_code: bool=True):
+    def _run(self, code, need_copy_code: bool=True, params: dict=None, allow_approximate: bool=False):
+        '''
+        Run the code in a sandboxed worker process if possible, otherwise in this process under a SIGALRM timeout.
+        If `params` is given, the values are injected into a fresh policy namespace (see `PolicyTemplate`) and My.py is not touched.
+        Raise `SandboxError` if the run does not succeed, e.g., with status "rejected" by the admission control.
+        Successful runs are memoized in the shared `ResultCache` with their cost (also in `self.last_run_cost`).
+        A run routed to a sampled trace (`admission_action` "sample") is not memoized, and its result stays in `self.last_run_result.value`: its approximate miss ratio is returned only if `allow_approximate`, else `SandboxError` is raised with status "approximate", so that it is not stored as a full result.
+        '''
+        if params != None:
+            replay_func, replay_args = self._replay_params, (code, params)
+        else:
+            replay_func, replay_args = self._replay, (code, need_copy_code)
+        if self.use_result_cache == True:
+            cache_key = self._get_result_cache_key(code, need_copy_code, params)
+            miss_ratio = ResultCache.default().get(**cache_key)
+            if miss_ratio != None:
+                self.last_run_result = SandboxResult(SandboxStatus.SUCCESS, value=miss_ratio)
+                self.last_run_cost = ResultCache.default().get_cost(**cache_key)
+                return miss_ratio
+        self.last_run_cost = None
+        result = self._execute(replay_func, replay_args)
+        if result.status != SandboxStatus.SUCCESS:
+            raise SandboxError(result)
+        self.last_run_cost = result.value["cost"]
+        if "sample_rate" in result.value:
+            logging.info(f"Projected {result.value['projected_time']:.0f} s: replayed a {result.value['sample_rate']:.3f} sample of the trace")
+            if allow_approximate == True:
+                return result.value["mr"]
+            result.status = SandboxStatus.APPROXIMATE
+            result.error = f"approximate: projected {result.value['projected_time']:.0f} s, replayed a {result.value['sample_rate']:.3f} sample of the trace"
+            raise SandboxError(result)
+        # the value of a full run is its miss ratio, e.g., for `EvalDaemon`
+        result.value = result.value["mr"]
+        if self.use_result_cache == True:
+            ResultCache.default().put(value=result.value, cost=self.last_run_cost, **cache_key)
+        return result.value
+
+    def _execute(self, func, args, time_limit: int=None):
+        '''
+        Run `func(*args)` in the sandbox worker if possible, otherwise in this process under a SIGALRM timeout.
+        Off the main thread, where SIGALRM cannot be handled, the sandbox worker enforces the limit even if `use_sandbox` is `False`.
+        Return: `SandboxResult`
+        '''
+        if time_limit == None:
+            time_limit = self.timeout_limit
+        use_sandbox = self.use_sandbox
+        if use_sandbox == False and threading.current_thread() is not threading.main_thread():
+            logging.warning(f"No SIGALRM timeout in thread {threading.current_thread().name}: running in a sandbox worker instead")
+            use_sandbox = True
+        if use_sandbox == True and SandboxWorker.is_available():
+            result = self._get_sandbox().run_with_limits(func, args=args, wall_limit=time_limit, cpu_limit=time_limit)
+        else:
+            result = SandboxWorker.run_local(timeout(time_limit)(func), *args)
+        self.last_run_result = result
+        return result
+
+    def _get_result_cache_key(self, code, need_copy_code: bool=True, params: dict=None, split: int=None):
+        '''
+        A configuration has one key whether its values are injected (`params`) or rendered in the code (e.g., by `_fix_default_param_for_code`): the key is on the `PolicyTemplate.skeleton` of the code and the values the run sees.
+        '''
+        if params == None and need_copy_code == False:
+            # the code to run has already been copied to My.py
+            with open(os.path.join(self.system_path, "My.py"), 'r') as file:
+                code = file.read()
+        template = self._get_template(code)
+        if template != None and len(template.params) > 0:
+            params = template.cast_params(params) if params != None else template.get_literal_params()
+            code = template.skeleton
+        else:
+            params = None
+        return dict(
+            engine=ResultCache.python_engine,
+            engine_version=ResultCache.python_engine_version,
+            code=code,
+            params=params,
+            trace_path=self.config.trace_path,
+            capacity=self.config.capacity,
+            extra={"consider_obj_size": self.config.consider_obj_size} if split == None else {"consider_obj_size": self.config.consider_obj_size, "split": split}
+        )
+
+    def get_cost(self, code, params: dict=None, split: int=None):
+        '''
+        The cost (see `Telemetry.make_cost`) memoized with the miss ratio of `code`, with `params` injected (or as is if `None`), on this trace and capacity.
+        Return: cost dict | `None` if not memoized
+        '''
+        return ResultCache.default().get_cost(**self._get_result_cache_key(code, True, params, split))
+
+    def _replay(self, code, need_copy_code: bool=True):
         if need_copy_code == True:
             with open(os.path.join(self.system_path, "My.py"), 'w') as file:
                 file.write(code)
+        def get_label():
+            if need_copy_code == True:
+                return hash_code(code)[:12]
+            with open(os.path.join(self.system_path, "My.py"), 'r') as file:
+                return hash_code(file.read())[:12]
+        # `My` is imported by `cache.Cache`; reload it as `Cache` does when no policy is given
+        return self._replay_trace(lambda: importlib.reload(sys.modules["My"]), get_label=get_label)
+
+    def _replay_params(self, code, params: dict):
+        template = get_policy_template(code)
+        return self._replay_trace(lambda: template.instantiate(params), get_label=lambda: f"{hash_code(code)[:12]} {params}")
 
-        cache = Cache(config=self.config)
+    def _get_progress_reporter(self, config: CacheConfig, total_requests: int, get_label=None):
+        '''
+        - get_label (callable | None): return the label of the events; called only if the reporter is enabled, as the label may be costly, e.g., a code hash
+        '''
+        progress = ProgressReporter(
+            path=self.progress_path,
+            callback=self.progress_callback,
+            interval_requests=self.progress_interval_requests,
+            interval_seconds=self.progress_interval_seconds,
+            trace=config.trace_path,
+            capacity=config.capacity,
+            total_requests=total_requests
+        )
+        if progress.enabled and get_label != None:
+            progress.label = get_label()
+        return progress
+
+    def _replay_trace(self, new_policy, get_label=None):
+        '''
+        Replay the trace on a new `Cache` with the fresh policy `new_policy()`, under the admission control if enabled.
+        Return: {"mr", "cost"} (see `Telemetry.CostMeter`), plus "sample_rate" and "projected_time" if the run was routed to a sampled trace
+        '''
         trace = self._read_trace()
+        # as in `_replay_lockstep`: a policy that draws random numbers gives the same miss ratio wherever it runs
+        random.seed(random_seed)
+        policy = new_policy()
+        cache = Cache(config=self.config, policy=policy)
         assert cache.access_count == 0
         assert cache.hit_count == 0
-        for oid, obj in enumerate(trace):
-            cache.get(obj)
-        return round(1 - cache.hit_count / cache.access_count, 4)
+        meter = CostMeter(cache, lambda: get_metadata_size(policy), len(trace))
+        projected_time = self._replay_chunks(cache, trace, self._get_progress_reporter(self.config, len(trace), get_label), meter=meter)
+        if projected_time == None:
+            return {
+                "mr": round(1 - cache.hit_count / cache.access_count, 4),
+                "cost": meter.get_cost()
+            }
+        # aim at half of the budget: the projection is a rough one
+        sample_rate = min(1.0, 0.5 * self.timeout_limit / projected_time)
+        config = copy.copy(self.config)
+        config.capacity = int(self.config.capacity * sample_rate)
+        sampled_trace = self._read_trace(sample_rate)
+        if config.capacity < 1 or len(sampled_trace) == 0:
+            raise RejectedException(f"rejected: projected {projected_time:.0f} s, too long to sample")
+        random.seed(random_seed)
+        policy = new_policy()
+        cache = Cache(config=config, policy=policy)
+        meter = CostMeter(cache, lambda: get_metadata_size(policy), len(sampled_trace))
+        progress = self._get_progress_reporter(config, len(sampled_trace), lambda: f"{get_label() if get_label != None else None} (sample rate {sample_rate:.3f})")
+        self._replay_chunks(cache, sampled_trace, progress, use_admission_control=False, meter=meter)
+        return {
+            "mr": round(1 - cache.hit_count / cache.access_count, 4),
+            "cost": meter.get_cost(),
+            "sample_rate": sample_rate,
+            "projected_time": projected_time
+        }
+
+    def _replay_chunks(self, cache: Cache, trace, progress: ProgressReporter, use_admission_control: bool=None, num_calibration_chunks: int=10, meter: CostMeter=None):
+        '''
+        Replay `trace` chunk by chunk; progress events are emitted, and the chunk times recorded in `meter`, at chunk boundaries.
+        Under the admission control, once the calibration prefix (`calibration_requests`) is done, the total replay time is projected after every chunk, without the overhead of `meter`. Raise `RejectedException` if the projection exceeds `timeout_limit` and `admission_action` is "reject".
+        Return: `None` if the whole trace is replayed, else the projected time (s) at which the replay stopped
+        '''
+        if use_admission_control == None:
+            use_admission_control = self.use_admission_control
+        chunk_size = max(1, self.calibration_requests // num_calibration_chunks)
+        if progress.enabled:
+            chunk_size = max(1, min(chunk_size, self.progress_interval_requests))
+        get_miss_ratio = lambda: round(1 - cache.hit_count / cache.access_count, 4) if cache.access_count > 0 else None
+        samples = [] # (cache occupancy, seconds per request) of each chunk
+        num_done = 0
+        progress.start()
+        start = time.perf_counter()
+        try:
+            for chunk_start in range(0, len(trace), chunk_size):
+                chunk = trace[chunk_start:chunk_start + chunk_size]
+                chunk_time = time.perf_counter()
+                for obj in chunk:
+                    cache.get(obj)
+                now = time.perf_counter()
+                num_done = chunk_start + len(chunk)
+                chunk_time = now - chunk_time
+                if meter != None:
+                    # without the time spent measuring the cost, which is not the policy's
+                    chunk_time = meter.record(chunk_time, len(chunk))
+                progress.update(num_done, get_miss_ratio(), lambda: self._get_occupancy(cache))
+                if use_admission_control == False:
+                    continue
+                samples.append((self._get_occupancy(cache), chunk_time / len(chunk)))
+                if num_done < self.calibration_requests or num_done == len(trace):
+                    continue
+                projected_time = (now - start - (meter.overhead_time if meter != None else 0.0)) + (len(trace) - num_done) * self._project_time_per_request(samples)
+                if projected_time > self.timeout_limit:
+                    if self.admission_action == "sample":
+                        progress.fail(num_done, RejectedException(f"sampled: projected {projected_time:.0f} s"))
+                        return projected_time
+                    raise RejectedException(f"rejected: projected {projected_time:.0f} s")
+        except BaseException as error:
+            # e.g., an exception of the policy, or the SIGALRM timeout
+            progress.fail(num_done, error)
+            raise
+        progress.finish(num_done, get_miss_ratio(), self._get_occupancy(cache))
+        return None
+
+    def _get_occupancy(self, cache: Cache):
+        if self.config.consider_obj_size == True:
+            return cache.size / cache.capacity
+        return len(cache.cache) / cache.capacity
+
+    def _project_time_per_request(self, samples):
+        '''
+        The time per request of the rest of the replay: the recent rate, or, if the cache is still filling, the rate extrapolated linearly to a full cache if it is higher.
+        '''
+        recent = float(np.mean([t for (_, t) in samples[-3:]]))
+        occupancies = np.array([o for (o, _) in samples])
+        if occupancies[-1] >= 1.0 or np.ptp(occupancies) == 0:
+            return recent
+        slope, intercept = np.polyfit(occupancies, [t for (_, t) in samples], 1)
+        return max(recent, slope + intercept)
+
+    def _replay_with_cost(self, code, params: dict, num_samples: int=64):
+        '''
+        Replay the trace in `num_samples` chunks; the metadata size is sampled after each chunk.
+        Return: {"mr", "time_per_request" (seconds, policy and cache bookkeeping only), "metadata_bytes" (peak)}
+        '''
+        random.seed(random_seed)
+        policy = get_policy_template(code).instantiate(params)
+        cache = Cache(config=self.config, policy=policy)
+        trace = self._read_trace()
+        chunk_size = max(1, -(-len(trace) // num_samples))
+        elapsed = 0.0
+        metadata_bytes = get_metadata_size(policy)
+        for chunk_start in range(0, len(trace), chunk_size):
+            start = time.perf_counter()
+            for obj in trace[chunk_start:chunk_start + chunk_size]:
+                cache.get(obj)
+            elapsed += time.perf_counter() - start
+            metadata_bytes = max(metadata_bytes, get_metadata_size(policy))
+        return {
+            "mr": round(1 - cache.hit_count / cache.access_count, 4),
+            "time_per_request": elapsed / max(len(trace), 1),
+            "metadata_bytes": metadata_bytes
+        }
+
+    def _load_policy(self, code, params: dict=None):
+        if params != None:
+            return get_policy_template(code).instantiate(params)
+        return load_policy(code)
+
+    def _replay_lockstep(self, code_list, params_list, split: int=None):
+        '''
+        Feed each request of one decoded trace to every policy in turn. A policy that raises is dropped; the others go on.
+        Each policy has its own `CostMeter`, which times its own requests only, and its own state of the `random` module, seeded as in a serial replay, so that its miss ratio is the one of `_run`.
+        - split (int): if given, the miss ratios of the first `split` requests and of the rest are reported separately, i.e., the rest is replayed on a warm cache
+        Return: (mr_list, error_list, cost_list); with `split`, each miss ratio is a (prefix mr, suffix mr) pair
+        '''
+        mr_list = [None for _ in code_list]
+        error_list = [None for _ in code_list]
+        cost_list = [None for _ in code_list]
+        trace = self._read_trace()
+        meters = dict() # code_id -> CostMeter
+        random_states = dict() # code_id -> state of `random`, for the codes that may use it
+        caches = []
+        for code_id, (code, params) in enumerate(zip(code_list, params_list)):
+            try:
+                random.seed(random_seed)
+                policy = self._load_policy(code, params)
+                cache = Cache(config=self.config, policy=policy)
+                meters[code_id] = CostMeter(cache, (lambda policy: lambda: get_metadata_size(policy))(policy), len(trace))
+                caches.append((code_id, cache))
+                if "random" in code:
+                    random_states[code_id] = random.getstate()
+            except Exception as error:
+                error_list[code_id] = repr(error)
+        if len(random_states) == 1:
+            # the only user of `random` keeps it for the whole replay
+            random.setstate(random_states.popitem()[1])
+        def replay(objs, caches):
+            perf_counter = time.perf_counter
+            for obj in objs:
+                failed_code_ids = []
+                for code_id, cache in caches:
+                    random_state = random_states.get(code_id)
+                    if random_state != None:
+                        random.setstate(random_state)
+                    start = perf_counter()
+                    try:
+                        cache.get(obj)
+                    except Exception as error:
+                        error_list[code_id] = repr(error)
+                        failed_code_ids.append(code_id)
+                    meters[code_id].record(perf_counter() - start)
+                    if random_state != None:
+                        random_states[code_id] = random.getstate()
+                if len(failed_code_ids) > 0:
+                    caches = [(code_id, cache) for (code_id, cache) in caches if code_id not in failed_code_ids]
+            return caches
+        get_miss_ratio = lambda hit_count, access_count: round(1 - hit_count / access_count, 4) if access_count > 0 else None
+        if split == None:
+            for code_id, cache in replay(trace, caches):
+                mr_list[code_id] = get_miss_ratio(cache.hit_count, cache.access_count)
+                cost_list[code_id] = meters[code_id].get_cost()
+            return mr_list, error_list, cost_list
+        caches = replay(trace[:split], caches)
+        prefix_counts = {code_id: (cache.hit_count, cache.access_count) for (code_id, cache) in caches}
+        for code_id, cache in replay(trace[split:], caches):
+            prefix_hit_count, prefix_access_count = prefix_counts[code_id]
+            mr_list[code_id] = (
+                get_miss_ratio(prefix_hit_count, prefix_access_count),
+                get_miss_ratio(cache.hit_count - prefix_hit_count, cache.access_count - prefix_access_count)
+            )
+            cost_list[code_id] = meters[code_id].get_cost()
+        return mr_list, error_list, cost_list
+
+    def simulate_lockstep(self, code_list, params_list=None, split: int=None):
+        '''
+        Simulate several policies (e.g., one policy with several parameter sets) in one pass over the trace.
+        Each code runs on its own `Cache` and policy namespace, so their metadata stay isolated. The time limit is `timeout_limit` per code.
+        Args:
+        - code_list (List[str])
+        - params_list (List[dict | None] | None): params injected into each code (see `PolicyTemplate`)
+        - split (int | None): report the miss ratios of the first `split` requests and of the rest (on a warm cache) separately
+        Return: list of miss ratios (or of (prefix mr, suffix mr) pairs with `split`), `None` for each code that fails
+        '''
+        if params_list == None:
+            params_list = [None for _ in code_list]
+        assert len(params_list) == len(code_list)
+        mr_list = [None for _ in code_list]
+        pending_code_ids = []
+        cache_keys = [self._get_result_cache_key(code, True, params, split) for (code, params) in zip(code_list, params_list)]
+        for code_id, cache_key in enumerate(cache_keys):
+            if self.use_result_cache == True:
+                mr_list[code_id] = ResultCache.default().get(**cache_key)
+            if mr_list[code_id] == None:
+                pending_code_ids.append(code_id)
+        if len(pending_code_ids) == 0:
+            return mr_list
+
+        pending_code_list = [code_list[code_id] for code_id in pending_code_ids]
+        pending_params_list = [params_list[code_id] for code_id in pending_code_ids]
+        time_limit = self.timeout_limit * len(pending_code_list)
+        start = time.time()
+        result = self._execute(self._replay_lockstep, (pending_code_list, pending_params_list, split), time_limit)
+        self.latency += time.time() - start
+        if result.status != SandboxStatus.SUCCESS:
+            logging.warning(f"Lockstep simulation of {len(pending_code_list)} codes: FAIL...\n\tError message: [{result.status}] {result.error}")
+            return mr_list
+        pending_mr_list, pending_error_list, pending_cost_list = result.value
+        for code_id, mr, error, cost in zip(pending_code_ids, pending_mr_list, pending_error_list, pending_cost_list):
+            if mr == None:
+                logging.warning(f"Lockstep simulation of code {code_id}: FAIL...\n\tError message: {error}")
+                continue
+            mr_list[code_id] = mr
+            if self.use_result_cache == True:
+                ResultCache.default().put(value=mr, cost=cost, **cache_keys[code_id])
+        return mr_list
     
     def _fix_default_param_for_code(self, code, default_params: dict=None):
         config_space = self._get_configspace(code, True)
@@ -159,7 +592,6 @@ class SimulatorCache(SimulatorBase):
             return new_code
         return code
 
-    @timeout()
     def simulate(self, code, code_id, need_log=True, check_code_exists: bool=True, fix_default_param: bool=False, need_save=True, need_copy_code: bool=True, default_params: dict=None):
         self.code_path = os.path.join(self.code_folder, f"{code_id}.py")
         if check_code_exists == True:
@@ -172,9 +604,13 @@ class SimulatorCache(SimulatorBase):
         except Exception as error:
             end = time.time()
             self.latency += end - start
-            logging.warning(f"New code: {code_id}\n\tFAIL...\n\tError message: {repr(error)}")
+            if isinstance(error, SandboxError) and error.result.status in [SandboxStatus.REJECTED, SandboxStatus.APPROXIMATE]:
+                error_msg = error.result.error # "rejected: projected N s" | "approximate: ..."
+            else:
+                error_msg = repr(error)
+            logging.warning(f"New code: {code_id}\n\tFAIL...\n\tError message: {error_msg}")
             if need_log:
-                self._log_error(code_id, "(Simulation) " + repr(error), traceback.format_exc().strip())
+                self._log_error(code_id, "(Simulation) " + error_msg, traceback.format_exc().strip())
             self._reset(need_copy_code)
             return None
         end = time.time()
@@ -190,37 +626,45 @@ class SimulatorCache(SimulatorBase):
             )
         return miss_ratio
     
-    def tune(self, code, code_id, fixed_default_param: bool, need_log: bool=True, need_copy_code: bool=True):
+    def tune(self, code, code_id, fixed_default_param: bool, need_log: bool=True, need_copy_code: bool=True, warm_starter=None, batch_size: int=1):
+        '''
+        - warm_starter (WarmStarter | None): seed the optimizer with prior results on similar traces
+        - batch_size (int): if > 1, the optimizer proposes `batch_size` configurations at a time, and each batch is simulated in lockstep
+        '''
         self.code_path = os.path.join(self.code_folder, f"{code_id}.py")
         config_space = self._get_configspace(code, fixed_default_param)
         if config_space == None:
             # No tunable parameters
             return None, None, None
         default_params = dict()
-        for k, v in dict(config_space).items(): # https://automl.github.io/ConfigSpace/latest/api/ConfigSpace/configuration/#ConfigSpace.configuration.Configuration.get_dictionary
+        for k, v in dict(config_space).items():
             default_params[k] = v.default_value
 
-        def objective(config_space: sp.Configuration):
-            params = dict(config_space).copy()
+        def objective(params: dict):
             assert len(params) > 0
-            new_code = self._update_code(code, params)
             try:
-                score = self._run(code=new_code, need_copy_code=need_copy_code)
+                score = self._run(code=code, need_copy_code=need_copy_code, params=params)
             except Exception:
-                self._reset(need_copy_code)
                 score = 1.0
             assert score != None
-            return dict(objectives=[score]) # tune for the minimal
+            return [score] # tune for the minimal
+
+        def evaluate_batch(params_list):
+            mr_list = self.simulate_lockstep([code for _ in params_list], params_list)
+            return [[mr if mr != None else 1.0] for mr in mr_list]
         
-        opt = Optimizer(
-            objective_function=objective,
-            config_space=config_space,
-            num_objectives=1,
-            num_constraints=0,
+        optimizer_kwargs = dict(
+            objective=objective,
+            space=config_space,
             max_runs=self.tune_runs,
-            surrogate_type="prf", # 'prf' for practical problems; 'gp' for mathematical problems
-            visualization="none"
+            optimizer=self.optimizer,
+            num_objectives=1,
+            batch_size=batch_size,
+            evaluate_batch=evaluate_batch if batch_size > 1 else None,
+            surrogate_type="prf", # openbox: 'prf' for practical problems; 'gp' for mathematical problems
         )
+        if warm_starter != None:
+            optimizer_kwargs.update(warm_starter.get_optimizer_kwargs(self.config.trace_path, config_space, self.tune_runs))
         
         opt_score = None
         tuned_parms = None
@@ -228,7 +672,7 @@ class SimulatorCache(SimulatorBase):
 
         start = time.time()
         try:
-            history = opt.run()
+            history = minimize(**optimizer_kwargs)
         except Exception as error:
             error_log = True
             logging.info(f"Tuning code {code_id}: FAIL...\n\tError message: {repr(error)}")
@@ -244,6 +688,49 @@ class SimulatorCache(SimulatorBase):
 
         return opt_score, default_params, tuned_parms
 
+    def tune_multi_objective(self, code, code_id, fixed_default_param: bool, need_log: bool=True):
+        '''
+        Tune the code's parameters for miss ratio, time per request and peak metadata bytes jointly (all minimized).
+        Costs are machine-dependent, so these runs bypass the `ResultCache`. A failed run scores the worst miss ratio and the resource limits, i.e., the time limit spread over the requests of the trace.
+        Return: pareto_front, default_params | `None, None` if the code has no tunable parameters
+        - pareto_front (List[{"params", "mr", "time_per_request", "metadata_bytes"}]): the non-dominated runs, sorted by miss ratio
+        '''
+        objective_keys = ["mr", "time_per_request", "metadata_bytes"]
+        self.code_path = os.path.join(self.code_folder, f"{code_id}.py")
+        config_space = self._get_configspace(code, fixed_default_param)
+        if config_space == None:
+            # No tunable parameters
+            return None, None
+        default_params = {k: v.default_value for k, v in dict(config_space).items()}
+
+        trials = []
+        # on the scale of the time per request of the successful runs
+        worst_time_per_request = self.timeout_limit / max(get_trace_length(self.config.trace_path), 1)
+        def objective(params: dict):
+            result = self._execute(self._replay_with_cost, (code, params))
+            if result.status != SandboxStatus.SUCCESS:
+                return [1.0, worst_time_per_request, float(self.memory_limit)]
+            trials.append(dict(params=params, **result.value))
+            return [result.value[k] for k in objective_keys]
+
+        start = time.time()
+        try:
+            minimize(
+                objective=objective,
+                space=config_space,
+                max_runs=self.tune_runs,
+                optimizer=self.optimizer,
+                num_objectives=len(objective_keys),
+                surrogate_type="prf",
+                acq_type="parego", # openbox: scalarizes the objectives, so no reference point is needed
+            )
+        except Exception as error:
+            logging.info(f"Multi-objective tuning code {code_id}: FAIL...\n\tError message: {repr(error)}")
+            if need_log:
+                self._log_error(code_id, "(Tuning) " + repr(error), traceback.format_exc().strip())
+        self.latency += time.time() - start
+        return get_pareto_front(trials, objective_keys), default_params
+
     def _get_configspace(self, code, fixed_default=False):
         '''
         Args:
@@ -253,50 +740,26 @@ class SimulatorCache(SimulatorBase):
             - float: 0.42
             - bool: 1
         Return:
-        - space (openbox.Space | None) if code has tunable parameters,
+        - space (Optimizers.SearchSpace | None) if code has tunable parameters,
         - or `None`
         '''
-        space = sp.Space()
-
-        tp_pattern = r'(# Put tunable constant parameters below\s*\n)(.*?)(?=^# Put the metadata specifically maintained by the policy below)'
-
-        tunable_parameters: str = extract_string(
-            text=code,
-            regex=tp_pattern,
-            group_id=2,
-        )
-
-        if tunable_parameters == None or tunable_parameters.strip() == "":
+        template = self._get_template(code)
+        if template == None or len(template.params) == 0:
             return None
 
-        candid_exprs = tunable_parameters.split("\n")
         optimizer_params = []
-        for cexpr in candid_exprs:
-            if not is_expr(cexpr):
-                continue
-            rhs_pattern = r"=\s*(.*?)\s*(#.*)?$"
-            rhs = extract_string(
-                text=cexpr,
-                regex=rhs_pattern,
-                group_id=1
-            )
-            if rhs == None:
-                continue
-            type_and_value = get_type_and_value(rhs)
-            if type_and_value == None:
-                continue
-            assert len(type_and_value) == 2
-            var_name = str(len(optimizer_params))
-            var_type = type_and_value[0]
+        for param in template.params:
+            var_name = param.param_id
+            var_type = param.type
             if var_type == bool:
                 var_lower = 0
                 var_upper = 1
-                var_default = 1 if type_and_value[1] else 0
+                var_default = 1 if param.default else 0
                 if fixed_default == True:
                     var_default = 1
-                optimizer_params.append(sp.Int(var_name, var_lower, var_upper, default_value=var_default))
+                optimizer_params.append(IntParam(var_name, var_lower, var_upper, default_value=var_default))
             elif var_type == int:
-                var_default = int(type_and_value[1])
+                var_default = int(param.default)
                 if fixed_default == True:
                     var_default = 3
                 var_lower = min(var_default, 1)
@@ -304,21 +767,26 @@ class SimulatorCache(SimulatorBase):
                 assert self.tune_int_upper != None
                 var_upper = self.tune_int_upper
                 var_upper = max(var_upper, 2 * var_default, var_lower)
-                optimizer_params.append(sp.Int(var_name, var_lower, var_upper, default_value=var_default))
+                optimizer_params.append(IntParam(var_name, var_lower, var_upper, default_value=var_default))
             else:
                 assert var_type == float
-                var_default = float(type_and_value[1])
+                var_default = float(param.default)
                 if fixed_default == True:
                     var_default = 0.42
                 var_lower = min(var_default, 0.0)
                 var_upper = max(var_default, 1.0)
-                optimizer_params.append(sp.Real(var_name, var_lower, var_upper, default_value=var_default))
+                optimizer_params.append(RealParam(var_name, var_lower, var_upper, default_value=var_default))
+
+        return SearchSpace(optimizer_params)
 
-        if len(optimizer_params) == 0:
+    def _get_template(self, code):
+        '''
+        Return: the parsed `PolicyTemplate` of the code, or `None` if the code cannot be parsed
+        '''
+        try:
+            return get_policy_template(code)
+        except SyntaxError:
             return None
-        
-        space.add_variables(optimizer_params)
-        return space
 
     def _update_code(self, code, params):
         '''
@@ -330,55 +798,10 @@ class SimulatorCache(SimulatorBase):
         - new_code (str)
         '''
         assert params != None
-        tp_pattern = r'(# Put tunable constant parameters below\s*\n)(.*?)(?=^# Put the metadata specifically maintained by the policy below)'
-
-        tunable_parameters = extract_string(
-            text=code,
-            regex=tp_pattern,
-            group_id=2,
-        )
-
-        assert tunable_parameters != None
-
-        candid_exprs = tunable_parameters.split("\n")
-        new_cexprs = []
-        param_id = 0
-        for cexpr in candid_exprs:
-            new_cexprs.append(cexpr)
-            if not is_expr(cexpr):
-                continue
-            rhs_pattern = r"=\s*(.*?)\s*(#.*)?$"
-            rhs = extract_string(
-                text=cexpr,
-                regex=rhs_pattern,
-                group_id=1
-            )
-            if rhs == None:
-                continue
-            type_and_value = get_type_and_value(rhs)
-            if type_and_value == None:
-                continue
-            assert len(type_and_value) == 2
-            new_cexpr = modify_string(
-                text=cexpr,
-                regex=rhs_pattern,
-                group_id=1,
-                modification=str(params[str(param_id)])
-            )
-            new_cexprs[-1] = new_cexpr
-            param_id += 1
-
-        assert param_id == len(params)
-
-        assert len(new_cexprs) == len(candid_exprs)
-        new_tunable_parameters = "\n".join(new_cexprs)
-        new_code = modify_string(
-            text=code,
-            regex=tp_pattern,
-            group_id=2,
-            modification=new_tunable_parameters
-        )
-        return new_code
+        template = self._get_template(code)
+        assert template != None
+        assert len(params) == len(template.params)
+        return template.render(params)
 
     def _reset(self, need_copy_code: bool=True):
         if need_copy_code == True:
@@ -0,0 +1,243 @@
+import os
+import sys
+import json
+import time
+import uuid
+import resource
+from typing import Dict, List
+
+def get_rss():
+    '''
+    Resident set size (bytes) of this process; the peak RSS if the current one is unknown.
+    '''
+    try:
+        with open("/proc/self/statm", 'r') as file:
+            return int(file.read().split()[1]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+cost_columns = ["wall_time", "requests_per_second", "peak_rss", "metadata_bytes", "evict_scan"]
+
+def make_cost(wall_time: float, num_requests: int, peak_rss: int=None, metadata_bytes: int=None, evict_scan: float=None):
+    '''
+    The cost of one run, stored next to its miss ratio; `None` for what the engine does not report.
+    - wall_time (s): the replay only, not the trace decoding
+    - requests_per_second
+    - peak_rss (bytes): of the replaying process, shared by the runs of a lockstep or in-process pass
+    - metadata_bytes: peak deep size of the policy's metadata, see `cache.get_metadata_size`
+    - evict_scan: mean number of Python lines executed per eviction, including the functions the eviction calls (e.g., the key function of a `min()` over the cached keys)
+    '''
+    return {
+        "wall_time": wall_time,
+        "requests_per_second": num_requests / wall_time if wall_time > 0 else None,
+        "peak_rss": peak_rss,
+        "metadata_bytes": metadata_bytes,
+        "evict_scan": evict_scan
+    }
+
+class CostMeter:
+    '''
+    Measure the cost (see `make_cost`) of replaying a trace on one `Cache`: `record()` the time of every replayed chunk, then `get_cost()`.
+    The RSS and the metadata size are sampled about `num_samples` times over the replay; the lines of one eviction out of `evict_sample_interval` are traced, and of at most about `max_traced_evictions` over the replay.
+    The time of the traced evictions and of the samples is measurement overhead (`overhead_time`): it is left out of the recorded times.
+    '''
+    def __init__(self, cache, get_metadata_bytes, total_requests: int, num_samples: int=16, evict_sample_interval: int=64, max_traced_evictions: int=1024):
+        '''
+        - cache (Cache): its evict function is wrapped to trace the sampled evictions
+        - get_metadata_bytes (func): () -> the metadata size of the policy
+        '''
+        self.get_metadata_bytes = get_metadata_bytes
+        self.sample_interval = max(1, total_requests // num_samples)
+        self.evict_sample_interval = max(evict_sample_interval, total_requests // max_traced_evictions)
+        # statistics
+        self.wall_time = 0.0
+        self.overhead_time = 0.0 # (s) spent tracing evictions and sampling
+        self.num_requests = 0
+        self.peak_rss = get_rss()
+        self.metadata_bytes = get_metadata_bytes()
+        self.num_evictions = 0
+        self.num_traced_evictions = 0
+        self.num_traced_lines = 0
+        # latent variables
+        self._next_sample = self.sample_interval
+        self._unrecorded_overhead = 0.0 # (s) of traced evictions since the last `record()`
+        evict_func = cache.evict_func
+        cache.evict_func = lambda cache_snapshot, obj: self._evict(evict_func, cache_snapshot, obj)
+
+    def _evict(self, evict_func, cache_snapshot, obj):
+        self.num_evictions += 1
+        if (self.num_evictions - 1) % self.evict_sample_interval != 0:
+            return evict_func(cache_snapshot, obj)
+        num_lines = 0
+        def trace_lines(frame, event, arg):
+            nonlocal num_lines
+            if event == "line":
+                num_lines += 1
+            return trace_lines
+        previous_trace = sys.gettrace()
+        start = time.perf_counter()
+        sys.settrace(trace_lines)
+        try:
+            return evict_func(cache_snapshot, obj)
+        finally:
+            sys.settrace(previous_trace)
+            self._unrecorded_overhead += time.perf_counter() - start
+            self.num_traced_evictions += 1
+            self.num_traced_lines += num_lines
+
+    def _sample(self):
+        start = time.perf_counter()
+        self.peak_rss = max(self.peak_rss, get_rss())
+        self.metadata_bytes = max(self.metadata_bytes, self.get_metadata_bytes())
+        self.overhead_time += time.perf_counter() - start
+
+    def record(self, wall_time: float, num_requests: int=1):
+        '''
+        - wall_time (s): of the requests replayed since the previous call, traced evictions included
+        Return: `wall_time` without the traced evictions, i.e., the time of the replay alone
+        '''
+        overhead, self._unrecorded_overhead = min(self._unrecorded_overhead, wall_time), 0.0
+        self.overhead_time += overhead
+        self.wall_time += wall_time - overhead
+        self.num_requests += num_requests
+        if self.num_requests >= self._next_sample:
+            self._sample()
+            self._next_sample = self.num_requests + self.sample_interval
+        return wall_time - overhead
+
+    def get_cost(self):
+        self._sample()
+        return make_cost(
+            wall_time=self.wall_time,
+            num_requests=self.num_requests,
+            peak_rss=self.peak_rss,
+            metadata_bytes=self.metadata_bytes,
+            evict_scan=self.num_traced_lines / self.num_traced_evictions if self.num_traced_evictions > 0 else None
+        )
+
+class ProgressReporter:
+    '''
+    Emit progress events of one replay every `interval_requests` requests or `interval_seconds` seconds, whichever comes first.
+    An event is a dict:
+    - run_id, pid, label, trace, capacity: who is running,
+    - event: "start", "progress", "done" or "failed" (with "error"),
+    - time, elapsed (s), requests_done, total_requests, requests_per_second (since the previous event), miss_ratio (running), occupancy, rss (bytes).
+    Events are appended as JSON lines to `path` (one `write()` per line, so many processes can share the file) and/or passed to `callback(event)`.
+    The callback runs in the process that replays the trace, e.g., a sandbox worker, so it must be picklable to reach there (e.g., the `put` of a `multiprocessing.Manager().Queue()`).
+    '''
+    def __init__(self, path: str=None, callback=None, interval_requests: int=10000, interval_seconds: float=5.0, label: str=None, trace: str=None, capacity: int=None, total_requests: int=None):
+        self.path = path
+        self.callback = callback
+        self.interval_requests = interval_requests
+        self.interval_seconds = interval_seconds
+        self.run_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.label = label
+        self.trace = trace
+        self.capacity = capacity
+        self.total_requests = total_requests
+        # latent variables
+        self._start = None
+        self._last_time = None
+        self._last_done = 0
+
+    @property
+    def enabled(self):
+        return self.path != None or self.callback != None
+
+    def _emit(self, event: str, requests_done: int, miss_ratio: float=None, occupancy: float=None, **extra):
+        now = time.time()
+        elapsed = now - self._start
+        interval = now - self._last_time
+        record = {
+            "run_id": self.run_id,
+            "pid": os.getpid(),
+            "label": self.label,
+            "trace": self.trace,
+            "capacity": self.capacity,
+            "event": event,
+            "time": now,
+            "elapsed": elapsed,
+            "requests_done": requests_done,
+            "total_requests": self.total_requests,
+            "requests_per_second": (requests_done - self._last_done) / interval if interval > 0 else None,
+            "miss_ratio": miss_ratio,
+            "occupancy": occupancy,
+            "rss": get_rss()
+        }
+        record.update(extra)
+        self._last_time = now
+        self._last_done = requests_done
+        if self.path != None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, 'a') as file:
+                file.write(json.dumps(record) + "\n")
+        if self.callback != None:
+            self.callback(record)
+
+    def start(self):
+        self._start = time.time()
+        self._last_time = self._start
+        self._last_done = 0
+        if self.enabled:
+            self._emit("start", 0)
+
+    def update(self, requests_done: int, miss_ratio: float, get_occupancy):
+        '''
+        Emit a "progress" event if an interval has passed. `get_occupancy()` is only called then.
+        '''
+        if not self.enabled:
+            return
+        if requests_done - self._last_done < self.interval_requests and time.time() - self._last_time < self.interval_seconds:
+            return
+        self._emit("progress", requests_done, miss_ratio, get_occupancy())
+
+    def finish(self, requests_done: int, miss_ratio: float, occupancy: float):
+        if self.enabled:
+            self._emit("done", requests_done, miss_ratio, occupancy)
+
+    def fail(self, requests_done: int, error: BaseException):
+        if self.enabled:
+            self._emit("failed", requests_done, error=repr(error))
+
+def read_progress(path: str):
+    '''
+    Return: the events in the JSONL file `path`; a partially written last line is skipped
+    '''
+    events = []
+    if not os.path.exists(path):
+        return events
+    with open(path, 'r') as file:
+        for line in file:
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return events
+
+def summarize_progress(path: str, stale_seconds: float=30.0, now: float=None):
+    '''
+    The latest event of every run in the JSONL file `path`, slowest first.
+    A run that has not finished is "stuck" if its latest event is older than `stale_seconds`, e.g., a policy looping inside one request, or a worker killed by the sandbox.
+    Return: list of dict, each the latest event plus "state" ("running", "stuck", "done" or "failed") and "eta" (s, `None` if unknown)
+    '''
+    if now == None:
+        now = time.time()
+    m_run_latest: Dict[str, Dict] = dict()
+    for event in read_progress(path):
+        m_run_latest[event["run_id"]] = event
+    summary: List[Dict] = []
+    for event in m_run_latest.values():
+        event = dict(event)
+        if event["event"] in ["done", "failed"]:
+            event["state"] = event["event"]
+        elif now - event["time"] > stale_seconds:
+            event["state"] = "stuck"
+        else:
+            event["state"] = "running"
+        event["eta"] = None
+        if event["state"] == "running" and event["total_requests"] != None and event["requests_per_second"]:
+            event["eta"] = (event["total_requests"] - event["requests_done"]) / event["requests_per_second"]
+        summary.append(event)
+    order = {"stuck": 0, "running": 1, "failed": 2, "done": 3}
+    summary.sort(key=lambda e: (order[e["state"]], -(e["eta"] or 0), -e["elapsed"]))
+    return summary
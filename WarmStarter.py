@@ -0,0 +1,107 @@
+import os
+import logging_config
+import logging
+from typing import Dict, List
+import numpy as np
+from Optimizers import SearchSpace
+from cache import Trace
+from ResultCache import ResultCache
+
+class PriorResult:
+    '''
+    A stored (params, miss ratio) observation of one algorithm on one trace.
+    '''
+    def __init__(self, trace_path: str, params: Dict, mr: float):
+        self.trace_path = trace_path
+        self.params = params
+        self.mr = mr
+
+    def __repr__(self):
+        return f"PriorResult({os.path.basename(self.trace_path)}, {self.params}, {self.mr})"
+
+def get_trace_stats(trace_path: str):
+    '''
+    `Trace.get_stats()`, memoized by trace content in the shared `ResultCache`.
+    '''
+    result_cache = ResultCache.default()
+    stats = result_cache.get_trace_stats(trace_path)
+    if stats == None:
+        stats = Trace(trace_path, True).get_stats()
+        result_cache.put_trace_stats(trace_path, stats)
+    return stats
+
+class WarmStarter:
+    '''
+    Seed a tuning run with the stored results of the *same* algorithm on the most similar traces.
+    Traces are compared by the euclidean distance of their standardized `Trace.get_stats()`.
+    - The tuned params of the `num_neighbors` nearest traces become initial configurations.
+    - If `use_transfer_learning`, the observations on each neighbor become a source history of an RGPE surrogate (openbox backend only).
+    - A warm-started run gets `run_budget_frac` of the tuning budget (but at least one run after the seeds): the seeds stand in for part of the exploration.
+    '''
+    stats_keys = ["log_len", "ndv_ratio", "one_hit_ratio", "top_share", "reuse_p50", "reuse_p90"]
+
+    def __init__(self, prior_results: List[PriorResult], num_neighbors: int=3, use_transfer_learning: bool=True, run_budget_frac: float=0.5):
+        assert 0 < run_budget_frac <= 1
+        self.m_trace_results: Dict[str, List[PriorResult]] = dict()
+        for result in prior_results:
+            if result.params == None or result.mr == None:
+                continue
+            if not os.path.exists(result.trace_path):
+                continue
+            self.m_trace_results.setdefault(result.trace_path, []).append(result)
+        self.num_neighbors = num_neighbors
+        self.use_transfer_learning = use_transfer_learning
+        self.run_budget_frac = run_budget_frac
+
+    def get_neighbors(self, trace_path: str):
+        '''
+        Return: the paths of the (at most) `num_neighbors` prior traces most similar to `trace_path`, nearest first.
+        '''
+        prior_trace_paths = sorted(self.m_trace_results.keys())
+        if len(prior_trace_paths) == 0:
+            return []
+        features = np.array([
+            [get_trace_stats(p)[k] for k in self.stats_keys]
+            for p in [trace_path] + prior_trace_paths
+        ])
+        std = features.std(axis=0)
+        std[std == 0] = 1.0
+        features = (features - features.mean(axis=0)) / std
+        distances = np.linalg.norm(features[1:] - features[0], axis=1)
+        return [prior_trace_paths[i] for i in np.argsort(distances, kind="stable")[:self.num_neighbors]]
+
+    def get_optimizer_kwargs(self, trace_path: str, space: SearchSpace, max_runs: int):
+        '''
+        Stored params are mapped into `space` with `SearchSpace.clip`.
+        - max_runs (int): the budget of a cold run; the default params and the seeds take fewer runs than the reduced budget, so the optimizer still proposes at least one configuration
+        Return: extra kwargs for `Optimizers.minimize`, with the reduced `max_runs`. Empty if there is nothing to warm-start from.
+        '''
+        neighbors = self.get_neighbors(trace_path)
+        histories = []
+        for neighbor in neighbors:
+            trials = []
+            for result in sorted(self.m_trace_results[neighbor], key=lambda r: r.mr):
+                params = space.clip(result.params)
+                if params == None:
+                    continue
+                trials.append((params, [result.mr]))
+            if len(trials) > 0:
+                histories.append((os.path.basename(neighbor), trials))
+        if len(histories) == 0:
+            return dict()
+        warm_max_runs = min(max_runs, max(2, int(np.ceil(max_runs * self.run_budget_frac))))
+        # the best params of every neighbor first, then the second best, etc.
+        initial_configurations = []
+        for rank in range(max([len(trials) for (_, trials) in histories])):
+            for (_, trials) in histories:
+                if rank < len(trials) and trials[rank][0] not in initial_configurations:
+                    initial_configurations.append(trials[rank][0])
+        # one run for the default params (see `Optimizers.OptimizerBackend`), one left to the optimizer
+        initial_configurations = initial_configurations[:max(0, warm_max_runs - 2)]
+        logging.info(f"Warm-starting from {[os.path.basename(n) for n in neighbors]} with {len(initial_configurations)} initial configurations and {warm_max_runs} runs instead of {max_runs}")
+        kwargs = dict(initial_configurations=initial_configurations, max_runs=warm_max_runs)
+        if self.use_transfer_learning == True:
+            # used by the openbox backend
+            kwargs["transfer_learning_history"] = histories
+            kwargs["surrogate_type"] = "tlbo_rgpe_prf"
+        return kwargs
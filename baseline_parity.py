@@ -0,0 +1,98 @@
+'''
+Parity check of the in-process baselines ([cache/Baselines.py](./cache/Baselines.py), [cache/Belady.py](./cache/Belady.py)) against cachesim on the zipf traces: every algorithm with its default parameters, at several capacities.
+Without cachesim as well, Belady is checked on the shipped real traces (`real_trace_folder`, whose next_vtime column holds timestamps): its miss ratio must be at most that of every in-process baseline, and below 1 on a trace with a repeated key.
+The runs go to neither the result cache nor the result store. Exit status 1 if a miss ratio differs from cachesim's by more than `--tolerance`, or if Belady is not a lower bound.
+
+    python baseline_parity.py --num-traces 8 --tolerance 0.02
+'''
+import os
+import sys
+import glob
+import argparse
+import numpy as np
+import logging_config
+import logging
+from cache import load_trace_columns
+from cache.Baselines import baseline_classes
+from cache.Belady import compute_next_vtime
+from utils import is_libcachesim_installed, _normalize_libcachesim_args, _simulate_in_process, _run_cachesim_command, _get_cachesim_command, _parse_cachesim_results, _match_cachesim_results
+
+zipf_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "trace", "zipf", "alpha1_m100_n1000")
+real_trace_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "trace_20_llm_ali_tencent_20250403")
+# libCacheSim names of the in-process algorithms
+algo_names = {"fifo": "fifo", "lru": "lru", "lfu": "lfu", "random": "random", "clock": "clock", "sieve": "sieve", "slru": "slru", "arc": "arc", "s3fifo": "s3fifo", "tinylfu": "tinyLFU", "belady": "belady"}
+
+def compare_trace(trace_path: str, algo_list, cache_cap_fracs):
+    '''
+    Return: list of (algo, cache_cap, in-process mr, cachesim mr | `None` if cachesim reports no result)
+    '''
+    columns = load_trace_columns(trace_path)
+    ndv = len(np.unique(columns["key"]))
+    cache_cap_list = sorted(set([max(1, int(ndv * f)) for f in cache_cap_fracs]))
+    runs = [_normalize_libcachesim_args(algo, cache_cap, "") + (cache_cap,) for algo in algo_list for cache_cap in cache_cap_list]
+    in_process_mr_list, _ = _simulate_in_process(columns, [(algo, cache_cap, params) for (algo, params, cache_cap) in runs])
+    stdout = _run_cachesim_command(_get_cachesim_command(trace_path, ",".join(algo_list), ",".join([str(c) for c in cache_cap_list]), ""))
+    m_result = _match_cachesim_results(_parse_cachesim_results(stdout), algo_list, cache_cap_list)
+    rows = []
+    for (algo, _, cache_cap), in_process_mr in zip(runs, in_process_mr_list):
+        row = m_result.get((algo, cache_cap))
+        rows.append((algo, cache_cap, in_process_mr, row["mr"] if row != None else None))
+    return rows
+
+def check_belady(trace_path: str, cache_cap_fracs):
+    '''
+    Return: list of (cache_cap, belady mr, the smallest baseline mr) of the capacities at which Belady is not a lower bound
+    '''
+    columns = load_trace_columns(trace_path)
+    ndv = len(np.unique(columns["key"]))
+    has_reuse = bool((compute_next_vtime(columns["key"]) >= 0).any())
+    failures = []
+    for cache_cap in sorted(set([max(1, int(ndv * f)) for f in cache_cap_fracs])):
+        runs = [("belady", cache_cap, "")] + [(algo, cache_cap, params) for (algo, params) in [_normalize_libcachesim_args(algo, cache_cap, "") for algo in baseline_classes]]
+        mr_list, _ = _simulate_in_process(columns, runs)
+        belady_mr, min_mr = mr_list[0], min(mr_list[1:])
+        # with a repeated key, OPT hits at least the request whose previous one is the nearest
+        if belady_mr > min_mr or (has_reuse and belady_mr >= 1.0):
+            failures.append((cache_cap, belady_mr, min_mr))
+    return failures
+
+def main(num_traces: int, algo_list, cache_cap_fracs, tolerance: float):
+    real_trace_paths = sorted(glob.glob(os.path.join(real_trace_folder, "*", "*", "*.oracleGeneral.bin")))
+    belady_failures = []
+    for trace_path in real_trace_paths:
+        for cache_cap, belady_mr, min_mr in check_belady(trace_path, cache_cap_fracs):
+            belady_failures.append(trace_path)
+            logging.warning(f"Belady on {os.path.relpath(trace_path, real_trace_folder)} with capacity {cache_cap}: {belady_mr}, above the best baseline {min_mr} or degenerate")
+    print(f"{'OK' if len(belady_failures) == 0 else 'FAIL'}: Belady is not a lower bound on {len(set(belady_failures))}/{len(real_trace_paths)} real traces")
+    if not is_libcachesim_installed():
+        print("cachesim is not built (see `utils.LIBCACHSIM_PATH`): no parity check")
+        return 0 if len(belady_failures) == 0 else 1
+    trace_file_names = sorted(os.listdir(zipf_folder), key=lambda f: int(f.split(".")[0]))[:num_traces]
+    m_algo_diffs = {algo: [] for algo in algo_list} # algo -> |in-process mr - cachesim mr| of every run
+    failures = []
+    for trace_file_name in trace_file_names:
+        for algo, cache_cap, in_process_mr, cachesim_mr in compare_trace(os.path.join(zipf_folder, trace_file_name), algo_list, cache_cap_fracs):
+            if cachesim_mr == None:
+                failures.append((trace_file_name, algo, cache_cap, in_process_mr, None))
+                continue
+            diff = abs(in_process_mr - cachesim_mr)
+            m_algo_diffs[algo].append(diff)
+            if diff > tolerance:
+                failures.append((trace_file_name, algo, cache_cap, in_process_mr, cachesim_mr))
+    print(f"{'algo':<10} {'runs':>5} {'mean |diff|':>12} {'max |diff|':>11}")
+    for algo, diffs in m_algo_diffs.items():
+        if len(diffs) > 0:
+            print(f"{algo:<10} {len(diffs):>5} {np.mean(diffs):>12.4f} {np.max(diffs):>11.4f}")
+    for trace_file_name, algo, cache_cap, in_process_mr, cachesim_mr in failures:
+        logging.warning(f"Parity: {algo} on {trace_file_name} with capacity {cache_cap}: in-process {in_process_mr}, cachesim {cachesim_mr}")
+    print(f"{'OK' if len(failures) == 0 else 'FAIL'}: {len(failures)} runs beyond the tolerance {tolerance}")
+    return 0 if len(failures) == 0 and len(belady_failures) == 0 else 1
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the in-process baselines with cachesim on the zipf traces")
+    parser.add_argument("--num-traces", type=int, default=8)
+    parser.add_argument("--algos", type=str, default=",".join([algo_names[a] for a in list(baseline_classes) + ["belady"]]), help="comma-separated libCacheSim names")
+    parser.add_argument("--cache-cap-fracs", type=str, default="0.01,0.1,0.3", help="comma-separated capacities, as fractions of the ndv of each trace")
+    parser.add_argument("--tolerance", type=float, default=0.02, help="largest accepted absolute difference of the miss ratios")
+    args = parser.parse_args()
+    sys.exit(main(args.num_traces, args.algos.split(","), [float(f) for f in args.cache_cap_fracs.split(",")], args.tolerance))
@@ -0,0 +1,130 @@
+'''
+Smoke test of [JobBroker.py](./JobBroker.py) on localhost: a broker and several worker processes evaluate SOTA policies on the zipf traces, one lease is lost on purpose, and every result must reach the result store.
+Everything is written under a temporary folder, removed at the end unless `--keep`.
+
+    python broker_smoke.py --num-workers 3
+'''
+import os
+import time
+import shutil
+import socket
+import secrets
+import argparse
+import tempfile
+import multiprocessing
+import logging_config
+import logging
+from cache import Trace
+from ResultStore import ResultStore
+from ResultCache import ResultCache
+import PolicyEvaluator
+from JobBroker import JobBroker, PolicyEvalStore, serve_broker, connect_broker, run_worker
+
+zipf_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "trace", "zipf", "alpha1_m100_n1000")
+trace_type = "alibaba1k" # a trace type with train/test folders, see `PolicyEvaluator._get_trace_path`
+train_frac = 5
+
+def prepare_traces(root: str, num_traces: int):
+    '''
+    Lay out the first zipf traces as `PolicyEvaluator` expects: full traces, and train (prefix) / test splits.
+    Return: the trace file names
+    '''
+    trace_file_names = sorted(os.listdir(zipf_folder), key=lambda f: int(f.split(".")[0]))[:num_traces]
+    folders = {
+        "full": os.path.join(root, "real", trace_type),
+        "train": os.path.join(root, "real", f"{trace_type}_{train_frac}_{10 - train_frac}", "train"),
+        "test": os.path.join(root, "real", f"{trace_type}_{train_frac}_{10 - train_frac}", "test"),
+    }
+    for folder in folders.values():
+        os.makedirs(folder, exist_ok=True)
+    for trace_file_name in trace_file_names:
+        trace = Trace(os.path.join(zipf_folder, trace_file_name), True)
+        split = len(trace.entries) * train_frac // 10
+        trace.to_bin(os.path.join(folders["full"], trace_file_name))
+        trace.to_bin(os.path.join(folders["train"], trace_file_name), end=split)
+        trace.to_bin(os.path.join(folders["test"], trace_file_name), start=split)
+    return trace_file_names
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def run_broker(address, authkey: bytes, lease_timeout: float):
+    serve_broker(JobBroker(lease_timeout=lease_timeout, max_attempts=3, on_result=PolicyEvalStore()), address, authkey)
+
+def connect(address, authkey: bytes, timeout: float=30.0):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return connect_broker(address, authkey)
+        except (ConnectionRefusedError, FileNotFoundError):
+            if time.time() > deadline:
+                raise
+            time.sleep(0.2)
+
+def main(num_workers: int, num_traces: int, lease_timeout: float, keep: bool=False):
+    root = tempfile.mkdtemp(prefix="broker_smoke_")
+    # the forked broker and workers inherit these paths
+    PolicyEvaluator.PolicyEvaluator.trace_root_folder = root
+    PolicyEvaluator.PolicyEvaluator.trace_analysis_folder = os.path.join(root, "analysis")
+    PolicyEvaluator.PolicyEvaluator.policy_eval_jsonl_path = os.path.join(root, "analysis", "policy_eval.jsonl")
+    ResultStore.db_path = os.path.join(root, "analysis", "results.sqlite")
+    ResultCache.db_path = os.path.join(root, "analysis", "result_cache.sqlite")
+    trace_file_names = prepare_traces(root, num_traces)
+    jobs = [
+        {"trace_type": trace_type, "trace_file_name": trace_file_name, "train_frac": train_frac, "cache_cap_frac": 0.1, "algo": algo, "is_sota": True}
+        for trace_file_name in trace_file_names
+        for algo in ["fifo", "lru"]
+    ]
+
+    ctx = multiprocessing.get_context("fork")
+    address = ("127.0.0.1", get_free_port())
+    authkey = secrets.token_hex(16).encode()
+    broker_process = ctx.Process(target=run_broker, args=(address, authkey, lease_timeout), daemon=True)
+    broker_process.start()
+    worker_processes = []
+    try:
+        broker = connect(address, authkey)
+        job_ids = broker.submit(jobs)
+        # a worker that leases a job and vanishes: the job must be re-queued once its lease expires
+        lost_job_id, _ = broker.lease("lost-worker")
+        logging.info(f"Broker smoke: lost the lease of job {lost_job_id}")
+        start = time.time()
+        for i in range(num_workers):
+            process = ctx.Process(target=run_worker, args=(address, authkey, f"smoke-worker-{i}"), kwargs=dict(heartbeat_interval=1.0, idle_wait=0.5, exit_when_idle=True))
+            process.start()
+            worker_processes.append(process)
+        for process in worker_processes:
+            process.join()
+        status = broker.status()
+        logging.info(f"Broker smoke: {status['done']} jobs done in {time.time() - start:.1f} s by {len(worker_processes)} workers, failed: {status['failed']}")
+        assert all([process.exitcode == 0 for process in worker_processes]), [process.exitcode for process in worker_processes]
+        assert status["done"] == len(jobs) and len(status["failed"]) == 0, status
+        assert all([broker.get_result(job_id) != None for job_id in job_ids])
+        assert broker.get_result(lost_job_id) != None, "the lost job was not re-queued"
+        assert "lost-worker" in status["workers"]
+        # the broker stores the results asynchronously to the completions
+        store = ResultStore(ResultStore.db_path)
+        deadline = time.time() + 10
+        while store.count("policy_eval", trace_type=trace_type) < len(jobs) and time.time() < deadline:
+            time.sleep(0.2)
+        assert store.count("policy_eval", trace_type=trace_type) == len(jobs), store.count("policy_eval", trace_type=trace_type)
+    finally:
+        for process in worker_processes:
+            if process.is_alive():
+                process.terminate()
+        broker_process.terminate()
+        broker_process.join()
+        if keep == False:
+            shutil.rmtree(root, ignore_errors=True)
+    print(f"OK: {len(jobs)} jobs, {num_workers} workers, lost lease re-queued")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a JobBroker with several workers on localhost")
+    parser.add_argument("--num-workers", type=int, default=3)
+    parser.add_argument("--num-traces", type=int, default=4)
+    parser.add_argument("--lease-timeout", type=float, default=3.0)
+    parser.add_argument("--keep", action="store_true", help="keep the temporary traces and stores")
+    args = parser.parse_args()
+    main(args.num_workers, args.num_traces, args.lease_timeout, args.keep)
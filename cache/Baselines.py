@@ -0,0 +1,559 @@
+import time
+import random
+import inspect
+import collections
+from typing import Dict, List
+
+baselines_version = "2" # bump when a baseline changes, to invalidate the memoized miss ratios
+
+class BaselineCache:
+    '''
+    In-process counterpart of a libCacheSim eviction algorithm. Objects have unit size, as with `cachesim --ignore-obj-size 1`, so `capacity` is a number of objects.
+    Subclasses implement `_hit(key)` (update the metadata and return `True` if `key` is cached), and either `_evict()` and `_insert(key)`, or `_miss(key)`.
+    '''
+    def __init__(self, capacity: int):
+        if not isinstance(capacity, int) or not capacity > 0:
+            raise ValueError("CAPACITY must be a positive integer.")
+        self.capacity = capacity
+        self.access_count = 0
+        self.hit_count = 0
+
+    def get(self, key) -> bool:
+        self.access_count += 1
+        if self._hit(key):
+            self.hit_count += 1
+            return True
+        self._miss(key)
+        return False
+
+    def _miss(self, key):
+        if len(self) >= self.capacity:
+            self._evict()
+        self._insert(key)
+
+    @property
+    def miss_count(self):
+        return self.access_count - self.hit_count
+
+    @property
+    def miss_ratio(self):
+        return round(self.miss_count / self.access_count, 4) if self.access_count > 0 else None
+
+class FIFOCache(BaselineCache):
+    def __init__(self, capacity: int):
+        super().__init__(capacity)
+        self.queue = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def _hit(self, key):
+        return key in self.queue
+
+    def peek_victim(self):
+        return next(iter(self.queue))
+
+    def _evict(self):
+        return self.queue.popitem(last=False)[0]
+
+    def _insert(self, key):
+        self.queue[key] = None
+
+class LRUCache(FIFOCache):
+    def _hit(self, key):
+        if key not in self.queue:
+            return False
+        self.queue.move_to_end(key)
+        return True
+
+class LFUCache(BaselineCache):
+    '''
+    Frequency buckets; ties are broken by LRU within the least frequent bucket.
+    '''
+    def __init__(self, capacity: int):
+        super().__init__(capacity)
+        self.freq = dict() # key -> frequency
+        self.buckets = dict() # frequency -> OrderedDict of keys
+        self.min_freq = 0
+
+    def __len__(self):
+        return len(self.freq)
+
+    def _hit(self, key):
+        if key not in self.freq:
+            return False
+        freq = self.freq[key]
+        bucket = self.buckets[freq]
+        del bucket[key]
+        if len(bucket) == 0:
+            del self.buckets[freq]
+            if self.min_freq == freq:
+                self.min_freq = freq + 1
+        self.freq[key] = freq + 1
+        self.buckets.setdefault(freq + 1, collections.OrderedDict())[key] = None
+        return True
+
+    def peek_victim(self):
+        return next(iter(self.buckets[self.min_freq]))
+
+    def _evict(self):
+        bucket = self.buckets[self.min_freq]
+        key, _ = bucket.popitem(last=False)
+        if len(bucket) == 0:
+            del self.buckets[self.min_freq]
+        del self.freq[key]
+        return key
+
+    def _insert(self, key):
+        self.freq[key] = 1
+        self.buckets.setdefault(1, collections.OrderedDict())[key] = None
+        self.min_freq = 1
+
+class RandomCache(BaselineCache):
+    '''
+    Uniformly random eviction with a seeded generator: reproducible, but not the same draws as libCacheSim.
+    '''
+    def __init__(self, capacity: int, seed: int=42):
+        super().__init__(capacity)
+        self.rng = random.Random(seed)
+        self.keys = []
+        self.pos = dict() # key -> index in `keys`
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _hit(self, key):
+        return key in self.pos
+
+    def _evict(self):
+        index = self.rng.randrange(len(self.keys))
+        key = self.keys[index]
+        last_key = self.keys.pop()
+        if last_key != key:
+            self.keys[index] = last_key
+            self.pos[last_key] = index
+        del self.pos[key]
+        return key
+
+    def _insert(self, key):
+        self.pos[key] = len(self.keys)
+        self.keys.append(key)
+
+class ClockCache(BaselineCache):
+    '''
+    FIFO with reinsertion: an object with a non-zero counter is moved to the head with its counter decremented instead of being evicted.
+    The hand (the tail of the queue) is advanced by `peek_victim` as well as by `_evict`, so both are amortized O(1): each reinsertion undoes a hit. As the main cache of `TinyLFUCache`, the objects passed by the hand are thus aged even if the candidate is rejected, whereas libCacheSim scans for the victim without moving them.
+    '''
+    def __init__(self, capacity: int, n_bit_counter: int=1):
+        super().__init__(capacity)
+        self.max_freq = (1 << n_bit_counter) - 1
+        self.queue = collections.OrderedDict() # key -> counter, the tail first
+
+    def __len__(self):
+        return len(self.queue)
+
+    def _hit(self, key):
+        if key not in self.queue:
+            return False
+        self.queue[key] = min(self.queue[key] + 1, self.max_freq)
+        return True
+
+    def peek_victim(self):
+        while True:
+            key, freq = next(iter(self.queue.items()))
+            if freq == 0:
+                return key
+            self.queue.move_to_end(key)
+            self.queue[key] = freq - 1
+
+    def _evict(self):
+        key = self.peek_victim()
+        del self.queue[key]
+        return key
+
+    def _insert(self, key):
+        self.queue[key] = 0
+
+class SieveCache(BaselineCache):
+    '''
+    SIEVE: the hand moves from the tail towards the head, clearing the visited bits, and evicts the first unvisited object. Objects are never moved.
+    '''
+    def __init__(self, capacity: int):
+        super().__init__(capacity)
+        self.nodes = dict() # key -> [newer key, older key, visited]
+        self.head = None # newest
+        self.tail = None # oldest
+        self.hand = None
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def _hit(self, key):
+        node = self.nodes.get(key)
+        if node == None:
+            return False
+        node[2] = True
+        return True
+
+    def peek_victim(self):
+        start = self.hand if self.hand != None else self.tail
+        key = start
+        while self.nodes[key][2] == True:
+            key = self.nodes[key][0]
+            if key == None:
+                key = self.tail
+            if key == start:
+                # all visited: the hand clears every bit and comes back
+                break
+        return key
+
+    def _evict(self):
+        key = self.hand if self.hand != None else self.tail
+        while self.nodes[key][2] == True:
+            self.nodes[key][2] = False
+            key = self.nodes[key][0]
+            if key == None:
+                key = self.tail
+        newer, older, _ = self.nodes.pop(key)
+        self.hand = newer
+        if newer != None:
+            self.nodes[newer][1] = older
+        else:
+            self.head = older
+        if older != None:
+            self.nodes[older][0] = newer
+        else:
+            self.tail = newer
+        return key
+
+    def _insert(self, key):
+        self.nodes[key] = [None, self.head, False]
+        if self.head != None:
+            self.nodes[self.head][0] = key
+        self.head = key
+        if self.tail == None:
+            self.tail = key
+
+class SLRUCache(BaselineCache):
+    '''
+    Segmented LRU: new objects enter segment 0; a hit promotes an object one segment up, and a full segment demotes its LRU object one segment down. Eviction takes the LRU object of the lowest non-empty segment.
+    '''
+    def __init__(self, capacity: int, n_seg: int=4):
+        super().__init__(capacity)
+        self.n_seg = max(1, min(n_seg, capacity))
+        self.seg_capacity = max(1, capacity // self.n_seg)
+        self.segs = [collections.OrderedDict() for _ in range(self.n_seg)]
+        self.seg_ids = dict() # key -> segment
+
+    def __len__(self):
+        return len(self.seg_ids)
+
+    def _hit(self, key):
+        seg_id = self.seg_ids.get(key)
+        if seg_id == None:
+            return False
+        if seg_id == self.n_seg - 1:
+            self.segs[seg_id].move_to_end(key)
+            return True
+        del self.segs[seg_id][key]
+        self.segs[seg_id + 1][key] = None
+        self.seg_ids[key] = seg_id + 1
+        for upper in range(seg_id + 1, 0, -1):
+            if len(self.segs[upper]) <= self.seg_capacity:
+                break
+            demoted, _ = self.segs[upper].popitem(last=False)
+            self.segs[upper - 1][demoted] = None
+            self.seg_ids[demoted] = upper - 1
+        return True
+
+    def peek_victim(self):
+        for seg in self.segs:
+            if len(seg) > 0:
+                return next(iter(seg))
+
+    def _evict(self):
+        for seg in self.segs:
+            if len(seg) > 0:
+                key, _ = seg.popitem(last=False)
+                del self.seg_ids[key]
+                return key
+
+    def _insert(self, key):
+        self.segs[0][key] = None
+        self.seg_ids[key] = 0
+
+class ARCCache(BaselineCache):
+    '''
+    ARC: recency (T1) and frequency (T2) lists, whose target split `p` adapts to hits on the ghost lists B1 and B2.
+    '''
+    def __init__(self, capacity: int):
+        super().__init__(capacity)
+        self.t1 = collections.OrderedDict()
+        self.t2 = collections.OrderedDict()
+        self.b1 = collections.OrderedDict()
+        self.b2 = collections.OrderedDict()
+        self.p = 0.0
+
+    def __len__(self):
+        return len(self.t1) + len(self.t2)
+
+    def _hit(self, key):
+        if key in self.t1:
+            del self.t1[key]
+            self.t2[key] = None
+            return True
+        if key in self.t2:
+            self.t2.move_to_end(key)
+            return True
+        return False
+
+    def _replace(self, in_b2: bool):
+        if len(self.t1) > 0 and ((in_b2 and len(self.t1) == self.p) or len(self.t1) > self.p or len(self.t2) == 0):
+            key, _ = self.t1.popitem(last=False)
+            self.b1[key] = None
+        else:
+            key, _ = self.t2.popitem(last=False)
+            self.b2[key] = None
+        return key
+
+    def peek_victim(self):
+        # the object `_replace(False)` evicts
+        if len(self.t1) > 0 and (len(self.t1) > self.p or len(self.t2) == 0):
+            return next(iter(self.t1))
+        return next(iter(self.t2))
+
+    def _evict(self):
+        return self._replace(False)
+
+    def _insert(self, key):
+        '''
+        Insert into a cache with a free slot, as the main cache of `TinyLFUCache` does: a ghost hit adapts `p` as in `_miss`, and the ghost lists are trimmed, but no object is evicted.
+        '''
+        c = self.capacity
+        if key in self.b1:
+            self.p = min(c, self.p + max(len(self.b2) / len(self.b1), 1))
+            del self.b1[key]
+            self.t2[key] = None
+            return
+        if key in self.b2:
+            self.p = max(0.0, self.p - max(len(self.b1) / len(self.b2), 1))
+            del self.b2[key]
+            self.t2[key] = None
+            return
+        if len(self.t1) + len(self.b1) >= c and len(self.b1) > 0:
+            self.b1.popitem(last=False)
+        elif len(self.t1) + len(self.t2) + len(self.b1) + len(self.b2) >= 2 * c and len(self.b2) > 0:
+            self.b2.popitem(last=False)
+        self.t1[key] = None
+
+    def _miss(self, key):
+        c = self.capacity
+        if key in self.b1:
+            self.p = min(c, self.p + max(len(self.b2) / len(self.b1), 1))
+            self._replace(False)
+            del self.b1[key]
+            self.t2[key] = None
+            return
+        if key in self.b2:
+            self.p = max(0.0, self.p - max(len(self.b1) / len(self.b2), 1))
+            self._replace(True)
+            del self.b2[key]
+            self.t2[key] = None
+            return
+        if len(self.t1) + len(self.b1) == c:
+            if len(self.t1) < c:
+                self.b1.popitem(last=False)
+                self._replace(False)
+            else:
+                self.t1.popitem(last=False)
+        else:
+            total = len(self.t1) + len(self.t2) + len(self.b1) + len(self.b2)
+            if total >= c:
+                if total == 2 * c:
+                    self.b2.popitem(last=False)
+                self._replace(False)
+        self.t1[key] = None
+
+class S3FIFOCache(BaselineCache):
+    '''
+    S3-FIFO: a small FIFO (`fifo_size_ratio` of the cache) filters one-hit wonders; objects requested `move_to_main_threshold` times while in it move to the main FIFO, which reinserts objects with a non-zero counter. The keys evicted from the small FIFO are remembered in a ghost FIFO, and a ghost hit is inserted into the main FIFO directly.
+    '''
+    def __init__(self, capacity: int, fifo_size_ratio: float=0.1, move_to_main_threshold: int=1, ghost_size_ratio: float=0.9):
+        super().__init__(capacity)
+        self.small_capacity = max(1, int(capacity * fifo_size_ratio))
+        self.ghost_capacity = int(capacity * ghost_size_ratio)
+        self.move_to_main_threshold = move_to_main_threshold
+        self.small = collections.OrderedDict() # key -> counter, the tail first
+        self.main = collections.OrderedDict() # key -> counter, the tail first
+        self.ghost = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.small) + len(self.main)
+
+    def _hit(self, key):
+        if key in self.small:
+            self.small[key] = min(self.small[key] + 1, 3)
+            return True
+        if key in self.main:
+            self.main[key] = min(self.main[key] + 1, 3)
+            return True
+        return False
+
+    def _evict_small(self):
+        while len(self.small) > 0:
+            key, freq = self.small.popitem(last=False)
+            if freq >= self.move_to_main_threshold:
+                self.main[key] = 0
+                continue
+            if self.ghost_capacity > 0:
+                self.ghost[key] = None
+                if len(self.ghost) > self.ghost_capacity:
+                    self.ghost.popitem(last=False)
+            return key
+        return self._evict_main()
+
+    def _evict_main(self):
+        while True:
+            key, freq = self.main.popitem(last=False)
+            if freq == 0:
+                return key
+            self.main[key] = freq - 1
+
+    def _miss(self, key):
+        while len(self) >= self.capacity:
+            if len(self.small) >= self.small_capacity or len(self.main) == 0:
+                self._evict_small()
+            else:
+                self._evict_main()
+        if key in self.ghost:
+            del self.ghost[key]
+            self.main[key] = 0
+        else:
+            self.small[key] = 0
+
+class CountMinSketch:
+    '''
+    4-bit counters in `depth` rows; all counters are halved every `10 × capacity` additions, so that the estimates follow recent popularity.
+    '''
+    hash_seeds = [0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93]
+
+    def __init__(self, capacity: int, depth: int=4):
+        width = 16
+        while width < capacity:
+            width *= 2
+        self.mask = width - 1
+        self.rows = [[0] * width for _ in range(depth)]
+        self.seeds = self.hash_seeds[:depth]
+        self.sample_size = 10 * capacity
+        self.num_added = 0
+
+    def _indices(self, key):
+        key = hash(key) & 0xffffffffffffffff
+        return [((key * seed) >> 32) & self.mask for seed in self.seeds]
+
+    def add(self, key):
+        for row, index in zip(self.rows, self._indices(key)):
+            if row[index] < 15:
+                row[index] += 1
+        self.num_added += 1
+        if self.num_added >= self.sample_size:
+            self.num_added //= 2
+            for row in self.rows:
+                for index in range(len(row)):
+                    row[index] >>= 1
+
+    def estimate(self, key):
+        return min(row[index] for row, index in zip(self.rows, self._indices(key)))
+
+class TinyLFUCache(BaselineCache):
+    '''
+    W-TinyLFU: an LRU window (`window_size` of the cache) in front of a main cache. An object leaving the window replaces the main cache's victim only if the frequency sketch rates it higher.
+    '''
+    main_cache_classes = {"slru": SLRUCache, "lru": LRUCache, "fifo": FIFOCache, "lfu": LFUCache, "arc": ARCCache, "clock": ClockCache, "sieve": SieveCache}
+
+    def __init__(self, capacity: int, window_size: float=0.01, main_cache: str="SLRU"):
+        super().__init__(capacity)
+        if main_cache.lower() not in self.main_cache_classes:
+            raise ValueError(f"Unsupported main cache of tinyLFU: {main_cache}")
+        self.window_capacity = max(1, int(capacity * window_size))
+        self.main_capacity = capacity - self.window_capacity
+        self.window = LRUCache(self.window_capacity)
+        self.main = self.main_cache_classes[main_cache.lower()](self.main_capacity) if self.main_capacity > 0 else None
+        self.sketch = CountMinSketch(capacity)
+
+    def __len__(self):
+        return len(self.window) + (len(self.main) if self.main != None else 0)
+
+    def get(self, key) -> bool:
+        self.sketch.add(key)
+        return super().get(key)
+
+    def _hit(self, key):
+        return self.window._hit(key) or (self.main != None and self.main._hit(key))
+
+    def _miss(self, key):
+        if len(self.window) >= self.window_capacity:
+            candidate = self.window._evict()
+            if self.main != None:
+                if len(self.main) < self.main_capacity:
+                    self.main._insert(candidate)
+                elif self.sketch.estimate(candidate) > self.sketch.estimate(self.main.peek_victim()):
+                    self.main._evict()
+                    self.main._insert(candidate)
+        self.window._insert(key)
+
+baseline_classes = {
+    "fifo": FIFOCache,
+    "lru": LRUCache,
+    "lfu": LFUCache,
+    "random": RandomCache,
+    "clock": ClockCache,
+    "sieve": SieveCache,
+    "slru": SLRUCache,
+    "arc": ARCCache,
+    "s3fifo": S3FIFOCache,
+    "tinylfu": TinyLFUCache,
+}
+
+def is_baseline(algo: str):
+    return algo.lower() in baseline_classes
+
+def get_baseline(algo: str, capacity: int, params: Dict[str, str]=None):
+    '''
+    Args:
+    - algo (str): libCacheSim name of the algorithm, case-insensitive
+    - params (dict | None): libCacheSim parameters, e.g., {"n-seg": "4"}; values are cast to the type of the default
+    Return: `BaselineCache`
+    '''
+    if not is_baseline(algo):
+        raise ValueError(f"No in-process baseline for {algo}")
+    cls = baseline_classes[algo.lower()]
+    signature = inspect.signature(cls.__init__)
+    kwargs = dict()
+    for name, value in (params or dict()).items():
+        arg_name = name.replace("-", "_")
+        if arg_name not in signature.parameters or arg_name == "capacity":
+            raise ValueError(f"Unknown parameter of {algo}: {name}")
+        default = signature.parameters[arg_name].default
+        kwargs[arg_name] = type(default)(value) if default != inspect.Parameter.empty else value
+    return cls(capacity, **kwargs)
+
+def simulate_baselines(keys: List, caches: List[BaselineCache], elapsed: List[float]=None):
+    '''
+    Feed every key of a trace to every cache, in one pass over the trace.
+    - elapsed: if given, the time (s) spent in each cache is added to it
+    Return: the miss ratio of every cache
+    '''
+    gets = [cache.get for cache in caches]
+    if elapsed == None:
+        for key in keys:
+            for get in gets:
+                get(key)
+    else:
+        perf_counter = time.perf_counter
+        for key in keys:
+            for i, get in enumerate(gets):
+                start = perf_counter()
+                get(key)
+                elapsed[i] += perf_counter() - start
+    return [cache.miss_ratio for cache in caches]
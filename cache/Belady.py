@@ -0,0 +1,78 @@
+import heapq
+from typing import List
+import numpy as np
+
+belady_version = "2" # bump when the engine changes, to invalidate the memoized miss ratios; 2: next_vtime recomputed from the keys
+
+def compute_next_vtime(keys: np.ndarray):
+    '''
+    The index of the next request to the same key, `-1` if none.
+    The next_vtime column stored in oracleGeneral traces cannot be used instead: in some traces (e.g., the split traces of `cache/trace_20_llm_ali_tencent_20250403`) it holds the timestamp of the next request, and in sampled traces it points at removed requests.
+    '''
+    keys = np.asarray(keys)
+    next_vtime = np.full(len(keys), -1, dtype=np.int64)
+    if len(keys) < 2:
+        return next_vtime
+    order = np.argsort(keys, kind="stable")
+    same_key = keys[order[:-1]] == keys[order[1:]]
+    next_vtime[order[:-1][same_key]] = order[1:][same_key]
+    return next_vtime
+
+class _BeladyCache:
+    '''
+    The objects in cache are identified by the index of their next request: a request is a hit iff its index is cached.
+    A max-heap of these indices gives the object requested farthest in the future. Hits leave stale indices in the heap; they are all in the past, so they never surface while a live index remains, and the heap is rebuilt once they outnumber the live ones.
+    '''
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.cached = dict() # next request index -> size
+        self.heap = [] # -(next request index)
+        self.used = 0
+        self.hit_count = 0
+
+    def get(self, vtime: int, next_vtime: int, size: int):
+        if vtime in self.cached:
+            self.hit_count += 1
+            self.used -= self.cached.pop(vtime)
+        if next_vtime < 0 or size > self.capacity:
+            # never requested again: evicted first, i.e., bypassed
+            return
+        self.cached[next_vtime] = size
+        self.used += size
+        heapq.heappush(self.heap, -next_vtime)
+        while self.used > self.capacity:
+            farthest = -heapq.heappop(self.heap)
+            if farthest in self.cached:
+                self.used -= self.cached.pop(farthest)
+        if len(self.heap) > 2 * len(self.cached) + 64:
+            self.heap = [-t for t in self.cached]
+            heapq.heapify(self.heap)
+
+def simulate_belady(next_vtime: np.ndarray, capacity_list: List[int], sizes: np.ndarray=None, split: int=None):
+    '''
+    Belady's OPT in one pass over the trace for every capacity, O(log C) per request and capacity.
+    Args:
+    - next_vtime: the index of the next request to the same key of every request, `-1` if none (see `compute_next_vtime`)
+    - sizes: object sizes, for the size-aware variant: `capacity_list` is then in bytes, and the objects requested farthest in the future are evicted until the new one fits. `None`: unit-size objects
+    - split: if given, the miss ratios of the first `split` requests and of the rest (on a warm cache) are reported separately
+    Return: the miss ratio of every capacity, or (prefix mr, suffix mr) pairs with `split`
+    '''
+    caches = [_BeladyCache(capacity) for capacity in capacity_list]
+    next_vtime = np.asarray(next_vtime).tolist()
+    sizes = np.asarray(sizes).tolist() if sizes is not None else [1] * len(next_vtime)
+    prefix_hit_counts = [0 for _ in caches]
+    for vtime, (next_t, size) in enumerate(zip(next_vtime, sizes)):
+        if vtime == split:
+            prefix_hit_counts = [cache.hit_count for cache in caches]
+        for cache in caches:
+            cache.get(vtime, next_t, size)
+    get_miss_ratio = lambda hit_count, access_count: round(1 - hit_count / access_count, 4) if access_count > 0 else None
+    if split == None:
+        return [get_miss_ratio(cache.hit_count, len(next_vtime)) for cache in caches]
+    split = min(split, len(next_vtime))
+    if split == len(next_vtime):
+        prefix_hit_counts = [cache.hit_count for cache in caches]
+    return [
+        (get_miss_ratio(prefix_hit_count, split), get_miss_ratio(cache.hit_count - prefix_hit_count, len(next_vtime) - split))
+        for (cache, prefix_hit_count) in zip(caches, prefix_hit_counts)
+    ]
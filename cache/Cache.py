@@ -2,7 +2,8 @@ import os
 import sys
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 import random
-random.seed(42) # set the random seed before importing `My` to enable reproduction
+random_seed = 42 # every replay of `Simulator` seeds `random` with it before loading the policy
+random.seed(random_seed) # set the random seed before importing `My` to enable reproduction
 import My
 import importlib
 
@@ -56,18 +57,23 @@ class CacheConfig:
         }
     
 class Cache:
-    def __init__(self, config: CacheConfig):
+    def __init__(self, config: CacheConfig, policy=None):
+        '''
+        - policy (module | None): the namespace providing the policy functions, e.g., from `load_policy()`. If `None`, `My` is reloaded and used.
+        '''
         assert isinstance(config, CacheConfig)
        
         self.__capacity = config.capacity
         self.__cache = dict() # a map from key to cache_obj
         self.__naccess = 0
         self.__nhit = 0
-        importlib.reload(My)
-        self.update_after_insert_func = My.update_after_insert
-        self.update_after_evict_func = My.update_after_evict
-        self.update_after_hit_func = My.update_after_hit
-        self.evict_func = My.evict
+        if policy == None:
+            importlib.reload(My)
+            policy = My
+        self.update_after_insert_func = policy.update_after_insert
+        self.update_after_evict_func = policy.update_after_evict
+        self.update_after_hit_func = policy.update_after_hit
+        self.evict_func = policy.evict
     
     @property
     def cache(self): # read-only
@@ -0,0 +1,41 @@
+import sys
+import types
+import collections
+
+def load_policy(code: str, name: str="My"):
+    '''
+    Execute the policy code in a fresh module namespace. Policies loaded this way do not share metadata, so several policies (or several parameter sets of one policy) can run side by side.
+    Note that they still share the global state of imported modules, e.g., `random`.
+    Return: the module providing `evict`, `update_after_hit`, `update_after_insert` and `update_after_evict`.
+    '''
+    policy = types.ModuleType(name)
+    exec(compile(code, f"<{name}>", "exec"), policy.__dict__)
+    return policy
+
+def get_metadata_size(policy):
+    '''
+    Deep size (bytes) of the metadata a loaded policy maintains, i.e., its module-level objects other than modules, functions, classes and dunder names.
+    Objects reachable from several names are counted once.
+    '''
+    seen = set()
+    size = 0
+    stack = [
+        value for name, value in vars(policy).items()
+        if not name.startswith("__") and not isinstance(value, (types.ModuleType, types.FunctionType, types.BuiltinFunctionType, type))
+    ]
+    while len(stack) > 0:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, (types.ModuleType, types.FunctionType, types.BuiltinFunctionType, type)):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, collections.deque)):
+            stack.extend(obj)
+        elif hasattr(obj, "__dict__"):
+            stack.append(vars(obj))
+        elif hasattr(obj, "__slots__"):
+            stack.extend(getattr(obj, s) for s in obj.__slots__ if hasattr(obj, s))
+    return size
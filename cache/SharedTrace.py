@@ -0,0 +1,139 @@
+import os
+import weakref
+import hashlib
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+from .Cache import CacheObj
+from .Trace import Trace
+
+HEADER_SIZE = 8 # the number of requests, as int64
+
+def get_shared_trace_name(trace_path: str):
+    '''
+    Name of the shared-memory segment of a trace, derived from (path, mtime, size) so that any process can find it.
+    '''
+    stat = os.stat(trace_path)
+    digest = hashlib.sha1(f"{os.path.abspath(trace_path)}:{stat.st_mtime_ns}:{stat.st_size}".encode()).hexdigest()
+    return f"cachetrace_{digest[:20]}"
+
+def _get_columns(shm: shared_memory.SharedMemory):
+    num_requests = int(np.ndarray((1,), dtype=np.int64, buffer=shm.buf)[0])
+    keys = np.ndarray((num_requests,), dtype=np.uint64, buffer=shm.buf, offset=HEADER_SIZE)
+    sizes = np.ndarray((num_requests,), dtype=np.uint32, buffer=shm.buf, offset=HEADER_SIZE + 8 * num_requests)
+    return keys, sizes
+
+class SharedTraceStore:
+    '''
+    Publish the decoded columns (key: uint64, size: uint32) of traces into `multiprocessing.shared_memory`, once per host.
+    Worker processes attach to them zero-copy with `attach_shared_trace(trace_path)`. The segments are unlinked by `close()`, or when the store is garbage collected or the process exits.
+    '''
+    def __init__(self):
+        self._segments = dict() # name -> SharedMemory
+        self._finalizer = weakref.finalize(self, SharedTraceStore._unlink_all, self._segments)
+
+    @staticmethod
+    def _unlink_all(segments):
+        for shm in segments.values():
+            shm.close()
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+        segments.clear()
+
+    def publish(self, trace_path: str, trace: Trace=None):
+        '''
+        Publish a trace if not yet published; `trace` avoids decoding it again if already loaded.
+        Return: the segment name
+        '''
+        name = get_shared_trace_name(trace_path)
+        if name in self._segments:
+            return name
+        if trace == None:
+            trace = Trace(trace_path, True)
+        num_requests = len(trace.entries)
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=HEADER_SIZE + 12 * max(num_requests, 1))
+        except FileExistsError:
+            # published by another store
+            return name
+        np.ndarray((1,), dtype=np.int64, buffer=shm.buf)[0] = num_requests
+        keys, sizes = _get_columns(shm)
+        keys[:] = [entry.key for entry in trace.entries]
+        sizes[:] = [entry.size for entry in trace.entries]
+        del keys, sizes
+        self._segments[name] = shm
+        return name
+
+    def close(self):
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+_attached = dict() # name -> SharedMemory, per process
+
+def _open_untracked(name: str):
+    '''
+    Attach to a segment without registering it to the resource tracker, which would unlink it when this process exits. Forked workers share the tracker of the publisher, so unregistering after attaching is not an option either.
+    '''
+    try:
+        return shared_memory.SharedMemory(name=name, create=False, track=False) # Python >= 3.13
+    except TypeError:
+        pass
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name, create=False)
+    finally:
+        resource_tracker.register = register
+
+def attach_shared_trace(trace_path: str):
+    '''
+    Return: (keys, sizes) numpy views of the published columns of the trace | `None` if the trace is not published
+    '''
+    name = get_shared_trace_name(trace_path)
+    if name not in _attached:
+        try:
+            shm = _open_untracked(name)
+        except FileNotFoundError:
+            return None
+        _attached[name] = shm
+    return _get_columns(_attached[name])
+
+class CacheObjView:
+    '''
+    A sequence of `CacheObj`s over the key and size columns of a trace, created on access: indexing or slicing returns new objects, and iterating creates them chunk by chunk.
+    '''
+    def __init__(self, keys: np.ndarray, sizes: np.ndarray, consider_obj_size: bool, chunk_size: int=4096):
+        self.keys = keys
+        self.sizes = sizes
+        self.consider_obj_size = consider_obj_size
+        self.chunk_size = chunk_size
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _to_objs(self, start: int, end: int):
+        keys = self.keys[start:end].tolist()
+        if self.consider_obj_size == True:
+            return [CacheObj(key=str(key), size=size, consider_obj_size=True) for (key, size) in zip(keys, self.sizes[start:end].tolist())]
+        return [CacheObj(key=str(key), size=1, consider_obj_size=False) for key in keys]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, end, step = index.indices(len(self))
+            assert step == 1
+            return self._to_objs(start, end)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self._to_objs(index, index + 1)[0]
+
+    def __iter__(self):
+        for start in range(0, len(self), self.chunk_size):
+            yield from self._to_objs(start, start + self.chunk_size)
@@ -1,7 +1,54 @@
+import os
 import struct
+import collections
 from typing import List
 import numpy as np
 
+def is_sampled_key(key: int, sample_rate: float):
+    '''
+    Spatial sampling: whether `key` hashes below `sample_rate`. A sampled key keeps all its requests, so the sample keeps the reuse pattern of the trace.
+    '''
+    return ((int(key) * 0x9E3779B97F4A7C15) >> 32) & 0xffffffff < int(sample_rate * (1 << 32))
+
+def sampled_key_mask(keys: np.ndarray, sample_rate: float):
+    '''
+    `is_sampled_key` over a uint64 array of keys.
+    '''
+    hashed = (keys.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(32)
+    return (hashed & np.uint64(0xffffffff)) < np.uint64(int(sample_rate * (1 << 32)))
+
+def get_trace_length(trace_path: str):
+    '''
+    Number of requests of a trace, without decoding it.
+    '''
+    if trace_path.endswith(".bin"):
+        return os.path.getsize(trace_path) // struct.Struct("<IQIq").size
+    with open(trace_path, "rb") as f:
+        return sum(1 for _ in f)
+
+oracle_general_dtype = np.dtype([("time", "<u4"), ("key", "<u8"), ("size", "<u4"), ("next_vtime", "<i8")])
+
+def load_trace_columns(trace_path: str):
+    '''
+    Decode a trace in bulk, without creating a `TraceEntry` per request.
+    Return: numpy structured array with the fields "time", "key", "size" and "next_vtime"
+    '''
+    if trace_path.endswith(".bin"):
+        return np.fromfile(trace_path, dtype=oracle_general_dtype)
+    rows = np.loadtxt(trace_path, delimiter=",", dtype=np.int64, ndmin=2)
+    columns = np.empty(len(rows), dtype=oracle_general_dtype)
+    for col_id, name in enumerate(oracle_general_dtype.names):
+        columns[name] = rows[:, col_id]
+    return columns
+
+def load_trace_keys(trace_path: str, start: int, count: int):
+    '''
+    The keys of requests [start, start + count) of a trace; only these are read from a .bin trace.
+    '''
+    if trace_path.endswith(".bin"):
+        return np.fromfile(trace_path, dtype=oracle_general_dtype, count=count, offset=start * oracle_general_dtype.itemsize)["key"]
+    return load_trace_columns(trace_path)["key"][start:start + count]
+
 class TraceEntry:
     def __init__(self, time: int, key: int, size: int, next_vtime: int):
         self.time = time
@@ -85,15 +132,49 @@ class Trace:
     
     def get_len(self):
         return len(self.entries)
+
+    def get_stats(self):
+        '''
+        Summary statistics to compare traces:
+        - log_len: log10(#requests)
+        - ndv_ratio: #distinct keys / #requests
+        - one_hit_ratio: fraction of distinct keys that are requested only once
+        - top_share: fraction of requests to the 10% most popular keys
+        - reuse_p50, reuse_p90: percentiles of log2(reuse distance), i.e., #requests between two consecutive accesses to a key
+        '''
+        if len(self.entries) == 0:
+            return {"log_len": 0.0, "ndv_ratio": 0.0, "one_hit_ratio": 0.0, "top_share": 0.0, "reuse_p50": 0.0, "reuse_p90": 0.0}
+        m_key_count = collections.Counter()
+        m_key_last_vtime = dict()
+        reuse_distances = []
+        for vtime, entry in enumerate(self.entries):
+            m_key_count[entry.key] += 1
+            if entry.key in m_key_last_vtime:
+                reuse_distances.append(vtime - m_key_last_vtime[entry.key])
+            m_key_last_vtime[entry.key] = vtime
+        counts = sorted(m_key_count.values(), reverse=True)
+        log_reuse_distances = np.log2(reuse_distances) if len(reuse_distances) > 0 else np.zeros(1)
+        return {
+            "log_len": float(np.log10(len(self.entries))),
+            "ndv_ratio": len(counts) / len(self.entries),
+            "one_hit_ratio": sum([1 for c in counts if c == 1]) / len(counts),
+            "top_share": sum(counts[:max(1, len(counts) // 10)]) / len(self.entries),
+            "reuse_p50": float(np.percentile(log_reuse_distances, 50)),
+            "reuse_p90": float(np.percentile(log_reuse_distances, 90)),
+        }
     
     def set_next_vtime(self):
+        '''
+        The next_vtime of a request is the index of the next request to the same key (not its timestamp), e.g., after sampling or cutting the trace.
+        '''
         m_key_vtime = {}
-        for entry in self.entries[::-1]:
+        for vtime in range(len(self.entries) - 1, -1, -1):
+            entry = self.entries[vtime]
             if entry.key in m_key_vtime:
                 entry.next_vtime = m_key_vtime[entry.key]
             else:
                 entry.next_vtime = -1
-            m_key_vtime[entry.key] = entry.time
+            m_key_vtime[entry.key] = vtime
     
     def to_bin(self, path: str, start=None, end=None):
         if start == None or start < 0:
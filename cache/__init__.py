@@ -1,2 +1,6 @@
-from .Cache import Cache, CacheConfig, CacheObj
-from .Trace import TraceEntry, Trace
\ No newline at end of file
+from .Cache import Cache, CacheConfig, CacheObj, random_seed
+from .Trace import TraceEntry, Trace, is_sampled_key, sampled_key_mask, get_trace_length, load_trace_columns, load_trace_keys
+from .Policy import load_policy, get_metadata_size
+from .SharedTrace import SharedTraceStore, CacheObjView, attach_shared_trace
+from .Baselines import BaselineCache, is_baseline, get_baseline, simulate_baselines, baselines_version
+from .Belady import simulate_belady, compute_next_vtime, belady_version
@@ -0,0 +1,67 @@
+'''
+Smoke test of [SignatureIndex.py](./SignatureIndex.py) on signatures built by [Signatary.py](./Signatary.py) from the shipped real test traces (`real_trace_folder`): the baselines must get non-zero signatures of more than one value, and the neighbors at distance 0 of a signature (up to the rounding of the p=2 distance) must be the policies with the same signature.
+The result cache is written under a temporary folder, removed at the end unless `--keep`.
+
+    python signature_smoke.py --algos fifo,lru,lfu,clock,sieve,slru,arc,s3fifo,tinyLFU
+'''
+import os
+import glob
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import logging_config
+import logging
+from ResultCache import ResultCache
+from Signatary import Signatary
+
+real_trace_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "trace_20_llm_ali_tencent_20250403")
+
+def prepare_test_folder(root: str):
+    '''
+    Gather the test traces of every trace family into one folder, one signature dimension per trace.
+    Return: the folder
+    '''
+    test_folder = os.path.join(root, "test")
+    os.makedirs(test_folder, exist_ok=True)
+    for trace_path in sorted(glob.glob(os.path.join(real_trace_folder, "*", "test", "*.oracleGeneral.bin"))):
+        family = os.path.basename(os.path.dirname(os.path.dirname(trace_path)))
+        os.symlink(trace_path, os.path.join(test_folder, f"{family}_{os.path.basename(trace_path)}"))
+    return test_folder
+
+def main(algo_list, keep: bool=False):
+    root = tempfile.mkdtemp(prefix="signature_smoke_")
+    ResultCache.db_path = os.path.join(root, "result_cache.sqlite")
+    try:
+        signatary = Signatary(prepare_test_folder(root))
+        logging.info(f"Signature smoke: Belady {signatary.belady}")
+        assert all([b < 1.0 for b in signatary.belady]), signatary.belady
+        index = signatary.new_index()
+        signatures = dict()
+        for algo in algo_list:
+            signatures[algo] = signatary.sign(algo, is_sota=True)
+            assert all([v != None for v in signatures[algo]]), (algo, signatures[algo])
+            assert np.any(np.array(signatures[algo]) > 0), f"{algo}: zero signature"
+            index.add(algo, signatures[algo])
+        # policies may tie on these traces (e.g., when both miss every request of a dimension): the index must not add ties of its own
+        groups = dict() # signature -> algos
+        for algo, signature in signatures.items():
+            groups.setdefault(tuple(signature), []).append(algo)
+        assert len(groups) > 1, f"all the signatures are equal: {groups}"
+        matrix = np.array(list(signatures.values()))
+        for algo, signature in signatures.items():
+            neighbors = index.knn(signature, k=len(signatures))
+            print(f"{algo:<10} {' '.join([f'{v:.3f}' for v in signature])}  ties: {[a for a in groups[tuple(signature)] if a != algo]}")
+            assert sorted([a for (a, d) in neighbors if d < 1e-6]) == sorted(groups[tuple(signature)]), (algo, neighbors)
+            assert np.allclose([d for (_, d) in neighbors], np.sort(np.linalg.norm(matrix - np.array(signature), axis=1))), (algo, neighbors)
+    finally:
+        if keep == False:
+            shutil.rmtree(root, ignore_errors=True)
+    print(f"OK: {len(algo_list)} signatures of dimension {signatary.dimension}, {len(groups)} distinct")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index the signatures of the baselines on the real test traces")
+    parser.add_argument("--algos", type=str, default="fifo,lru,lfu,clock,sieve,slru,arc,s3fifo,tinyLFU", help="comma-separated libCacheSim names")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary result cache")
+    args = parser.parse_args()
+    main(args.algos.split(","), args.keep)
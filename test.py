@@ -1,6 +1,7 @@
 from Analyzer import Analyzer
 import os
 from CrossValidator import CrossValidator
+from utils import run_libcachesim_batch
 
 def get_traces():
     trace_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "trace", "zipf", "alpha1_m100_n1000")
@@ -31,6 +32,20 @@ def test(
         cache_cap_frac=0.1,
     )
 
+def prefetch_sota(
+        algo_list: list, # names of SOTA policies in libcachesim
+        cache_cap_frac: float,
+):
+    '''
+    Simulate the default parameters of every SOTA policy with one cachesim call per trace, so that `test` finds them in the result cache.
+    '''
+    analyzer = Analyzer()
+    sweeps = []
+    for trace_path in get_traces():
+        cache_cap = max(1, int(analyzer.get_trace_ndv(trace_path) * cache_cap_frac))
+        sweeps.append((trace_path, algo_list, [cache_cap]))
+    run_libcachesim_batch(sweeps)
+
 def plot(
         algo_list: list,
 ):
@@ -59,6 +74,7 @@ if __name__ == "__main__":
     self_designed_algo_list = [
         os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "sample_code", "214.py")
     ]
+    prefetch_sota(sota_algo_list, cache_cap_frac=0.1)
     for algo in sota_algo_list + self_designed_algo_list:
         if algo in sota_algo_list:
             test(True, algo)
@@ -1,16 +1,23 @@
 import os
 import json
+import time
 import re
+import shlex
+import signal
+import asyncio
 import subprocess
 import logging_config
 import logging
 import traceback
-from openbox import space as sp
-from openbox import Optimizer
+from Optimizers import IntParam, RealParam, CategoricalParam, SearchSpace, minimize
 from datetime import datetime
 import itertools
+import collections
 import matplotlib.pyplot as plt
 import numpy as np
+from ResultCache import ResultCache
+from Telemetry import get_rss, make_cost, cost_columns
+from cache import get_baseline, is_baseline, simulate_baselines, baselines_version, load_trace_columns, get_trace_length, simulate_belady, compute_next_vtime, belady_version, get_metadata_size
 
 LIBCACHSIM_PATH="/home/v-ruiyingma/libCacheSim"
 
@@ -70,10 +77,101 @@ def modify_string(text: str, regex, group_id, modification):
         return modified_text
     return text
 
-def run_libcachesim(cache_trace, cache_alg, cache_cap, params=""):
+def is_libcachesim_installed():
+    return os.path.exists(f"{LIBCACHSIM_PATH}/_build/bin/cachesim")
+
+def get_libcachesim_version():
     '''
-    Return miss ratio. `None` if fail.
+    Identify the cachesim build by the binary's mtime and size, so that results are invalidated after a rebuild.
+    Without a build, the runs fall back to the in-process baselines (`cache.Baselines`), identified by their version.
+    '''
+    if not is_libcachesim_installed():
+        return f"baselines-{baselines_version}"
+    stat = os.stat(f"{LIBCACHSIM_PATH}/_build/bin/cachesim")
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+def _parse_libcachesim_params(params: str):
+    '''
+    " -e n-seg=4,seg-size=1" -> {"n-seg": "4", "seg-size": "1"}
+    '''
+    params = params.strip()
+    if params.startswith("-e"):
+        params = params[2:].strip()
+    if params == "":
+        return dict()
+    return dict(p.strip().split("=", 1) for p in params.split(","))
+
+def _is_in_process(cache_alg):
+    '''
+    Belady always runs in this process (`cache.Belady`); the other algorithms do without a cachesim build (`cache.Baselines`).
+    '''
+    return cache_alg.lower() == "belady" or not is_libcachesim_installed()
+
+def _has_in_process(cache_alg):
+    return cache_alg.lower() == "belady" or is_baseline(cache_alg)
+
+def get_engine(algo, is_sota: bool):
+    '''
+    The engine that simulates `algo`, recorded in the `Analyzer` and `PolicyEvaluator` entries: the miss ratios of a sota algorithm differ slightly between cachesim and the in-process baselines.
+    Return: "cachesim" | "in-process" (see `_is_in_process`) | `ResultCache.python_engine` if not `is_sota`
     '''
+    if is_sota != True:
+        return ResultCache.python_engine
+    return "in-process" if _is_in_process(algo) else "cachesim"
+
+def get_stored_engine(entry_dict: dict):
+    '''
+    The engine of a stored entry dict; the entries stored before the engine was recorded ran the sota algorithms with cachesim.
+    '''
+    if "engine" in entry_dict:
+        return entry_dict["engine"]
+    return "cachesim" if entry_dict["is_sota"] == True else ResultCache.python_engine
+
+def _simulate_in_process(columns, runs, split: int=None):
+    '''
+    Simulate every (cache_alg, cache_cap, params), normalized, in one pass over the trace columns (see `load_trace_columns`).
+    - split (int): report the miss ratios of the first `split` requests and of the rest (on a warm cache) separately
+    Return: (mr_list, cost_list)
+    - mr_list: the miss ratio of every run, or (prefix mr, suffix mr) pairs with `split`
+    - cost_list: the cost of every run (see `Telemetry.make_cost`), with the metadata size of the baseline at the end of the pass; `None` for Belady, an offline bound
+    '''
+    mr_list = [None for _ in runs]
+    cost_list = [None for _ in runs]
+    belady_ids = [i for i, run in enumerate(runs) if run[0].lower() == "belady"]
+    baseline_ids = [i for i, run in enumerate(runs) if run[0].lower() != "belady"]
+    if len(belady_ids) > 0:
+        if any([_parse_libcachesim_params(runs[i][2]) != dict() for i in belady_ids]):
+            raise ValueError("belady takes no parameter")
+        # not the next_vtime column of the trace, which may hold timestamps
+        for i, mr in zip(belady_ids, simulate_belady(compute_next_vtime(columns["key"]), [runs[i][1] for i in belady_ids], split=split)):
+            mr_list[i] = mr
+    if len(baseline_ids) > 0:
+        caches = [get_baseline(runs[i][0], runs[i][1], _parse_libcachesim_params(runs[i][2])) for i in baseline_ids]
+        keys = columns["key"].tolist()
+        elapsed = [0.0 for _ in caches]
+        if split == None:
+            for i, mr in zip(baseline_ids, simulate_baselines(keys, caches, elapsed)):
+                mr_list[i] = mr
+        else:
+            prefix_mr_list = simulate_baselines(keys[:split], caches, elapsed)
+            prefix_counts = [(cache.hit_count, cache.access_count) for cache in caches]
+            simulate_baselines(keys[split:], caches, elapsed)
+            for i, prefix_mr, (prefix_hit_count, prefix_access_count), cache in zip(baseline_ids, prefix_mr_list, prefix_counts, caches):
+                suffix_access_count = cache.access_count - prefix_access_count
+                suffix_mr = round(1 - (cache.hit_count - prefix_hit_count) / suffix_access_count, 4) if suffix_access_count > 0 else None
+                mr_list[i] = (prefix_mr, suffix_mr)
+        peak_rss = get_rss()
+        for i, cache, cache_elapsed in zip(baseline_ids, caches, elapsed):
+            cost_list[i] = make_cost(cache_elapsed, len(keys), peak_rss=peak_rss, metadata_bytes=get_metadata_size(cache))
+    return mr_list, cost_list
+
+def _run_in_process(cache_trace, runs):
+    '''
+    Return: (mr_list, cost_list), see `_simulate_in_process`
+    '''
+    return _simulate_in_process(load_trace_columns(cache_trace), runs)
+
+def _normalize_libcachesim_args(cache_alg, cache_cap, params):
     if cache_alg == "tinyLFU-slru" or cache_alg == "full-tinylfu-slru":
         new_cache_alg = "tinyLFU" if cache_alg == "tinyLFU-slru" else "full-tinylfu"
         cache_alg = new_cache_alg
@@ -90,29 +188,459 @@ def run_libcachesim(cache_trace, cache_alg, cache_cap, params=""):
 
     if params != "" and not params.startswith(" -e "):
         params = " -e " + params.strip()
-    
-    command = f'''{LIBCACHSIM_PATH}/_build/bin/cachesim {cache_trace} oracleGeneral {cache_alg} {cache_cap} --ignore-obj-size 1 --consider-obj-metadata 0 --warmup-sec -1 --report-interval 1000{params}'''
+    return cache_alg, params
+
+def _get_cachesim_command(cache_trace, cache_alg, cache_cap, params):
+    '''
+    `cache_alg` and `cache_cap` may be comma-separated lists: cachesim then simulates every (algorithm, capacity) in one pass over the trace.
+    '''
+    return f'''{LIBCACHSIM_PATH}/_build/bin/cachesim {cache_trace} oracleGeneral {cache_alg} {cache_cap} --ignore-obj-size 1 --consider-obj-metadata 0 --warmup-sec -1 --report-interval 1000{params}'''
+
+def _run_cachesim_command(command):
+    '''
+    Return: cachesim's stdout
+    '''
+    result = subprocess.run(command, capture_output=True, text=True, shell=True)
+    if result.returncode != 0:
+        logging.warning(f"LibCacheSim Error\n\t[output] {result.stdout}\n\t[error] {result.stderr}")
+        raise ValueError
+    return result.stdout
+
+def _run_cachesim(cache_trace, cache_alg, cache_cap, params):
+    '''
+    Return: the last line of cachesim's output (`<trace> <alg> cache size <cap>, <n> req, miss ratio <mr>, throughput <t> MQPS`)
+    '''
+    stdout = _run_cachesim_command(_get_cachesim_command(cache_trace, cache_alg, cache_cap, params))
+    result_lines = [l.strip() for l in stdout.split("\n") if len(l.strip()) > 0]
+    return result_lines[-1]
+
+_cachesim_result_regex = re.compile(r"(\S+)\s+cache size\s+(\d+)\S*,\s*(\d+) req, miss ratio ([\d.]+)(?:.*throughput ([\d.]+) MQPS)?")
+
+def _parse_cachesim_results(stdout: str):
+    '''
+    Return: a row per result line of cachesim: {"cache_name", "cache_size", "n_req", "mr", "throughput" (MQPS | None)}
+    '''
+    rows = []
+    for line in stdout.split("\n"):
+        match = _cachesim_result_regex.search(line)
+        if match == None:
+            continue
+        rows.append({
+            "cache_name": match.group(1),
+            "cache_size": int(match.group(2)),
+            "n_req": int(match.group(3)),
+            "mr": float(match.group(4)),
+            "throughput": float(match.group(5)) if match.group(5) != None else None
+        })
+    return rows
+
+def _normalize_cache_name(name: str):
+    return re.sub(r"[^0-9a-z]", "", name.lower())
+
+def _match_cachesim_results(rows, cache_alg_list, cache_cap_list):
+    '''
+    cachesim reports its own cache names (e.g., "S3FIFO-0.1000-2" for s3fifo): a row belongs to the algorithm whose name is its longest prefix.
+    Return: {(cache_alg, cache_cap): row}
+    '''
+    m_result = dict()
+    for row in rows:
+        if row["cache_size"] not in cache_cap_list:
+            continue
+        row_name = _normalize_cache_name(row["cache_name"])
+        candid_algs = [a for a in cache_alg_list if row_name.startswith(_normalize_cache_name(a))]
+        if len(candid_algs) == 0:
+            continue
+        cache_alg = max(candid_algs, key=lambda a: len(_normalize_cache_name(a)))
+        m_result[(cache_alg, row["cache_size"])] = row
+    return m_result
+
+def _get_cachesim_cost(row: dict):
+    '''
+    The cost of a run from its row of cachesim's output (see `_parse_cachesim_results`): cachesim reports its throughput only.
+    '''
+    if row["throughput"] == None or row["throughput"] == 0:
+        return None
+    return make_cost(row["n_req"] / (row["throughput"] * 1e6), row["n_req"])
+
+def _parse_cachesim_cost(result_info: str):
+    rows = _parse_cachesim_results(result_info)
+    return _get_cachesim_cost(rows[-1]) if len(rows) > 0 else None
+
+def _parse_cachesim_miss_ratio(result_info: str):
+    miss_ratio_info = result_info.split(",")[2].strip()
+    return float(miss_ratio_info.split()[2])
+
+def _parse_cachesim_time_per_request(result_info: str):
+    '''
+    Seconds per request, from the reported throughput (MQPS).
+    '''
+    throughput_info = result_info.split(",")[3].strip()
+    return 1e-6 / float(throughput_info.split()[1])
+
+def run_libcachesim(cache_trace, cache_alg, cache_cap, params="", use_result_cache: bool=True):
+    '''
+    Return miss ratio. `None` if fail.
+    Successful runs are memoized in the shared `ResultCache`, with their cost (see `get_libcachesim_cost`).
+    '''
+    cache_alg, params = _normalize_libcachesim_args(cache_alg, cache_cap, params)
+    if use_result_cache == True:
+        cache_key = _get_libcachesim_result_cache_key(cache_trace, cache_alg, cache_cap, params)
+        miss_ratio = ResultCache.default().get(**cache_key)
+        if miss_ratio != None:
+            return miss_ratio
+
     try:
-        result = subprocess.run(command, capture_output=True, text=True, shell=True)
-        if result.returncode != 0:
-            logging.warning(f"LibCacheSim Error\n\t[output] {result.stdout}\n\t[error] {result.stderr}")
-            raise ValueError
-        stdout = result.stdout
-        result_lines = [l.strip() for l in stdout.split("\n") if len(l.strip()) > 0]
-        result_info = result_lines[-1]
-        miss_ratio_info = result_info.split(",")[2].strip()
-        miss_ratio = float(miss_ratio_info.split()[2])
+        if _is_in_process(cache_alg):
+            mr_list, cost_list = _run_in_process(cache_trace, [(cache_alg, cache_cap, params)])
+            miss_ratio, cost = mr_list[0], cost_list[0]
+        else:
+            result_info = _run_cachesim(cache_trace, cache_alg, cache_cap, params)
+            miss_ratio, cost = _parse_cachesim_miss_ratio(result_info), _parse_cachesim_cost(result_info)
+        if use_result_cache == True:
+            ResultCache.default().put(value=miss_ratio, cost=cost, **cache_key)
         return miss_ratio
     except Exception:
-        logging.warning(f"Traceback:\n", traceback.format_exc())
+        logging.warning(f"Traceback:\n{traceback.format_exc()}")
         return None
-    
-def tune_libcachesim(trace, alg, cache_cap, fixed_default_params: bool=False, tune_runs: int=20):
+
+def get_libcachesim_cost(cache_trace, cache_alg, cache_cap, params="", split: int=None):
+    '''
+    The cost (see `Telemetry.make_cost`) memoized with the miss ratio of a `run_libcachesim` call (or, with `split`, of a `run_libcachesim_warm` run).
+    The cachesim binary reports its throughput only, so its peak RSS, metadata size and evict scan are `None`.
+    Return: cost dict | `None` if not memoized
+    '''
+    cache_alg, params = _normalize_libcachesim_args(cache_alg, cache_cap, params)
+    return ResultCache.default().get_cost(**_get_libcachesim_result_cache_key(cache_trace, cache_alg, cache_cap, params, split))
+
+def _get_libcachesim_result_cache_key(cache_trace, cache_alg, cache_cap, params, split: int=None):
+    '''
+    `cache_alg` and `params` are normalized (see `_normalize_libcachesim_args`).
+    '''
+    return dict(
+        engine=ResultCache.libcachesim_engine,
+        engine_version=f"belady-{belady_version}" if cache_alg.lower() == "belady" else get_libcachesim_version(),
+        code=cache_alg,
+        params=params,
+        trace_path=cache_trace,
+        capacity=cache_cap,
+        extra=None if split == None else {"split": split},
+    )
+
+async def _run_cachesim_command_async(command, timeout: float=None):
+    '''
+    Same as `_run_cachesim_command`, as an asyncio subprocess killed after `timeout` seconds.
+    '''
+    process = await asyncio.create_subprocess_exec(*shlex.split(command), stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, start_new_session=True)
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        logging.warning(f"LibCacheSim Timeout ({timeout}s)\n\t[command] {command}")
+        raise
+    finally:
+        if process.returncode == None:
+            # timed out or cancelled: kill its children too, which would keep the pipes open
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            await process.wait()
+    stdout, stderr = stdout.decode(), stderr.decode()
+    if process.returncode != 0:
+        logging.warning(f"LibCacheSim Error\n\t[output] {stdout}\n\t[error] {stderr}")
+        raise ValueError
+    return stdout
+
+class LibCacheSimRunner:
+    '''
+    Run cachesim calls as asyncio subprocesses, at most `max_concurrency` (default: the available cores) at a time, each killed after `timeout` seconds (`None`: no limit).
+    Use it from a running event loop, e.g., `await runner.gather([(trace, alg, cap), ...])`; `run_libcachesim_many()` and `run_libcachesim_batch()` wrap it for synchronous callers.
+    Belady, and without a cachesim build every algorithm, run in process in worker threads, which are not subject to `timeout`.
+    '''
+    def __init__(self, max_concurrency: int=None, timeout: float=None, use_result_cache: bool=True):
+        from Scheduler import get_num_workers
+        self.max_concurrency = max_concurrency if max_concurrency != None else get_num_workers()
+        self.timeout = timeout
+        self.use_result_cache = use_result_cache
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def _run_command(self, command):
+        async with self._semaphore:
+            return await _run_cachesim_command_async(command, self.timeout)
+
+    async def run(self, cache_trace, cache_alg, cache_cap, params=""):
+        '''
+        Same as `run_libcachesim`.
+        Return: miss ratio | `None` if fail
+        '''
+        cache_alg, params = _normalize_libcachesim_args(cache_alg, cache_cap, params)
+        cache_key = _get_libcachesim_result_cache_key(cache_trace, cache_alg, cache_cap, params)
+        if self.use_result_cache == True:
+            miss_ratio = ResultCache.default().get(**cache_key)
+            if miss_ratio != None:
+                return miss_ratio
+        try:
+            if _is_in_process(cache_alg):
+                async with self._semaphore:
+                    mr_list, cost_list = await asyncio.to_thread(_run_in_process, cache_trace, [(cache_alg, cache_cap, params)])
+                miss_ratio, cost = mr_list[0], cost_list[0]
+            else:
+                stdout = await self._run_command(_get_cachesim_command(cache_trace, cache_alg, cache_cap, params))
+                result_lines = [l.strip() for l in stdout.split("\n") if len(l.strip()) > 0]
+                miss_ratio, cost = _parse_cachesim_miss_ratio(result_lines[-1]), _parse_cachesim_cost(result_lines[-1])
+        except Exception:
+            logging.warning(f"Traceback:\n{traceback.format_exc()}")
+            return None
+        if self.use_result_cache == True:
+            ResultCache.default().put(value=miss_ratio, cost=cost, **cache_key)
+        return miss_ratio
+
+    async def gather(self, calls: list):
+        '''
+        - calls: list of (cache_trace, cache_alg, cache_cap) or (cache_trace, cache_alg, cache_cap, params)
+        Return: the miss ratio of every call (`None` if fail), in order
+        '''
+        return await asyncio.gather(*[self.run(*call) for call in calls])
+
+    async def run_sweep(self, cache_trace, cache_alg_list, cache_cap_list):
+        '''
+        Miss ratios of every (algorithm, capacity) with the default params on one trace.
+        The runs that share the same cachesim arguments go through one cachesim call, i.e., one read of the trace. A run missing from its output is retried alone.
+        Return: {(cache_alg, cache_cap): miss ratio | `None` if fail}
+        '''
+        m_result = dict()
+        m_params_runs = collections.defaultdict(list) # normalized params -> [(cache_alg, cache_cap, normalized cache_alg)]
+        for cache_alg in cache_alg_list:
+            for cache_cap in cache_cap_list:
+                normalized_alg, params = _normalize_libcachesim_args(cache_alg, cache_cap, "")
+                if self.use_result_cache == True:
+                    miss_ratio = ResultCache.default().get(**_get_libcachesim_result_cache_key(cache_trace, normalized_alg, cache_cap, params))
+                    if miss_ratio != None:
+                        m_result[(cache_alg, cache_cap)] = miss_ratio
+                        continue
+                m_params_runs[params].append((cache_alg, cache_cap, normalized_alg))
+
+        async def run_group(params, runs):
+            normalized_alg_list = sorted(set([r[2] for r in runs]))
+            cap_list = sorted(set([r[1] for r in runs]))
+            try:
+                stdout = await self._run_command(_get_cachesim_command(cache_trace, ",".join(normalized_alg_list), ",".join([str(c) for c in cap_list]), params))
+                m_row = _match_cachesim_results(_parse_cachesim_results(stdout), normalized_alg_list, cap_list)
+            except Exception:
+                logging.warning(f"Traceback:\n{traceback.format_exc()}")
+                m_row = dict()
+            for (cache_alg, cache_cap, normalized_alg) in runs:
+                if (normalized_alg, cache_cap) not in m_row:
+                    m_result[(cache_alg, cache_cap)] = await self.run(cache_trace, cache_alg, cache_cap)
+                    continue
+                row = m_row[(normalized_alg, cache_cap)]
+                miss_ratio = row["mr"]
+                if self.use_result_cache == True:
+                    ResultCache.default().put(value=miss_ratio, cost=_get_cachesim_cost(row), **_get_libcachesim_result_cache_key(cache_trace, normalized_alg, cache_cap, params))
+                m_result[(cache_alg, cache_cap)] = miss_ratio
+
+        async def run_in_process(runs):
+            # one pass over the trace for every run, whatever its params
+            try:
+                async with self._semaphore:
+                    mr_list, cost_list = await asyncio.to_thread(_run_in_process, cache_trace, [(normalized_alg, cache_cap, params) for (_, cache_cap, normalized_alg, params) in runs])
+            except Exception:
+                logging.warning(f"Traceback:\n{traceback.format_exc()}")
+                mr_list, cost_list = [None for _ in runs], [None for _ in runs]
+            for ((cache_alg, cache_cap, normalized_alg, params), miss_ratio, cost) in zip(runs, mr_list, cost_list):
+                m_result[(cache_alg, cache_cap)] = miss_ratio
+                if miss_ratio != None and self.use_result_cache == True:
+                    ResultCache.default().put(value=miss_ratio, cost=cost, **_get_libcachesim_result_cache_key(cache_trace, normalized_alg, cache_cap, params))
+
+        in_process_runs = []
+        m_params_cachesim_runs = collections.defaultdict(list)
+        for params, group in m_params_runs.items():
+            for (cache_alg, cache_cap, normalized_alg) in group:
+                if not _is_in_process(normalized_alg):
+                    m_params_cachesim_runs[params].append((cache_alg, cache_cap, normalized_alg))
+                elif _has_in_process(normalized_alg):
+                    in_process_runs.append((cache_alg, cache_cap, normalized_alg, params))
+                else:
+                    logging.warning(f"No cachesim build nor in-process baseline for {cache_alg}")
+                    m_result[(cache_alg, cache_cap)] = None
+        tasks = [run_group(params, runs) for params, runs in m_params_cachesim_runs.items()]
+        if len(in_process_runs) > 0:
+            tasks.append(run_in_process(in_process_runs))
+        await asyncio.gather(*tasks)
+        return m_result
+
+def run_libcachesim_many(calls: list, max_concurrency: int=None, timeout: float=None, use_result_cache: bool=True):
+    '''
+    Run `run_libcachesim` calls concurrently, see `LibCacheSimRunner.gather`.
+    '''
+    if len(calls) == 0:
+        return []
+    runner = LibCacheSimRunner(max_concurrency=max_concurrency, timeout=timeout, use_result_cache=use_result_cache)
+    return asyncio.run(runner.gather(calls))
+
+def run_libcachesim_warm(full_trace, prefix_trace, cache_alg, cache_cap, params_list: list, use_result_cache: bool=True):
+    '''
+    Replay `full_trace`, whose first requests are `prefix_trace` (e.g., the train split), with every params, and report the miss ratio of the prefix and of the rest separately: the rest is replayed on a warm cache.
+    In-process algorithms (see `_is_in_process`) do it in one pass. With cachesim, the suffix misses are the misses on the full trace minus those on `prefix_trace`, which cachesim reports to 4 decimals.
+    Return: a (prefix mr, suffix mr) pair for every params, `None` for each failed run
+    '''
+    num_requests = get_trace_length(full_trace)
+    split = get_trace_length(prefix_trace)
+    if not split < num_requests:
+        raise ValueError(f"{prefix_trace} is not a proper prefix of {full_trace}")
+    runs = [_normalize_libcachesim_args(cache_alg, cache_cap, params) for params in params_list]
+    if _is_in_process(cache_alg):
+        mr_list = [None for _ in runs]
+        cache_keys = [_get_libcachesim_result_cache_key(full_trace, alg, cache_cap, params, split) for (alg, params) in runs]
+        pending_ids = []
+        for i, cache_key in enumerate(cache_keys):
+            if use_result_cache == True:
+                mr_list[i] = ResultCache.default().get(**cache_key)
+            if mr_list[i] == None:
+                pending_ids.append(i)
+        if len(pending_ids) > 0:
+            try:
+                pending_mr_list, pending_cost_list = _simulate_in_process(load_trace_columns(full_trace), [(runs[i][0], cache_cap, runs[i][1]) for i in pending_ids], split)
+            except Exception:
+                logging.warning(f"Traceback:\n{traceback.format_exc()}")
+                pending_mr_list, pending_cost_list = [None for _ in pending_ids], [None for _ in pending_ids]
+            for i, mr, cost in zip(pending_ids, pending_mr_list, pending_cost_list):
+                mr_list[i] = mr
+                if mr != None and use_result_cache == True:
+                    ResultCache.default().put(value=mr, cost=cost, **cache_keys[i])
+        return [tuple(mr) if mr != None else None for mr in mr_list]
+    mr_list = run_libcachesim_many(
+        [(full_trace, cache_alg, cache_cap, params) for params in params_list] + [(prefix_trace, cache_alg, cache_cap, params) for params in params_list],
+        use_result_cache=use_result_cache
+    )
+    warm_mr_list = []
+    for params, full_mr, prefix_mr in zip(params_list, mr_list[:len(params_list)], mr_list[len(params_list):]):
+        if full_mr == None or prefix_mr == None:
+            warm_mr_list.append(None)
+            continue
+        suffix_mr = (full_mr * num_requests - prefix_mr * split) / (num_requests - split)
+        warm_mr_list.append((prefix_mr, round(min(max(suffix_mr, 0.0), 1.0), 4)))
+        if use_result_cache == True:
+            # the cost of the warm run is the one of the run on the full trace
+            alg, normalized_params = _normalize_libcachesim_args(cache_alg, cache_cap, params)
+            ResultCache.default().put(
+                value=warm_mr_list[-1],
+                cost=get_libcachesim_cost(full_trace, cache_alg, cache_cap, params),
+                **_get_libcachesim_result_cache_key(full_trace, alg, cache_cap, normalized_params, split)
+            )
+    return warm_mr_list
+
+def run_libcachesim_sweep(cache_trace, cache_alg_list, cache_cap_list, use_result_cache: bool=True, timeout: float=None):
+    '''
+    See `LibCacheSimRunner.run_sweep`.
+    '''
+    runner = LibCacheSimRunner(timeout=timeout, use_result_cache=use_result_cache)
+    return asyncio.run(runner.run_sweep(cache_trace, cache_alg_list, cache_cap_list))
+
+def run_libcachesim_batch(sweeps: list, use_result_cache: bool=True, max_concurrency: int=None, timeout: float=None):
+    '''
+    Run `run_libcachesim_sweep` on several traces concurrently.
+    - sweeps: list of (cache_trace, cache_alg_list, cache_cap_list)
+    Return: the result of every sweep, in order
+    '''
+    if len(sweeps) == 0:
+        return []
+    runner = LibCacheSimRunner(max_concurrency=max_concurrency, timeout=timeout, use_result_cache=use_result_cache)
+    async def run_all():
+        return await asyncio.gather(*[runner.run_sweep(*sweep) for sweep in sweeps])
+    return asyncio.run(run_all())
+
+def run_libcachesim_with_cost(cache_trace, cache_alg, cache_cap, params=""):
+    '''
+    Return: {"mr": miss ratio, "time_per_request": seconds} | `None` if fail. Costs are machine-dependent, so they are not memoized.
+    '''
+    cache_alg, params = _normalize_libcachesim_args(cache_alg, cache_cap, params)
+    try:
+        if _is_in_process(cache_alg):
+            columns = load_trace_columns(cache_trace)
+            start = time.perf_counter()
+            miss_ratio = _simulate_in_process(columns, [(cache_alg, cache_cap, params)])[0][0]
+            return {
+                "mr": miss_ratio,
+                "time_per_request": (time.perf_counter() - start) / max(len(columns), 1)
+            }
+        result_info = _run_cachesim(cache_trace, cache_alg, cache_cap, params)
+        return {
+            "mr": _parse_cachesim_miss_ratio(result_info),
+            "time_per_request": _parse_cachesim_time_per_request(result_info)
+        }
+    except Exception:
+        logging.warning(f"Traceback:\n{traceback.format_exc()}")
+        return None
+
+def tune_libcachesim(trace, alg, cache_cap, fixed_default_params: bool=False, tune_runs: int=20, warm_starter=None, optimizer: str="auto", need_default_run: bool=True):
     '''
+    Args:
+    - warm_starter (WarmStarter | None): seed the optimizer with prior results of `alg` on similar traces
+    - optimizer (str): tuning backend, see `Optimizers.optimizer_backends`
+    - need_default_run (bool): run the default params on `trace`; if not, default_mr is `None` and the tuned params are not compared with the default ones, which is left to the caller
     Return: default_mr, tuned_mr, default_params, tuned_params | `None`
     - `None`: fail to run libcachesim
     '''
-    # map: param_name -> type, default, lower, uppper/type, default, choice
+    m_trace_params = get_libcachesim_param_info(trace, cache_cap, fixed_default_params)
+
+    default_mr = None
+    if need_default_run == True:
+        default_mr = run_libcachesim(trace, alg, cache_cap)
+        if default_mr == None:
+            return None
+    
+    if alg not in m_trace_params:
+        return default_mr, default_mr, dict(), dict()
+    
+    default_params = {
+        p: v[1]
+        for p, v in m_trace_params[alg].items()
+    }
+    space = get_libcachesim_space(m_trace_params[alg])
+
+    def objective(params: dict):
+        miss_ratio = run_libcachesim(trace, alg, cache_cap, " -e " + libcachesim_params_to_str(alg, params))
+        if miss_ratio == None:
+            miss_ratio = 1.0
+        
+        return [miss_ratio]
+    
+    optimizer_kwargs = dict(
+        objective=objective,
+        space=space,
+        max_runs=tune_runs,
+        optimizer=optimizer,
+        num_objectives=1,
+        surrogate_type="prf"
+    )
+    if warm_starter != None:
+        optimizer_kwargs.update(warm_starter.get_optimizer_kwargs(trace, space, tune_runs))
+
+    tuned_mr = None
+    tuned_params = None
+    error_log = None
+    try:
+        history = minimize(**optimizer_kwargs)
+    except Exception as error:
+        error_log = f"Openbox Tuning Error: {repr(error)}\n" + traceback.format_exc()
+        logging.warning(error_log)
+        
+    
+    if error_log == None and len(history.get_incumbents()) > 0:
+        tuned_mr = history.get_incumbent_value()
+        tuned_params = dict(history.get_incumbent_configs()[0]).copy()
+
+    
+    if tuned_mr == None or (default_mr != None and tuned_mr > default_mr):
+        tuned_mr = default_mr
+        tuned_params = default_params
+
+    return default_mr, tuned_mr, default_params, tuned_params
+
+def get_libcachesim_param_info(trace, cache_cap, fixed_default_params: bool=False):
+    '''
+    Return: map: algo -> param_name -> [type, default, lower, upper] | [str, default, choices]
+    '''
     default_seg_num = 4
     if cache_cap <= default_seg_num:
         default_seg_num = 1
@@ -194,80 +722,83 @@ def tune_libcachesim(trace, alg, cache_cap, fixed_default_params: bool=False, tu
                     param[1] = 0.42
                 elif param[0] == bool:
                     param[1] = 1
+    return m_trace_params
 
-    default_mr = run_libcachesim(trace, alg, cache_cap)
-    if default_mr == None:
-        return None
-    
-    if alg not in m_trace_params:
-        return default_mr, default_mr, dict(), dict()
-    
-    default_params = {
-        p: v[1]
-        for p, v in m_trace_params[alg].items()
-    }
-        
+def get_libcachesim_space(param_info: dict):
     params_to_tune = []
-    for param_name, param_status in m_trace_params[alg].items():
+    for param_name, param_status in param_info.items():
         param_type = param_status[0]
         if param_type == int:
-            params_to_tune.append(sp.Int(name=param_name, lower=param_status[2], upper=param_status[3], default_value=param_status[1]))
+            params_to_tune.append(IntParam(name=param_name, lower=param_status[2], upper=param_status[3], default_value=param_status[1]))
         elif param_type == float:
-            params_to_tune.append(sp.Real(name=param_name, lower=param_status[2], upper=param_status[3], default_value=param_status[1]))
+            params_to_tune.append(RealParam(name=param_name, lower=param_status[2], upper=param_status[3], default_value=param_status[1]))
         elif param_type == str:
-            params_to_tune.append(sp.Categorical(name=param_name, choices=param_status[2], default_value=param_status[1]))
+            params_to_tune.append(CategoricalParam(name=param_name, choices=param_status[2], default_value=param_status[1]))
         else:
             raise ValueError('Unknown param type')
-    space = sp.Space()
-    space.add_variables(params_to_tune)
-
-    def objective(config_space: sp.Configuration):
-        params = dict(config_space).copy()
-        if alg == "fifomerge":
-            params["n-keep"] = max(params["n-exam"] // params["ratio"], 1)
-            del params["ratio"]
-        param_str = ""
-        for param_name, param_val in params.items():
-            if param_str != "":
-                param_str += ","
-            param_str += f"{param_name}={param_val}"
-
-        miss_ratio = run_libcachesim(trace, alg, cache_cap, " -e " + param_str)
-        if miss_ratio == None:
-            miss_ratio = 1.0
-        
-        return dict(objectives=[miss_ratio])
-    
-    opt = Optimizer(
-        objective_function=objective,
-        config_space=space,
-        num_objectives=1,
-        num_constraints=0,
-        max_runs=tune_runs,
-        surrogate_type="prf",
-        visualization="none"
-    )
+    return SearchSpace(params_to_tune)
 
-    tuned_mr = None
-    tuned_params = None
-    error_log = None
-    try:
-        history = opt.run()
-    except Exception as error:
-        error_log = f"Openbox Tuning Error: {repr(error)}\n" + traceback.format_exc()
-        logging.warning(error_log)
-        
-    
-    if error_log == None and len(history.get_incumbents()) > 0:
-        tuned_mr = history.get_incumbent_value()
-        tuned_params = dict(history.get_incumbent_configs()[0]).copy()
+def libcachesim_params_to_str(alg, params: dict):
+    params = params.copy()
+    if alg == "fifomerge":
+        params["n-keep"] = max(params["n-exam"] // params["ratio"], 1)
+        del params["ratio"]
+    param_str = ""
+    for param_name, param_val in params.items():
+        if param_str != "":
+            param_str += ","
+        param_str += f"{param_name}={param_val}"
+    return param_str
 
-    
-    if tuned_mr == None or tuned_mr > default_mr:
-        tuned_mr = default_mr
-        tuned_params = default_params
+def get_pareto_front(points: list, objective_keys: list):
+    '''
+    Args:
+    - points (List[dict]): each point has a value for every key in `objective_keys`, all to be minimized
+    Return: the non-dominated points, sorted by the first objective
+    '''
+    def dominates(p, q):
+        return all(p[k] <= q[k] for k in objective_keys) and any(p[k] < q[k] for k in objective_keys)
+    front = [p for p in points if not any(dominates(q, p) for q in points)]
+    return sorted(front, key=lambda p: tuple(p[k] for k in objective_keys))
 
-    return default_mr, tuned_mr, default_params, tuned_params
+def tune_libcachesim_multi_objective(trace, alg, cache_cap, fixed_default_params: bool=False, tune_runs: int=20, optimizer: str="auto"):
+    '''
+    Minimize miss ratio and time per request (from cachesim's reported throughput) jointly. cachesim does not report the metadata size.
+    Return: Pareto front (List[{"params", "mr", "time_per_request"}]), sorted by miss ratio | `None` if fail to run libcachesim
+    '''
+    objective_keys = ["mr", "time_per_request"]
+    m_trace_params = get_libcachesim_param_info(trace, cache_cap, fixed_default_params)
+    if alg not in m_trace_params:
+        cost = run_libcachesim_with_cost(trace, alg, cache_cap)
+        if cost == None:
+            return None
+        return [dict(params=dict(), **cost)]
+    space = get_libcachesim_space(m_trace_params[alg])
+
+    trials = []
+    def objective(params: dict):
+        cost = run_libcachesim_with_cost(trace, alg, cache_cap, " -e " + libcachesim_params_to_str(alg, params))
+        if cost == None:
+            # cachesim has no time limit: the slowest run so far, on the scale of the time per request of the successful runs
+            return [1.0, max([trial["time_per_request"] for trial in trials], default=1.0)]
+        trials.append(dict(params=params, **cost))
+        return [cost[k] for k in objective_keys]
+
+    try:
+        minimize(
+            objective=objective,
+            space=space,
+            max_runs=tune_runs,
+            optimizer=optimizer,
+            num_objectives=len(objective_keys),
+            surrogate_type="prf",
+            acq_type="parego"
+        )
+    except Exception as error:
+        logging.warning(f"Openbox Tuning Error: {repr(error)}\n" + traceback.format_exc())
+    if len(trials) == 0:
+        return None
+    return get_pareto_front(trials, objective_keys)
     
 def miss_ratio_reduction(mr, fifo_mr):
     assert mr != None
@@ -279,13 +810,41 @@ def miss_ratio_reduction(mr, fifo_mr):
     else:
         return (fifo_mr - mr) / fifo_mr
     
-def plot_mr(m_algo_mr: dict, png_path):
+def get_median_cost(cost_list: list, column: str):
+    '''
+    The median of a cost column (see `Telemetry.cost_columns`) over the runs whose cost is known, `None` if none is.
+    '''
+    values = [cost[column] for cost in cost_list if cost != None and cost.get(column) != None]
+    return float(np.median(values)) if len(values) > 0 else None
+
+def plot_mr(m_algo_mr: dict, png_path, m_algo_cost: dict=None, rank_by: str=None, max_cost: dict=None):
+    '''
+    Plot the percentiles of the miss ratio reduction from FIFO of every algorithm.
+    - m_algo_cost (dict | None): algo -> list of cost dicts (see `Telemetry.make_cost`), e.g., one per trace; needed to rank or filter by cost
+    - rank_by (str | None): order the algorithms by their mean miss ratio reduction ("mr", best first) or by the median of a cost column (cheapest first, unknown last); `None` keeps the order of `m_algo_mr`
+    - max_cost (dict | None): cost column -> bound: drop the algorithms whose median cost exceeds it or is unknown
+    '''
     markers = itertools.cycle("<^osv>v*p")
     colors = itertools.cycle(
         reversed(["#b2182b", "#ef8a62", "#fddbc7", "#d1e5f0", "#67a9cf", "#2166ac"])
     )
     algo_list = list(m_algo_mr.keys())
     assert "fifo" not in algo_list
+    if m_algo_cost == None:
+        m_algo_cost = dict()
+    if max_cost != None:
+        assert all([column in cost_columns for column in max_cost])
+        for column, bound in max_cost.items():
+            algo_list = [a for a in algo_list if get_median_cost(m_algo_cost.get(a, []), column) != None and get_median_cost(m_algo_cost.get(a, []), column) <= bound]
+    if rank_by == "mr":
+        algo_list.sort(key=lambda a: -np.mean(m_algo_mr[a]))
+    elif rank_by != None:
+        assert rank_by in cost_columns
+        median_costs = {a: get_median_cost(m_algo_cost.get(a, []), rank_by) for a in algo_list}
+        algo_list.sort(key=lambda a: (median_costs[a] == None, median_costs[a] if median_costs[a] != None else 0))
+    if len(algo_list) == 0:
+        logging.warning(f"No algorithm to plot in {png_path}")
+        return
     # plot
     plt.figure(figsize=(28, 8))
     percentiles = [10, 25, 50, 75, 90]